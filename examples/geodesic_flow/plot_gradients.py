@@ -26,8 +26,8 @@ import matplotlib.pyplot as plt
 
 N = 27
 
-print(hd.discrete_2d_gradient(3, 3, axis=0))
-print(hd.discrete_2d_gradient(3, 3, axis=1))
+print(hd.discrete_2d_gradient(3, 3, axis=0).toarray())
+print(hd.discrete_2d_gradient(3, 3, axis=1).toarray())
 
 # exit()
 circles = []
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019, University of Stuttgart
+# All rights reserved.
+#
+# Permission to use, copy, modify, and distribute this software for any purpose
+# with or without   fee is hereby granted, provided   that the above  copyright
+# notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS  SOFTWARE INCLUDING ALL  IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR  BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR  ANY DAMAGES WHATSOEVER RESULTING  FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION,   ARISING OUT OF OR IN    CONNECTION WITH THE USE   OR
+# PERFORMANCE OF THIS SOFTWARE.
+#
+#                                         Jim Mainprice on Wed January 22 2019
+
+from demos_common_imports import *
+import numpy as np
+from pyrieef.geometry.heat_diffusion import GeodesicDistanceField
+from pyrieef.geometry.workspace import *
+from pyrieef.rendering.workspace_planar import WorkspaceDrawer
+import matplotlib.pyplot as plt
+
+# Geodesic distance to three sources computed with the heat method,
+# the operators are factorized once and the sources solved as a batch.
+
+ROWS = 1
+COLS = 3
+
+circles = []
+circles.append(Circle(origin=[.1, .0], radius=0.1))
+circles.append(Circle(origin=[.1, .25], radius=0.05))
+circles.append(Circle(origin=[.2, .25], radius=0.05))
+circles.append(Circle(origin=[.0, .25], radius=0.05))
+
+workspace = Workspace()
+workspace.obstacles = circles
+renderer = WorkspaceDrawer(workspace, rows=ROWS, cols=COLS)
+sources = np.array([[0.2, 0.15], [-.3, -.3], [.3, -.2]])
+
+field = GeodesicDistanceField(workspace, nb_points=101)
+D = field.distances(sources)
+for i, source in enumerate(sources):
+    renderer.set_drawing_axis(i)
+    renderer.draw_ws_obstacles()
+    renderer.draw_ws_point(source, color='r', shape='o')
+    renderer.background_matrix_eval = False
+    renderer.draw_ws_img(np.where(np.isinf(D[i]), np.nan, D[i]),
+                         interpolate="none", color_style=plt.cm.tab20c)
+renderer.show()
@@ -58,15 +58,14 @@ f.X = [X_data, X_data]
 f.Y = [Y1, Y2]
 f.D = [np.eye(2), np.eye(2)]
 f.ridge_lambda = [.1, .1]
+f.weight_threshold = 1e-4  # neglect the data points further away
 
-# Querries the regressed function f
+# Querries the regressed function f on all points at once
 # And then draws the interolated field in red and original points in black
 X_int, Y_int = workspace.box.meshgrid(30)
-U_int, V_int = np.zeros(X_int.shape), np.zeros(Y_int.shape)
-for i, j in itertools.product(range(X_int.shape[0]), range(X_int.shape[1])):
-    g = f(np.array([X_int[i, j], Y_int[i, j]]))
-    U_int[i, j] = g[0]
-    V_int[i, j] = g[1]
+G = f.forward_batch(np.vstack([X_int.ravel(), Y_int.ravel()]).T)
+U_int = G[:, 0].reshape(X_int.shape)
+V_int = G[:, 1].reshape(Y_int.shape)
 
 renderer = WorkspaceDrawer(workspace)
 renderer.set_drawing_axis(i)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2018, University of Stuttgart
+# All rights reserved.
+#
+# Permission to use, copy, modify, and distribute this software for any purpose
+# with or without   fee is hereby granted, provided   that the above  copyright
+# notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS  SOFTWARE INCLUDING ALL  IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR  BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR  ANY DAMAGES WHATSOEVER RESULTING  FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION,   ARISING OUT OF OR IN    CONNECTION WITH THE USE   OR
+# PERFORMANCE OF THIS SOFTWARE.
+#
+#                                        Jim Mainprice on Sunday June 13 2018
+
+from demos_common_imports import *
+import numpy as np
+from pyrieef.graph.shortest_path import *
+from pyrieef.graph.dstar_lite import *
+from pyrieef.geometry.workspace import *
+from pyrieef.motion.cost_terms import *
+import time
+
+# Compares repairing the shortest path with D* Lite against rerunning
+# Dijkstra from scratch when a square patch of the costmap changes,
+# for increasing fractions of changed cells.
+
+nb_points = 100
+nb_trials = 20
+fractions = [.001, .005, .01, .05, .1, .25]
+average_cost = True
+
+workspace = Workspace()
+workspace.obstacles.append(Circle(np.array([0.1, 0.1]), .1))
+workspace.obstacles.append(Circle(np.array([-.2, -.1]), .15))
+phi = CostGridPotential2D(
+    SignedDistanceWorkspaceMap(workspace), 10., .1, 10.)
+costmap = phi(workspace.box.stacked_meshgrid(nb_points)).T
+s, t = (5, 5), (nb_points - 5, nb_points - 5)
+
+converter = CostmapToSparseGraph(costmap, average_cost)
+converter.convert()
+planner = DStarLite(costmap, average_cost)
+time_0 = time.time()
+planner.shortest_path(s[0], s[1], t[0], t[1])
+print("initial search : {} expansions, {:.2f} ms".format(
+    planner.nb_expansions, 1000. * (time.time() - time_0)))
+
+np.random.seed(0)
+print("{:>10} {:>15} {:>15} {:>12}".format(
+    "fraction", "dijkstra (ms)", "d* lite (ms)", "expansions"))
+for fraction in fractions:
+    width = max(1, int(round(np.sqrt(fraction) * nb_points)))
+    t_dijkstra, t_dstar, nb_expansions = 0., 0., 0
+    for _ in range(nb_trials):
+        i, j = np.random.randint(nb_points - width, size=2)
+        cells = np.stack(np.meshgrid(
+            np.arange(i, i + width), np.arange(j, j + width)), -1)
+        new_costmap = costmap.copy()
+        new_costmap[i:i + width, j:j + width] *= np.random.uniform(
+            .5, 4., size=(width, width))
+
+        time_0 = time.time()
+        converter.dijkstra_on_map(new_costmap, s[0], s[1], t[0], t[1])
+        t_dijkstra += time.time() - time_0
+
+        planner.nb_expansions = 0
+        time_0 = time.time()
+        planner.shortest_path_on_map(
+            new_costmap, s[0], s[1], t[0], t[1], cells)
+        t_dstar += time.time() - time_0
+        nb_expansions += planner.nb_expansions
+
+        # go back to the original costmap for the next trial
+        planner.shortest_path_on_map(costmap, s[0], s[1], t[0], t[1], cells)
+    print("{:10.3f} {:15.2f} {:15.2f} {:12.0f}".format(
+        float(width ** 2) / nb_points ** 2,
+        1000. * t_dijkstra / nb_trials,
+        1000. * t_dstar / nb_trials,
+        float(nb_expansions) / nb_trials))
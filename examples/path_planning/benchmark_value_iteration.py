@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020, University of Stuttgart
+# All rights reserved.
+#
+# Permission to use, copy, modify, and distribute this software for any purpose
+# with or without   fee is hereby granted, provided   that the above  copyright
+# notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS  SOFTWARE INCLUDING ALL  IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR  BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR  ANY DAMAGES WHATSOEVER RESULTING  FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION,   ARISING OUT OF OR IN    CONNECTION WITH THE USE   OR
+# PERFORMANCE OF THIS SOFTWARE.
+#
+#                                        Jim Mainprice on Wed February 12 2019
+
+from demos_common_imports import *
+import numpy as np
+from pyrieef.planning.mdp import GridMDP
+from pyrieef.planning.algorithms import value_iteration
+import itertools
+import time
+
+# Counts the Bellman backups needed by the value iteration variants
+# to reach epsilon on random mazes, the error is measured against
+# the utilities obtained with a tight epsilon. With a large step cost
+# all utilities have to decrease from their initial value of zero,
+# with a small one mostly the states leading to the goal are updated.
+
+sizes = [5, 10, 20]
+step_rewards = [-.04, -.001]
+epsilon = 1e-3
+gamma = .99
+methods = ["sparse", "gauss_seidel", "prioritized"]
+
+
+def maze(n, step_reward):
+    """ Random maze of n x n cells carved by a depth first search,
+        walls are NaN, the goal is at the bottom right corner """
+    grid = np.full((2 * n + 1, 2 * n + 1), np.nan)
+    visited = np.zeros((n, n), dtype=bool)
+    stack = [(0, 0)]
+    visited[0, 0] = True
+    grid[1, 1] = step_reward
+    while stack:
+        i, j = stack[-1]
+        neighbors = [(i + di, j + dj) for di, dj in
+                     [(-1, 0), (1, 0), (0, -1), (0, 1)]
+                     if 0 <= i + di < n and 0 <= j + dj < n and
+                     not visited[i + di, j + dj]]
+        if not neighbors:
+            stack.pop()
+            continue
+        k, l = neighbors[np.random.randint(len(neighbors))]
+        visited[k, l] = True
+        grid[i + k + 1, j + l + 1] = step_reward
+        grid[2 * k + 1, 2 * l + 1] = step_reward
+        stack.append((k, l))
+    grid[2 * n - 1, 2 * n - 1] = 1.
+    return GridMDP(grid, terminals=[(2 * n - 1, 1)], gamma=gamma)
+
+
+np.random.seed(0)
+print("{:>6} {:>6} {:>8} {:>14} {:>12} {:>10} {:>10}".format(
+    "reward", "size", "states", "method", "backups", "time (s)", "error"))
+for step_reward, n in itertools.product(step_rewards, sizes):
+    mdp = maze(n, step_reward)
+    U_star = value_iteration(mdp, 1e-10, method="sparse")
+    for method in methods:
+        time_0 = time.time()
+        U, backups = value_iteration(
+            mdp, epsilon, method=method, return_backups=True)
+        t = time.time() - time_0
+        error = max(abs(U[s] - U_star[s]) for s in mdp.states)
+        print("{:>6} {:>6} {:>8} {:>14} {:>12} {:>10.3f} {:>10.2e}".format(
+            step_reward, n, len(mdp.states), method, backups, t, error))
@@ -23,7 +23,7 @@ from pyrieef.geometry.workspace import *
 from pyrieef.geometry.interpolation import *
 from pyrieef.rendering.workspace_planar import WorkspaceDrawer
 from pyrieef.planning.mdp import GridMDP
-from pyrieef.planning.mdp import value_iteration
+from pyrieef.planning.algorithms import value_iteration
 import matplotlib.pyplot as plt
 import itertools
 
@@ -40,8 +40,8 @@ reward = np.where(occupany > 0, -10., -.001)
 reward[0, 0] = 10
 
 # Calculate value function using value iteration
-mdp = GridMDP(reward.tolist(), terminals=[(0, 0)])
-X = value_iteration(mdp)
+mdp = GridMDP(reward, terminals=[(0, 0)])
+X = value_iteration(mdp, method="sparse")
 value = np.zeros(reward.shape)
 for x in X:
     value[x] = X[x]
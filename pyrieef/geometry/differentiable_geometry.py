@@ -20,6 +20,7 @@
 import numpy as np
 import copy
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 
 class DifferentiableMap:
@@ -77,6 +78,69 @@ class DifferentiableMap:
         J = self.jacobian(q)
         return [x, J]
 
+    def forward_batch(self, X):
+        """ Evaluates the map on N points stacked row-wise
+                X : N x n (points x input dimension)
+            returns an array of dimension N x m. The default implementation
+            loops over the points, maps that can be evaluated with
+            array operations should override this method. """
+        X = _as_batch(X, self.input_dimension())
+        m = self.output_dimension()
+        Y = np.empty((X.shape[0], m))
+        for i, x in enumerate(X):
+            Y[i] = np.asarray(self.forward(x)).reshape(m)
+        return Y
+
+    def jacobian_batch(self, X):
+        """ Evaluates the jacobian on N points stacked row-wise
+                X : N x n (points x input dimension)
+            returns an array of dimension N x m x n.
+            The default implementation loops over the points. """
+        X = _as_batch(X, self.input_dimension())
+        m, n = self.output_dimension(), self.input_dimension()
+        J = np.empty((X.shape[0], m, n))
+        for i, x in enumerate(X):
+            J[i] = np.asarray(self.jacobian(x)).reshape(m, n)
+        return J
+
+    def hessian_batch(self, X):
+        """ Evaluates the hessian on N points stacked row-wise
+                X : N x n (points x input dimension)
+            returns an array of dimension N x n x n, only defined
+            for functions (output dimension of one).
+            The default implementation loops over the points. """
+        assert self.output_dimension() == 1
+        X = _as_batch(X, self.input_dimension())
+        n = self.input_dimension()
+        H = np.empty((X.shape[0], n, n))
+        for i, x in enumerate(X):
+            H[i] = np.asarray(self.hessian(x)).reshape(n, n)
+        return H
+
+    def hessian_vector_product(self, q, v):
+        """ Returns the product of the hessian at q with the vector v,
+                v : n (input dimension)
+            as an array of dimension n. When the hessian is not implemented
+            the product is a difference of gradients along v, otherwise
+            the hessian is multiplied, maps that are sums or compositions
+            should override this method to never form the hessian. """
+        if type(self).hessian is DifferentiableMap.hessian:
+            return finite_difference_hessian_vector_product(self, q, v)
+        n = self.input_dimension()
+        return np.asarray(self.hessian(q)).reshape(n, n) @ np.ravel(v)
+
+    def hessian_vector_product_batch(self, X, V):
+        """ Hessian vector products on N points and vectors stacked row-wise
+                X, V : N x n (points x input dimension)
+            returns an array of dimension N x n. The default implementation
+            multiplies the batch of hessians when it is implemented, and
+            otherwise loops over the points. """
+        X = _as_batch(X, self.input_dimension())
+        if _has_batch(self, "hessian_batch"):
+            return np.einsum("nij,nj->ni", self.hessian_batch(X), V)
+        return np.array([self.hessian_vector_product(x, v)
+                         for x, v in zip(X, V)]).reshape(X.shape)
+
 
 class Compose(DifferentiableMap):
 
@@ -135,7 +199,7 @@ class Compose(DifferentiableMap):
         J_f = self._f.jacobian(x)
         H_f = self._f.hessian(x)
         a_x = J_g.T * H_f * J_g
-        b_x = J_f * np.ones(self.input_dimension()) * H_g
+        b_x = np.asarray(J_f).item() * H_g
         return a_x + b_x
 
     def evaluate(self, q):
@@ -147,6 +211,56 @@ class Compose(DifferentiableMap):
         J = J_f * self._g.jacobian(q)
         return [y, J]
 
+    def forward_batch(self, X):
+        return self._f.forward_batch(self._g.forward_batch(X))
+
+    def jacobian_batch(self, X):
+        """ J_f(g(x_i)) J_g(x_i) for all points """
+        J_f = self._f.jacobian_batch(self._g.forward_batch(X))
+        return np.matmul(J_f, self._g.jacobian_batch(X))
+
+    def hessian_batch(self, X):
+        """  J_g' H_f J_g + J_f H_g for all points,
+             only implemented when g is a function (H_g is n x n). """
+        assert self._g.output_dimension() == 1
+        Y = self._g.forward_batch(X)
+        J_g = self._g.jacobian_batch(X)
+        J_f = self._f.jacobian_batch(Y)
+        H_f = self._f.hessian_batch(Y)
+        H_g = self._g.hessian_batch(X)
+        a_x = np.matmul(np.swapaxes(J_g, 1, 2), np.matmul(H_f, J_g))
+        b_x = J_f[:, :, 0, np.newaxis] * H_g
+        return a_x + b_x
+
+    def hessian_vector_product(self, q, v):
+        """  J_g' H_f J_g v + sum_i (J_f)_i H_g_i v, where H_g_i are the
+             hessians of the outputs of g, the hessians are never formed.
+             The second term is a difference of J_g' J_f' along v when g
+             is not a function. WARNING: f has to be a function. """
+        x = np.atleast_1d(self._g(q))
+        v = np.ravel(v)
+        J_g = np.asarray(self._g.jacobian(q)).reshape(x.size, v.size)
+        J_f = np.asarray(self._f.jacobian(x)).ravel()
+        Hv = J_g.T @ self._f.hessian_vector_product(x, J_g @ v)
+        if self._g.output_dimension() == 1:
+            return Hv + J_f.item() * self._g.hessian_vector_product(q, v)
+        return Hv + _directional_difference(
+            lambda p: np.asarray(self._g.jacobian(p)).T @ J_f, q, v)
+
+    def hessian_vector_product_batch(self, X, V):
+        """ J_g' H_f J_g v + sum_i (J_f)_i H_g_i v for all points """
+        Y = self._g.forward_batch(X)
+        J_g = self._g.jacobian_batch(X)
+        J_f = self._f.jacobian_batch(Y)[:, 0, :]
+        W = self._f.hessian_vector_product_batch(
+            Y, np.einsum("nij,nj->ni", J_g, V))
+        Hv = np.einsum("nij,ni->nj", J_g, W)
+        if self._g.output_dimension() == 1:
+            return Hv + J_f * self._g.hessian_vector_product_batch(X, V)
+        return Hv + _directional_difference(
+            lambda P: np.einsum(
+                "nij,ni->nj", self._g.jacobian_batch(P), J_f), X, V)
+
 
 class Pullback(Compose):
 
@@ -176,6 +290,26 @@ class Pullback(Compose):
         # print("J_g :", J_g.shape)
         return J_g.T * H_f * J_g
 
+    def hessian_batch(self, X):
+        """ J_g' H_f J_g for all points """
+        J_g = self._g.jacobian_batch(X)
+        H_f = self._f.hessian_batch(self._g.forward_batch(X))
+        return np.matmul(np.swapaxes(J_g, 1, 2), np.matmul(H_f, J_g))
+
+    def hessian_vector_product(self, q, v):
+        """ J_g' H_f J_g v (Gauss-Newton), H_f is never formed """
+        x = np.atleast_1d(self._g(q))
+        v = np.ravel(v)
+        J_g = np.asarray(self._g.jacobian(q)).reshape(x.size, v.size)
+        return J_g.T @ self._f.hessian_vector_product(x, J_g @ v)
+
+    def hessian_vector_product_batch(self, X, V):
+        """ J_g' H_f J_g v for all points """
+        J_g = self._g.jacobian_batch(X)
+        W = self._f.hessian_vector_product_batch(
+            self._g.forward_batch(X), np.einsum("nij,nj->ni", J_g, V))
+        return np.einsum("nij,ni->nj", J_g, W)
+
 
 class Scale(DifferentiableMap):
     """ Scales a function by a constant """
@@ -199,6 +333,21 @@ class Scale(DifferentiableMap):
     def hessian(self, q):
         return self._alpha * self._f.hessian(q)
 
+    def forward_batch(self, X):
+        return self._alpha * self._f.forward_batch(X)
+
+    def jacobian_batch(self, X):
+        return self._alpha * self._f.jacobian_batch(X)
+
+    def hessian_batch(self, X):
+        return self._alpha * self._f.hessian_batch(X)
+
+    def hessian_vector_product(self, q, v):
+        return self._alpha * self._f.hessian_vector_product(q, v)
+
+    def hessian_vector_product_batch(self, X, V):
+        return self._alpha * self._f.hessian_vector_product_batch(X, V)
+
 
 class SumOfTerms(DifferentiableMap):
     """ Sums n differentiable maps """
@@ -227,6 +376,22 @@ class SumOfTerms(DifferentiableMap):
     def hessian(self, q):
         return sum(f.hessian(q) for f in self._functions)
 
+    def forward_batch(self, X):
+        return sum(f.forward_batch(X) for f in self._functions)
+
+    def jacobian_batch(self, X):
+        return sum(f.jacobian_batch(X) for f in self._functions)
+
+    def hessian_batch(self, X):
+        return sum(f.hessian_batch(X) for f in self._functions)
+
+    def hessian_vector_product(self, q, v):
+        return sum(f.hessian_vector_product(q, v) for f in self._functions)
+
+    def hessian_vector_product_batch(self, X, V):
+        return sum(f.hessian_vector_product_batch(X, V)
+                   for f in self._functions)
+
 
 class RangeSubspaceMap(DifferentiableMap):
     """ Takes only some outputs """
@@ -252,6 +417,17 @@ class RangeSubspaceMap(DifferentiableMap):
         assert self.output_dimension() == 1
         return np.matrix(np.zeros((self._dim, self._dim)))
 
+    def forward_batch(self, X):
+        return _as_batch(X, self._dim)[:, self._indices]
+
+    def jacobian_batch(self, X):
+        J = np.eye(self._dim)[self._indices, :]
+        return np.broadcast_to(J, (len(X),) + J.shape).copy()
+
+    def hessian_batch(self, X):
+        assert self.output_dimension() == 1
+        return np.zeros((len(X), self._dim, self._dim))
+
 
 class CombinedOutputMap(DifferentiableMap):
     """ creates a combination of the maps
@@ -287,6 +463,12 @@ class CombinedOutputMap(DifferentiableMap):
             idx += m.output_dimension()
         return J_phi
 
+    def forward_batch(self, X):
+        return np.hstack([m.forward_batch(X) for m in self._maps])
+
+    def jacobian_batch(self, X):
+        return np.concatenate([m.jacobian_batch(X) for m in self._maps], 1)
+
 
 class ProductFunction(DifferentiableMap):
     """Take the product of functions"""
@@ -336,6 +518,26 @@ class ProductFunction(DifferentiableMap):
 
         return v1 * H2 + v2 * H1 + np.outer(g1, g2) + np.outer(g2, g1)
 
+    def forward_batch(self, X):
+        return self._g.forward_batch(X) * self._h.forward_batch(X)
+
+    def jacobian_batch(self, X):
+        v1 = self._g.forward_batch(X)[:, :, np.newaxis]
+        v2 = self._h.forward_batch(X)[:, :, np.newaxis]
+        J1 = self._g.jacobian_batch(X)
+        J2 = self._h.jacobian_batch(X)
+        return v1 * J2 + v2 * J1
+
+    def hessian_batch(self, X):
+        v1 = self._g.forward_batch(X)[:, :, np.newaxis]
+        v2 = self._h.forward_batch(X)[:, :, np.newaxis]
+        H1 = self._g.hessian_batch(X)
+        H2 = self._h.hessian_batch(X)
+        g1 = self._g.jacobian_batch(X)
+        g2 = self._h.jacobian_batch(X)
+        g1_g2 = np.matmul(np.swapaxes(g1, 1, 2), g2)
+        return v1 * H2 + v2 * H1 + g1_g2 + np.swapaxes(g1_g2, 1, 2)
+
 
 class AffineMap(DifferentiableMap):
     """Simple map of the form: f(x)=ax + b"""
@@ -366,6 +568,19 @@ class AffineMap(DifferentiableMap):
         return np.matrix(np.zeros((
             self.input_dimension(), self.input_dimension())))
 
+    def forward_batch(self, X):
+        X = _as_batch(X, self.input_dimension())
+        return np.dot(X, np.asarray(self._a).T) + np.asarray(self._b).T
+
+    def jacobian_batch(self, X):
+        a = np.asarray(self._a)
+        return np.broadcast_to(a, (len(X),) + a.shape).copy()
+
+    def hessian_batch(self, X):
+        assert self.output_dimension() == 1
+        n = self.input_dimension()
+        return np.zeros((len(X), n, n))
+
 
 class QuadricFunction(DifferentiableMap):
     """ Here we implement a quadric funciton of the form:
@@ -388,9 +603,8 @@ class QuadricFunction(DifferentiableMap):
 
     def forward(self, x):
         x_tmp = np.matrix(x.reshape(self._b.size, 1))
-        v = np.asscalar(
-            .5 * x_tmp.T * self._a * x_tmp + self._b.T * x_tmp + self._c)
-        return v
+        v = .5 * x_tmp.T * self._a * x_tmp + self._b.T * x_tmp + self._c
+        return v.item()
 
     def jacobian(self, x):
         x_tmp = np.matrix(x.reshape(self._b.size, 1))
@@ -404,6 +618,22 @@ class QuadricFunction(DifferentiableMap):
         else:
             return 0.5 * (self._a + self._a.T)
 
+    def forward_batch(self, X):
+        X = _as_batch(X, self.input_dimension())
+        a, b = np.asarray(self._a), np.asarray(self._b).ravel()
+        v = .5 * np.einsum('ij,jk,ik->i', X, a, X) + np.dot(X, b) + self._c
+        return v.reshape(len(X), 1)
+
+    def jacobian_batch(self, X):
+        X = _as_batch(X, self.input_dimension())
+        H = np.asarray(self.hessian(None))
+        g = np.dot(X, H.T) + np.asarray(self._b).ravel()
+        return g[:, np.newaxis, :]
+
+    def hessian_batch(self, X):
+        H = np.asarray(self.hessian(None))
+        return np.broadcast_to(H, (len(X),) + H.shape).copy()
+
 
 class ExpTestFunction(DifferentiableMap):
     """ Test function that can be evaluated on a grid """
@@ -484,6 +714,17 @@ class IdentityMap(DifferentiableMap):
         assert self.output_dimension() == 1
         return np.matrix(np.zeros((self._dim, self._dim)))
 
+    def forward_batch(self, X):
+        return np.array(_as_batch(X, self._dim))
+
+    def jacobian_batch(self, X):
+        return np.broadcast_to(
+            np.eye(self._dim), (len(X), self._dim, self._dim)).copy()
+
+    def hessian_batch(self, X):
+        assert self.output_dimension() == 1
+        return np.zeros((len(X), self._dim, self._dim))
+
 
 class ZeroMap(DifferentiableMap):
     """Simple zero map : f(x)=0"""
@@ -508,6 +749,16 @@ class ZeroMap(DifferentiableMap):
         assert self.output_dimension() == 1
         return np.matrix(np.zeros((self._n, self._n)))
 
+    def forward_batch(self, X):
+        return np.zeros((len(X), self._m))
+
+    def jacobian_batch(self, X):
+        return np.zeros((len(X), self._m, self._n))
+
+    def hessian_batch(self, X):
+        assert self.output_dimension() == 1
+        return np.zeros((len(X), self._n, self._n))
+
 
 class SquaredNorm(DifferentiableMap):
     """ Simple squared norm : f(x)= | x - x_0 | ^2 """
@@ -533,6 +784,18 @@ class SquaredNorm(DifferentiableMap):
         assert self.output_dimension() == 1
         return np.matrix(np.eye(self.x_0.size, self.x_0.size))
 
+    def forward_batch(self, X):
+        delta_x = _as_batch(X, self.x_0.size) - self.x_0
+        return .5 * np.sum(delta_x ** 2, axis=1).reshape(len(X), 1)
+
+    def jacobian_batch(self, X):
+        delta_x = _as_batch(X, self.x_0.size) - self.x_0
+        return delta_x[:, np.newaxis, :]
+
+    def hessian_batch(self, X):
+        n = self.x_0.size
+        return np.broadcast_to(np.eye(n), (len(X), n, n)).copy()
+
 
 class Norm(DifferentiableMap):
     """
@@ -642,6 +905,22 @@ class SoftMax(DifferentiableMap):
         s = self.forward(q)
         return self._gamma * (np.diag(s) - np.outer(s, s))
 
+    def _softmax_batch(self, X):
+        z = self._gamma * _as_batch(X, self._n)
+        z = np.exp(z - np.max(z, axis=1, keepdims=True))
+        return z / np.sum(z, axis=1, keepdims=True)
+
+    def _softmax_jacobian_batch(self, X):
+        s = self._softmax_batch(X)
+        diag_s = s[:, :, np.newaxis] * np.eye(self._n)
+        return self._gamma * (diag_s - s[:, :, np.newaxis] * s[:, np.newaxis])
+
+    def forward_batch(self, X):
+        return self._softmax_batch(X)
+
+    def jacobian_batch(self, X):
+        return self._softmax_jacobian_batch(X)
+
 
 class LogSumExp(SoftMax):
     """ Log of softmax (smooth max)
@@ -671,6 +950,19 @@ class LogSumExp(SoftMax):
         M = p_inv * np.diag(z) - (p_inv ** 2) * np.outer(z, z)
         return self._gamma * M
 
+    def forward_batch(self, X):
+        """ shifts by the max for numerical stability """
+        z = self._gamma * _as_batch(X, self._n)
+        z_max = np.max(z, axis=1, keepdims=True)
+        log_sum = np.log(np.sum(np.exp(z - z_max), axis=1, keepdims=True))
+        return (1. / self._gamma) * (z_max + log_sum)
+
+    def jacobian_batch(self, X):
+        return self._softmax_batch(X)[:, np.newaxis, :]
+
+    def hessian_batch(self, X):
+        return self._softmax_jacobian_batch(X)
+
 
 class Sigmoid(DifferentiableMap):
     """
@@ -832,42 +1124,119 @@ class MakeDifferentiableMap(DifferentiableMap):
         return np.array(self._g(x))
 
 
-def finite_difference_jacobian(f, q):
+def _as_batch(X, n):
+    """ Makes sure X is an array of N points of dimension n (N x n) """
+    X = np.asarray(X)
+    assert X.ndim == 2 and X.shape[1] == n
+    return X
+
+
+def _has_batch(f, method):
+    """ True if f overrides the batched evaluation of DifferentiableMap """
+    return (isinstance(f, DifferentiableMap) and
+            getattr(type(f), method) is not getattr(DifferentiableMap, method))
+
+
+def _thread_pool():
+    """ Thread pool shared by the finite differences """
+    global _FINITE_DIFFERENCE_POOL
+    if _FINITE_DIFFERENCE_POOL is None:
+        _FINITE_DIFFERENCE_POOL = ThreadPoolExecutor()
+    return _FINITE_DIFFERENCE_POOL
+
+
+_FINITE_DIFFERENCE_POOL = None
+
+
+def _finite_difference(f, q, dt, method, evaluate, evaluate_batch, m):
+    """
+    Central (or complex step) differences of the function evaluate
+    (f.forward or f.gradient) with m outputs, returns an m x n array
+    """
+    n = q.size
+    if dt is None:
+        dt = 1e-20 if method == "complex" else 1e-4
+    if method == "complex":
+        Q = [q.astype(complex) for j in range(n)]
+        for j in range(n):
+            Q[j].flat[j] += 1j * dt
+        if _has_batch(f, evaluate_batch):
+            Y = getattr(f, evaluate_batch)(np.array(Q).reshape(n, n))
+        else:
+            Y = [getattr(f, evaluate)(q_j) for q_j in Q]
+        if not all(np.iscomplexobj(y) for y in Y):
+            # e.g., the map writes into float buffers or calls np.abs
+            raise ValueError(
+                "The complex step was dropped by the evaluation, "
+                "the map is not complex safe (use method='central')")
+        Y = np.array([np.asarray(y).reshape(m) for y in Y])
+        return np.imag(Y).T / dt
+    if method not in ["central", "threads"]:
+        raise ValueError("Unknown finite difference method : " + str(method))
+
+    # all perturbed inputs, q + dt / 2 e_j followed by q - dt / 2 e_j
+    if method == "central" and _has_batch(f, evaluate_batch):
+        Q = np.asarray(q, dtype=float).reshape(1, n) + (
+            .5 * dt * np.vstack([np.eye(n), -np.eye(n)]))
+        Y = getattr(f, evaluate_batch)(Q).reshape(2 * n, m)
+    else:
+        Q = [q.astype(float) for j in range(2 * n)]
+        for j in range(n):
+            Q[j].flat[j] += .5 * dt
+            Q[n + j].flat[j] -= .5 * dt
+        if method == "threads":
+            Y = list(_thread_pool().map(getattr(f, evaluate), Q))
+        else:
+            Y = [getattr(f, evaluate)(q_j) for q_j in Q]
+        Y = np.array([np.asarray(y).reshape(m) for y in Y])
+    return (Y[:n] - Y[n:]).T / dt
+
+
+def _directional_difference(g, q, v, dt=1e-4):
+    """ Central difference of the function g at q along v,
+        the step is relative to the norm of v """
+    norm = np.linalg.norm(v)
+    if norm == 0:
+        return np.zeros(np.shape(g(q)))
+    h = dt / norm
+    return (g(q + .5 * h * v) - g(q - .5 * h * v)) / h
+
+
+def finite_difference_hessian_vector_product(f, q, v, dt=1e-4):
+    """ Difference of the gradients of f along v,
+        costs two gradient evaluations instead of 2n for the hessian """
+    q = np.asarray(q, dtype=float).ravel()
+    return _directional_difference(f.gradient, q, np.ravel(v), dt)
+
+
+def finite_difference_jacobian(f, q, dt=None, method="central"):
     """ Takes an object f that has a forward method returning
-    a numpy array when querried. """
+    a numpy array when querried.
+
+        dt : step size, 1e-4 by default (1e-20 for the complex step)
+        method : "central" evaluates the 2n perturbed inputs as one
+                 batch when f implements forward_batch,
+                 "threads" evaluates them in a thread pool and
+                 "complex" uses the complex step Im(f(q + i dt e_j)) / dt,
+                 which requires f to be complex analytic, a ValueError
+                 is raised when f returns real values. """
     assert q.size == f.input_dimension()
-    dt = 1e-4
-    dt_half = dt / 2.
-    J = np.zeros((
-        f.output_dimension(), f.input_dimension()))
-    for j in range(q.size):
-        q_up = copy.deepcopy(q)
-        q_up[j] += dt_half
-        x_up = f.forward(q_up)
-        q_down = copy.deepcopy(q)
-        q_down[j] -= dt_half
-        x_down = f.forward(q_down)
-        J[:, j] = (x_up - x_down) / dt
+    J = _finite_difference(
+        f, q, dt, method, "forward", "forward_batch", f.output_dimension())
     return np.matrix(J)
 
 
-def finite_difference_hessian(f, q):
+def finite_difference_hessian(f, q, dt=None, method="central"):
     """ Takes an object f that has a forward method returning
-    a numpy array when querried. """
+    a numpy array when querried.
+
+        dt : step size
+        method : see finite_difference_jacobian, the gradients are
+                 evaluated in batch when f implements jacobian_batch """
     assert q.size == f.input_dimension()
     assert f.output_dimension() == 1
-    dt = 1e-4
-    dt_half = dt / 2.
-    H = np.zeros((
-        f.input_dimension(), f.input_dimension()))
-    for j in range(q.size):
-        q_up = copy.deepcopy(q)
-        q_up[j] += dt_half
-        g_up = f.gradient(q_up)
-        q_down = copy.deepcopy(q)
-        q_down[j] -= dt_half
-        g_down = f.gradient(q_down)
-        H[:, j] = (g_up - g_down) / dt
+    H = _finite_difference(
+        f, q, dt, method, "gradient", "jacobian_batch", f.input_dimension())
     return np.matrix(H)
 
 
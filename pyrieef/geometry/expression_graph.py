@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2018, University of Stuttgart
+# All rights reserved.
+#
+# Permission to use, copy, modify, and distribute this software for any purpose
+# with or without   fee is hereby granted, provided   that the above  copyright
+# notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS  SOFTWARE INCLUDING ALL  IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR  BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR  ANY DAMAGES WHATSOEVER RESULTING  FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION,   ARISING OUT OF OR IN    CONNECTION WITH THE USE   OR
+# PERFORMANCE OF THIS SOFTWARE.
+#
+#                                        Jim Mainprice on Sunday June 13 2018
+
+import numpy as np
+from .differentiable_geometry import *
+from .differentiable_geometry import _as_batch
+
+# Methods that a subclass must inherit to be traced as its base class
+EVALUATION_METHODS = ["forward", "jacobian", "hessian",
+                      "forward_batch", "jacobian_batch", "hessian_batch"]
+
+
+def _is(f, cls):
+    """ True if f is an instance of cls which is evaluated as cls """
+    return isinstance(f, cls) and all(
+        getattr(type(f), m) is getattr(cls, m) for m in EVALUATION_METHODS)
+
+
+class _Node:
+    """ Operation of the plan on the outputs of other nodes
+
+        op : input, index, affine, scale, sum, product or map
+        dim : output dimension
+        linear : the output is affine in the input of the plan """
+
+    def __init__(self, op, children, dim, linear, params=None):
+        self.op = op
+        self.children = children
+        self.dim = dim
+        self.linear = linear
+        self.params = params
+        self.unique = op != "index" or np.unique(params).size == params.size
+
+
+class CompiledMap(DifferentiableMap):
+    """
+        Flat evaluation plan of a tree of differentiable maps
+
+        The tree is traced once into nodes in topological order:
+            - RangeSubspaceMap are folded into index arrays
+            - consecutive Scale, AffineMap and indices are merged
+            - identical sub-expressions are evaluated once
+        Other maps are leaves of the plan, evaluated with their batch
+        methods. Values are obtained by a forward pass and jacobians by a
+        reverse pass over the plan, so that the tree is not walked at each
+        evaluation. The hessian follows the chain rule of the tree, a
+        Pullback of a non linear map is kept as a leaf so that the
+        curvature of that map is still dropped.
+
+        The result is the one of the tree up to the rounding of the
+        merged constants. Scale maps by arrays are not folded, they are
+        leaves of the plan.
+        WARNING: the constants of the folded maps (scalars, matrices
+        and indices) are copied at compilation, call recompile() when
+        they are modified in place (the leaves are evaluated by
+        reference, see CliquesFunctionNetwork.invalidate).
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._n = f.input_dimension()
+        self._m = f.output_dimension()
+        self.recompile()
+
+    def recompile(self):
+        """ Traces the tree again, e.g., after changing its constants """
+        self._nodes = [_Node("input", [], self._n, True)]
+        self._keys = {}
+        self._compile(self._trace(self._f, 0))
+
+    def output_dimension(self):
+        return self._m
+
+    def input_dimension(self):
+        return self._n
+
+    def operations(self):
+        """ Returns the operations of the plan in evaluation order """
+        return [node.op for node in self._nodes]
+
+    def forward(self, q):
+        y = self.forward_batch(np.reshape(q, (1, self._n)))[0]
+        return y[0] if self._m == 1 else y
+
+    def jacobian(self, q):
+        return np.matrix(self.jacobian_batch(np.reshape(q, (1, self._n)))[0])
+
+    def hessian(self, q):
+        H = self.hessian_batch(np.reshape(q, (1, self._n)))[0]
+        return np.matrix(H)
+
+    def evaluate(self, q):
+        y, J, _ = self.value_grad_hess_batch(
+            np.reshape(q, (1, self._n)), hessian=False)
+        return [y[0][0] if self._m == 1 else y[0], np.matrix(J[0])]
+
+    def forward_batch(self, X):
+        return self.value_grad_hess_batch(X, True, False, False)[0]
+
+    def jacobian_batch(self, X):
+        return self.value_grad_hess_batch(X, False, True, False)[1]
+
+    def hessian_batch(self, X):
+        return self.value_grad_hess_batch(X, False, False, True)[2]
+
+    def value_grad_hess_batch(self, X, value=True, gradient=True,
+                              hessian=True):
+        """
+            Returns the values (N x m), jacobians (N x m x n) and hessians
+            (N x n x n) on N points from a single forward pass, the
+            quantities that are not requested are returned as None.
+        """
+        X = _as_batch(X, self._n)
+        V = self._forward(X)
+        J, H = None, None
+        if gradient or hessian:
+            W, jacobians = self._reverse(V)
+            if gradient:
+                J = W[0] if W[0] is not None else np.zeros(
+                    (len(X), self._m, self._n))
+            if hessian:
+                H = self._hessian(V, W, jacobians)
+        return V[-1] if value else None, J, H
+
+    def _forward(self, X):
+        """ Outputs of all nodes """
+        V = [X]
+        for node in self._nodes[1:]:
+            y = V[node.children[0]]
+            if node.op == "index":
+                y = y[:, node.params]
+            elif node.op == "affine":
+                A, b = node.params
+                y = np.dot(y, A.T) + b
+            elif node.op == "scale":
+                y = node.params * y
+            elif node.op == "sum":
+                y = sum(V[i] for i in node.children)
+            elif node.op == "product":
+                y = y * V[node.children[1]]
+            else:
+                y = node.params.forward_batch(y).reshape(len(X), node.dim)
+            V.append(y)
+        return V
+
+    def _reverse(self, V):
+        """ Adjoints of all nodes (N x m x dim), None when they do not
+            contribute to the output, and jacobians of the leaves """
+        N = len(V[0])
+        W = [None] * len(self._nodes)
+        W[-1] = np.broadcast_to(np.eye(self._m), (N, self._m, self._m))
+        jacobians = {}
+        for i in range(len(self._nodes) - 1, 0, -1):
+            node, W_i = self._nodes[i], W[i]
+            if W_i is None:
+                continue
+            c = node.children
+            if node.op == "index":
+                W_c = np.zeros((N, self._m, self._nodes[c[0]].dim))
+                if node.unique:
+                    W_c[:, :, node.params] = W_i
+                else:
+                    np.add.at(W_c, (slice(None), slice(None), node.params),
+                              W_i)
+                self._accumulate(W, c[0], W_c)
+            elif node.op == "affine":
+                self._accumulate(W, c[0], np.matmul(W_i, node.params[0]))
+            elif node.op == "scale":
+                self._accumulate(W, c[0], node.params * W_i)
+            elif node.op == "sum":
+                for j in c:
+                    self._accumulate(W, j, W_i)
+            elif node.op == "product":
+                self._accumulate(W, c[0], W_i * V[c[1]][:, np.newaxis, :])
+                self._accumulate(W, c[1], W_i * V[c[0]][:, np.newaxis, :])
+            else:
+                jacobians[i] = node.params.jacobian_batch(V[c[0]])
+                self._accumulate(W, c[0], np.matmul(W_i, jacobians[i]))
+        return W, jacobians
+
+    def _hessian(self, V, W, jacobians):
+        """ Sums the curvature of the leaves and products weighted by
+            their adjoints, pulled back by the jacobians of their inputs
+            (forward mode), only defined for functions. """
+        assert self._m == 1
+        N = len(V[0])
+        J = [None] * len(self._nodes)
+        J[0] = np.broadcast_to(np.eye(self._n), (N, self._n, self._n))
+        for i in self._tangent_nodes:
+            node = self._nodes[i]
+            c = node.children
+            if node.op == "index":
+                J[i] = J[c[0]][:, node.params, :]
+            elif node.op == "affine":
+                J[i] = np.matmul(node.params[0], J[c[0]])
+            elif node.op == "scale":
+                J[i] = node.params * J[c[0]]
+            elif node.op == "sum":
+                J[i] = sum(J[j] for j in c)
+            elif node.op == "product":
+                J[i] = (V[c[0]][:, :, np.newaxis] * J[c[1]] +
+                        V[c[1]][:, :, np.newaxis] * J[c[0]])
+            elif i in jacobians:
+                J[i] = np.matmul(jacobians[i], J[c[0]])
+            else:
+                J[i] = np.matmul(
+                    node.params.jacobian_batch(V[c[0]]), J[c[0]])
+        H = np.zeros((N, self._n, self._n))
+        for i, node in enumerate(self._nodes):
+            if W[i] is None or node.op not in ("map", "product"):
+                continue
+            w = W[i][:, 0, 0, np.newaxis, np.newaxis]
+            c = node.children
+            if node.op == "product":
+                H_i = np.matmul(np.swapaxes(J[c[0]], 1, 2), J[c[1]])
+                H += w * (H_i + np.swapaxes(H_i, 1, 2))
+                continue
+            H_f = w * node.params.hessian_batch(V[c[0]])
+            if c[0] in self._selections:
+                # the input of the leaf is a selection of the input
+                ids = self._selections[c[0]]
+                if self._nodes[c[0]].unique:
+                    H[:, ids[:, np.newaxis], ids] += H_f
+                else:
+                    np.add.at(H, (slice(None), ids[:, np.newaxis], ids), H_f)
+            else:
+                H += np.matmul(
+                    np.swapaxes(J[c[0]], 1, 2), np.matmul(H_f, J[c[0]]))
+        return H
+
+    @staticmethod
+    def _accumulate(W, i, W_i):
+        W[i] = W_i if W[i] is None else W[i] + W_i
+
+    def _trace(self, f, x):
+        """ Adds the nodes of f applied to the output of node x """
+        assert f.input_dimension() == self._nodes[x].dim
+        if _is(f, Scale) and np.ndim(f._alpha) == 0:
+            return self._scale(
+                self._trace(f._f, x), np.asarray(f._alpha).item())
+        if _is(f, SumOfTerms):
+            terms = [self._trace(g, x) for g in f._functions]
+            if len(terms) == 1:
+                return terms[0]
+            return self._add("sum", terms, f.output_dimension(), all(
+                self._nodes[i].linear for i in terms))
+        if _is(f, ProductFunction):
+            return self._add("product", [
+                self._trace(f._g, x), self._trace(f._h, x)], 1, False)
+        if _is(f, Pullback):
+            y = self._trace(f._g, x)
+            if not self._nodes[y].linear:
+                return self._leaf(f, x)
+            return self._trace(f._f, y)
+        if _is(f, Compose):
+            return self._trace(f._f, self._trace(f._g, x))
+        if _is(f, RangeSubspaceMap):
+            return self._index(x, np.asarray(f._indices, dtype=int))
+        if _is(f, AffineMap):
+            return self._affine(
+                x, np.asarray(f._a), np.asarray(f._b).ravel())
+        if _is(f, IdentityMap):
+            return x
+        return self._leaf(f, x)
+
+    def _leaf(self, f, x):
+        return self._add("map", [x], f.output_dimension(), False, f, id(f))
+
+    def _index(self, x, indices):
+        node = self._nodes[x]
+        if node.op == "index":
+            return self._index(node.children[0], node.params[indices])
+        if node.op == "affine":
+            A, b = node.params
+            return self._affine(node.children[0], A[indices], b[indices])
+        if np.array_equal(indices, np.arange(node.dim)):
+            return x
+        return self._add("index", [x], indices.size, node.linear,
+                         indices, indices.tobytes())
+
+    def _affine(self, x, A, b):
+        node = self._nodes[x]
+        if node.op == "affine":
+            A_x, b_x = node.params
+            return self._affine(node.children[0], A.dot(A_x), A.dot(b_x) + b)
+        if node.op == "index":
+            A_x = np.zeros((A.shape[0], self._nodes[node.children[0]].dim))
+            np.add.at(A_x.T, node.params, A.T)
+            return self._affine(node.children[0], A_x, b)
+        if node.op == "scale":
+            return self._affine(node.children[0], node.params * A, b)
+        return self._add("affine", [x], b.size, node.linear, (A, b),
+                         (A.shape, A.tobytes(), b.tobytes()))
+
+    def _scale(self, x, alpha):
+        node = self._nodes[x]
+        if node.op == "scale":
+            return self._scale(node.children[0], alpha * node.params)
+        if node.op == "affine":
+            A, b = node.params
+            return self._affine(node.children[0], alpha * A, alpha * b)
+        if np.all(np.asarray(alpha) == 1):
+            return x
+        return self._add("scale", [x], node.dim, node.linear, alpha, alpha)
+
+    def _add(self, op, children, dim, linear, params=None, key=None):
+        """ Adds a node unless the same operation is already in the plan """
+        key = (op, tuple(children), key)
+        if key not in self._keys:
+            self._nodes.append(_Node(op, children, dim, linear, params))
+            self._keys[key] = len(self._nodes) - 1
+        return self._keys[key]
+
+    def _compile(self, output):
+        """ Keeps the nodes the output depends on (the output is last,
+            children are always added before their parents) and the
+            nodes whose jacobians are needed by the hessian """
+        used = {0, output}
+        for i in range(output, 0, -1):
+            if i in used:
+                used.update(self._nodes[i].children)
+        order = sorted(used)
+        ids = {i: k for k, i in enumerate(order)}
+        nodes = []
+        for i in order:
+            node = self._nodes[i]
+            nodes.append(_Node(node.op, [ids[j] for j in node.children],
+                               node.dim, node.linear, node.params))
+        self._nodes = nodes
+        self._keys = None
+        self._selections = {0: np.arange(self._n)}
+        for i, node in enumerate(self._nodes):
+            if node.op == "index" and node.children[0] == 0:
+                self._selections[i] = node.params
+        tangent = set()
+        for node in self._nodes:
+            if node.op == "product":
+                tangent.update(node.children)
+            if node.op == "map" and node.children[0] not in self._selections:
+                tangent.update(node.children)
+        for i in range(len(self._nodes) - 1, 0, -1):
+            if i in tangent:
+                tangent.update(self._nodes[i].children)
+        tangent.discard(0)
+        self._tangent_nodes = sorted(tangent)
+
+
+def compile_map(f):
+    """ Traces the tree of the differentiable map f into a flat
+        evaluation plan (see CompiledMap) """
+    return CompiledMap(f)
@@ -25,7 +25,10 @@ from pyrieef.utils.misc import *
 # External
 import itertools
 from functools import reduce
-# import scipy
+from scipy import sparse
+from scipy import ndimage
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu, spsolve
 
 NB_POINTS = 20
 VERBOSE = False
@@ -60,48 +63,72 @@ def compare_with_kernel(u_t, t, workspace):
     return u_e
 
 
-def forward_euler_2d(dt, h, source_grid, iterations, occupancy):
+def forward_euler_2d_steps(dt, h, source_grid, iterations, occupancy,
+                           stride=None):
     """
-    Forward Euler Integration of the heat equation
+    Forward Euler Integration of the heat equation as a generator
 
         h : space discretization
         t : time discretization
+        stride : number of time steps between two frames
+                 (TIME_FACTOR by default)
+
+    Yields (t, u_t) every stride steps, iterations frames in total.
+    The grid is updated in place in two alternating buffers, so the
+    memory is constant and u_t is only valid until the next frame,
+    copy it to keep it (see forward_euler_2d).
     """
-    U = []
+    stride = TIME_FACTOR if stride is None else stride
     t = 0.
-    dh2 = h ** 2
-    # dt = dh2 * dh2 / (2 * (dh2 + dh2))
-    Zero = np.zeros((NB_POINTS, NB_POINTS))
-    u_t = Zero.copy()
-    u_0 = Zero.copy()
-    d = 1. / dh2
+    c = dt / (h ** 2)
+    free = (occupancy.T == 0).astype(float)
+    free[[0, -1], :] = 0.  # the border is never updated
+    free[:, [0, -1]] = 0.
+    u_0 = np.zeros((NB_POINTS, NB_POINTS))
+    u_t = np.zeros((NB_POINTS, NB_POINTS))
     u_0[source_grid[0], source_grid[1]] = 1.e4
-    u_0 = np.where(occupancy.T > 0, Zero, u_0)
-    for k in range(iterations * TIME_FACTOR):
+    u_0 *= (occupancy.T == 0)
+    for k in range(iterations * stride):
         if CONSTANT_SOURCE:
             u_0[source_grid[0], source_grid[1]] = 1.e4
         # Propagate with forward-difference in time
         # central-difference in space
         if VECTORIZED:
-            u_t[1:-1, 1:-1] = u_0[1:-1, 1:-1] + dt * d * (
-                (u_0[2:, 1:-1] - 2 * u_0[1:-1, 1:-1] + u_0[:-2, 1:-1]) +
-                (u_0[1:-1, 2:] - 2 * u_0[1:-1, 1:-1] + u_0[1:-1, :-2]))
+            u = u_t[1:-1, 1:-1]
+            np.multiply(u_0[1:-1, 1:-1], -4., out=u)
+            u += u_0[2:, 1:-1]
+            u += u_0[:-2, 1:-1]
+            u += u_0[1:-1, 2:]
+            u += u_0[1:-1, :-2]
+            u *= c
+            u += u_0[1:-1, 1:-1]
         else:
             for i, j in itertools.product(
                     range(1, NB_POINTS - 1), range(1, NB_POINTS - 1)):
-                u_t[i, j] = u_0[i, j] + dt * d * (
+                u_t[i, j] = u_0[i, j] + c * (
                     - 4 * u_0[i, j] +
                     (u_0[i + 1, j] + u_0[i - 1, j]) +
                     (u_0[i, j + 1] + u_0[i, j - 1]))
-
-        u_t = np.where(occupancy.T > 0, Zero, u_t)
-        u_0 = u_t.copy()
+        u_t *= free
+        u_0, u_t = u_t, u_0
         t += dt
-        if k % TIME_FACTOR == 0:
+        if k % stride == 0:
             print("t : {:.3E} , u_t.max() : {:.3E}, k {}".format(
-                t, u_t.max(), k))
-            U.append(u_t.copy())
-    return U
+                t, u_0.max(), k))
+            yield t, u_0
+
+
+def forward_euler_2d(dt, h, source_grid, iterations, occupancy):
+    """
+    Forward Euler Integration of the heat equation
+
+        h : space discretization
+        t : time discretization
+
+    Returns the list of frames of forward_euler_2d_steps.
+    """
+    return [u_t.copy() for t, u_t in forward_euler_2d_steps(
+        dt, h, source_grid, iterations, occupancy)]
 
 
 def apply_boundry_conditions_to_vector(u_t, n, occupancy):
@@ -116,9 +143,8 @@ def apply_boundry_conditions_to_vector(u_t, n, occupancy):
     occupancy : array
         2d array of occupancy values
 
-    TODO:
-        - apply the boundry condition dirrectly
-        on the laplacian matrix
+    Note: crank_nicholson_2d_sparse applies the boundry conditions
+        dirrectly on the laplacian matrix (see dirichlet_laplacian)
     """
 
     for j in range(u_t.size):
@@ -147,39 +173,27 @@ def crank_nicholson_2d(dt, h, source_grid, iterations, occupancy):
                    k
                   --- * (U(i-1,j,m) + U(i+1,j,m) + U(i,j-1,m) + U(i,j+1,m))
                   h^2
+
+    Note: dt and iterations are not used, 9 implicit steps of .003
+        are taken and every third one is returned. The matrix is
+        factorized (sparse LU) instead of inverted, see
+        crank_nicholson_2d_sparse for the scheme with time steps.
     """
     n = NB_POINTS
-    d = 1. / (h ** 2)
-    dim = n ** 2
-    M = np.zeros((dim, dim))
-
-    Zero = np.zeros((dim, ))
-    u_t = Zero.copy()
-    u_0 = Zero.copy()
+    u_t = np.zeros(n ** 2)
     u_t[source_grid[0] * n + source_grid[1]] = 1.e4
-    # u_0 = np.where(occupancy.T > 0, Zero, u_0)
 
     print("create matrix...")
-
-    # with np.printoptions(
-    #         formatter={'float': '{: 0.1f}'.format},
-    #         linewidth=200):
-    #     print("M : \n", M)
-
     M = (-1 / (h ** 2)) * discrete_2d_laplacian(n, n, matrix_form=True)
 
-    print("solve...")
+    print("factorize ...")
+    solve = splu((sparse.identity(n ** 2) - .003 * M).tocsc()).solve
 
     costs = []
-    # u_t = u_0
-
-    print("invert ...")
-    A_inv = np.linalg.inv(np.eye(dim) - .003 * M)
-
     for i in range(9):
 
         print("solve {}..".format(i))
-        u_t = A_inv @ u_t
+        u_t = solve(u_t)
 
         apply_boundry_conditions_to_vector(u_t, n, occupancy)
 
@@ -191,6 +205,45 @@ def crank_nicholson_2d(dt, h, source_grid, iterations, occupancy):
     return costs
 
 
+def crank_nicholson_2d_sparse(dt, h, source_grid, iterations, occupancy):
+    """
+    Crank-Nicholson algorithm with a prefactorized sparse matrix
+    we use a row major representation of the matrix
+
+        h : space discretization
+        t : time discretization
+
+    (I + k/2 L) U(m+1) = (I - k/2 L) U(m)    with k = dt / h^2
+
+    where L is the negative of the Discrete-2D-Laplacian restricted
+    to the free cells, the heat stays zero on the border and the
+    obstacles (see dirichlet_laplacian).
+    """
+    n = NB_POINTS
+    free = occupancy.T == 0
+    u_t = np.zeros(n ** 2)
+    u_t[source_grid[0] * n + source_grid[1]] = 1.e4
+    u_t[~free.flatten()] = 0
+
+    c = .5 * dt / (h ** 2)
+    L = dirichlet_laplacian(free)
+    B = sparse.identity(n ** 2, format="csr") - c * L
+    solve = implicit_step_solver(free, c)
+
+    U = []
+    t = 0.
+    for k in range(iterations * TIME_FACTOR):
+        if CONSTANT_SOURCE:
+            u_t[source_grid[0] * n + source_grid[1]] = 1.e4
+        u_t = solve(B @ u_t)
+        t += dt
+        if k % TIME_FACTOR == 0:
+            print("t : {:.3E} , u_t.max() : {:.3E}, k {}".format(
+                t, u_t.max(), k))
+            U.append(np.reshape(u_t, (n, n)).copy())
+    return U
+
+
 def crank_nicholson_2d_version_2(dt, h, source_grid, iterations, occupancy):
     """
     Crank-Nicholson algorithm with matrix inversion
@@ -239,35 +292,25 @@ def crank_nicholson_2d_version_2(dt, h, source_grid, iterations, occupancy):
     return U
 
 
+def discrete_1d_gradient(n):
+    """
+    Sparse forward difference, left difference on the last element
+    """
+    G = sparse.diags([-np.ones(n), np.ones(n - 1)], [0, 1], format="lil")
+    G[n - 1, n - 2:] = [-1, 1]
+    return G.tocsr()
+
+
 def discrete_2d_gradient(M, N, dx=1., axis=0):
     """
     Efficient allocation of the Discrete-2D-Gradient
+    as a sparse matrix of shape (M * N, M * N)
     """
-    dim = M * N
     if axis == 0:
-        A = np.zeros((dim, dim))
-        np.fill_diagonal(A, -1)
-
-        A[range(M * (N - 1)), range(M, dim)] = 1
-
-        # every end of collumn left difference
-        last_block = range(M * (N - 1), dim)
-        A[last_block, last_block] = 1
-        A[last_block, range(M * (N - 2), M * (N - 1))] = -1
-
+        A = sparse.kron(discrete_1d_gradient(N), sparse.identity(M))
     if axis == 1:
-
-        A = np.zeros((dim, dim))
-        np.fill_diagonal(A, -1)
-
-        A[range(dim - 1), range(1, dim)] = 1
-
-        # every end of row left difference
-        A[range(M - 1, M * (N - 1), M), range(M, dim, M)] = 0
-        A[range(M - 1, dim, M), range(M - 1, dim, M)] = 1
-        A[range(M - 1, dim, M), range(M - 2, dim, M)] = -1
-
-    return (1/dx) * A
+        A = sparse.kron(sparse.identity(N), discrete_1d_gradient(M))
+    return (1/dx) * A.tocsr()
 
 
 def finite_difference_laplacian_2d(h, u):
@@ -292,42 +335,75 @@ def finite_difference_laplacian_2d(h, u):
 def discrete_2d_laplacian(M, N, matrix_form=False):
     """
     Efficient allocation of the Discrete-2D-Laplacian
+    as a sparse matrix of shape (M * N, M * N)
 
         Return the negatie of the operator
 
-    TODOs
-        1) change allocation in crank_nicholson_2d
-        2) can do better with range instead of for loop!
-
+        matrix_form : when False the neighbors are taken along
+                      the row major index only (1D stencil)
     """
-    A = np.zeros((M * N, M * N))
+    dim = M * N
     if matrix_form:
-        diagonal = np.ones(M)
-        Id = np.diag(-1 * diagonal)
-        D = np.diag(4 * diagonal)
-        D[range(1, M), range(M - 1)] = -1
-        D[range(M - 1), range(1, M)] = -1
-        for i in range(N):
-            A[i * M:(i + 1) * M, i * M:(i + 1) * M] = D
-            if i > 0:
-                A[(i - 1) * M:i * M, i * M:(i + 1) * M] = Id
-            if i < N - 1:
-                A[(i + 1) * M:(i + 2) * M, i * M:(i + 1) * M] = Id
-        return A
+        def second_difference(n):
+            return sparse.diags(
+                [-np.ones(n - 1), 2 * np.ones(n), -np.ones(n - 1)],
+                [-1, 0, 1])
+        A = (sparse.kron(sparse.identity(N), second_difference(M)) +
+             sparse.kron(second_difference(N), sparse.identity(M)))
     else:
         # This actually seems wrong...
-        for p, q in itertools.product(range(A.shape[0]), range(A.shape[1])):
-            i0, j0 = row_major(p, A.shape[0])
-            i1, j1 = row_major(q, A.shape[0])
-            if p == q:
-                A[p, q] = 4
-            elif (
-                    i0 == i1 - 1) and (j0 == j1) or (
-                    i0 == i1 + 1) and (j0 == j1) or (
-                    i0 == i1) and (j0 == j1 - 1) or (
-                    i0 == i1) and (j0 == j1 + 1):
-                A[p, q] = -1
-        return A
+        A = sparse.diags(
+            [-np.ones(dim - 1), 4 * np.ones(dim), -np.ones(dim - 1)],
+            [-1, 0, 1])
+    return A.tocsr()
+
+
+def dirichlet_laplacian(free):
+    """
+    Negative Discrete-2D-Laplacian with zero heat on the border
+    of the grid and on the obstacles
+
+        free : 2d boolean array of the cells where the heat diffuses,
+               row major as the heat vector
+
+    The rows and columns of the occupied and border cells are zero
+    so that they stay at zero in the implicit time steps.
+    """
+    M, N = free.shape
+    interior = np.zeros(free.shape, dtype=bool)
+    interior[1:-1, 1:-1] = free[1:-1, 1:-1]
+    P = sparse.diags(interior.flatten().astype(float))
+    return (P @ discrete_2d_laplacian(N, M, matrix_form=True) @ P).tocsr()
+
+
+_implicit_step_solvers = {}
+
+
+def implicit_step_solver(free, c):
+    """
+    Returns the solve function of the sparse LU factorization
+    of I + c L, where L is the dirichlet_laplacian on the free cells,
+    the factorizations are cached and reused across time steps.
+    """
+    key = (free.shape, np.packbits(free).tobytes(), c)
+    if key not in _implicit_step_solvers:
+        if len(_implicit_step_solvers) > 10:
+            _implicit_step_solvers.clear()
+        A = sparse.identity(free.size, format="csc") + c * (
+            dirichlet_laplacian(free).tocsc())
+        _implicit_step_solvers[key] = splu(A).solve
+    return _implicit_step_solvers[key]
+
+
+def least_squares_potential(D, b):
+    """
+    Minimum norm solution of D phi = b in the least squares sense,
+    where the null space of the gradient operator D is the constants.
+    """
+    A = (D.T @ D).tolil()
+    A[0, 0] += 1.  # fixes the constant
+    phi = spsolve(A.tocsc(), D.T @ b)
+    return phi - phi.mean()
 
 
 def normalized_gradient(field):
@@ -364,12 +440,12 @@ def distance_from_gradient(U, V, dh, f=None):
     N = U.shape[0]
     Dx = discrete_2d_gradient(N, N, dx=dh, axis=0)
     Dy = discrete_2d_gradient(N, N, dx=dh, axis=1)
-    D = np.vstack([Dx, Dy])
+    D = sparse.vstack([Dx, Dy]).tocsr()
     grad = np.hstack([U.flatten(), V.flatten()])
     if f is not None:
-        grad = np.dot(D, f.flatten())
-    phi = np.dot(np.linalg.pinv(D), grad)
-    d = np.linalg.norm(grad - np.dot(D, phi))
+        grad = D @ f.flatten()
+    phi = least_squares_potential(D, grad)
+    d = np.linalg.norm(grad - D @ phi)
     print("d : ", d)
     phi.shape = (N, N)
     return phi
@@ -391,8 +467,7 @@ def poisson_equation(D, dh):
     N = D.shape[1]
     A = (1. / (dh**2)) * discrete_2d_laplacian(M, N, True)
     D = D.flatten()
-    A_inv = np.linalg.inv(A)
-    phi = np.dot(A_inv, D)
+    phi = spsolve(A.tocsc(), D)
     phi -= phi.min()  # solve by setting minimum to 0
     phi.shape = (M, N)
     return phi
@@ -432,21 +507,19 @@ def distance(U, V, D, dh):
 
     # D2xy = (1. / (dh**2)) * discrete_2d_laplacian(M, N, True)
     # b = np.hstack([U.flatten(), V.flatten(), D.flatten()])
-    # A = np.vstack([Dx, Dy, D2xy])
+    # A = sparse.vstack([Dx, Dy, D2xy])
 
     b = np.hstack([U.flatten(), V.flatten()])
-    A = np.vstack([Dx, Dy])
-
-    print("inverse matrix...")
-    A_inv = np.linalg.pinv(A)
+    A = sparse.vstack([Dx, Dy]).tocsr()
 
-    phi = np.dot(A_inv, b)
+    print("solve least squares...")
+    phi = least_squares_potential(A, b)
     phi -= phi.min()
 
-    d = np.linalg.norm(np.dot(Dx, phi) - U.flatten())
+    d = np.linalg.norm(Dx @ phi - U.flatten())
     print("d1 = ", d)
 
-    d = np.linalg.norm(np.dot(Dy, phi) - V.flatten())
+    d = np.linalg.norm(Dy @ phi - V.flatten())
     print("d2 = ", d)
 
     phi.shape = (M, N)
@@ -483,3 +556,122 @@ def heat_diffusion(workspace, source, iterations):
     else:
         return forward_euler_2d(
             t, h, source_grid, iterations, occupancy)
+
+
+class GeodesicDistanceField:
+    """
+    Geodesic distance on the free space of a workspace computed
+    with the heat method. The operators are restricted to the free
+    cells of the grid (zero flux through the obstacles) and their
+    sparse factorizations are computed once, the distances to many
+    sources are then obtained by solving with multiple right hand sides.
+
+        1) diffuse heat from the sources for a short time t
+        2) normalize the gradient of the heat X = - grad u / |grad u|
+        3) solve the Poisson equation L phi = div X
+
+        K. Crane, C. Weischedel and M. Wardetzky, Geodesics in Heat,
+        ACM Transactions on Graphics 2013.
+
+    Parameters
+    ----------
+        workspace : Workspace
+        nb_points : number of cells along each axis of the grid
+        time_factor : diffusion time in units of the squared resolution
+    """
+
+    def __init__(self, workspace, nb_points=NB_POINTS, time_factor=1.):
+        self.grid = workspace.pixel_map(nb_points)
+        h = self.grid.resolution
+        self.free = occupancy_map(nb_points, workspace) == 0
+        n = np.count_nonzero(self.free)
+        index = np.full(self.free.shape, -1)
+        index[self.free] = np.arange(n)
+        self._index = index
+
+        # differences along the edges between free cells (axis 0 and 1)
+        # and their averaging to the cells and from the cells
+        G, to_cells, to_edges = [], [], []
+        for a, s in enumerate([np.s_[1:, :], np.s_[:, 1:]]):
+            t = np.s_[:-1, :] if a == 0 else np.s_[:, :-1]
+            edges = self.free[s] & self.free[t]
+            i, j = index[t][edges], index[s][edges]
+            m = i.size
+            rows = np.repeat(np.arange(m), 2)
+            cols = np.stack([i, j], axis=1).flatten()
+            G.append(sparse.csr_matrix(
+                (np.tile([-1. / h, 1. / h], m), (rows, cols)), (m, n)))
+            B = sparse.csr_matrix((np.full(2 * m, .5), (rows, cols)), (m, n))
+            degree = np.maximum(np.asarray(B.sum(axis=0)).flatten(), .5)
+            to_cells.append(sparse.diags(.5 / degree) @ B.T)
+            to_edges.append(B)
+        self._G = sparse.vstack(G).tocsr()
+        self._to_cells = [A.tocsr() for A in to_cells]
+        self._to_edges = to_edges
+
+        # Neumann Laplacian, one fixed value per connected component
+        L = (self._G.T @ self._G).tocsc()
+        nb_components, self._components = connected_components(L)
+        anchors = np.unique(self._components, return_index=True)[1]
+        A = sparse.csc_matrix(
+            (np.ones(nb_components), (anchors, anchors)), (n, n))
+        self._heat_solve = splu(
+            sparse.identity(n, format="csc") + time_factor * h ** 2 * L).solve
+        self._poisson_solve = splu((L + A).tocsc()).solve
+
+    def source_ids(self, sources):
+        """ Indices of the free cells containing the sources (k x 2) """
+        cells = self.grid.world_to_grid(np.atleast_2d(sources)).T
+        cells = np.clip(cells.T, 0, np.array(self.free.shape) - 1).T
+        ids = self._index[cells[0], cells[1]]
+        if (ids < 0).any():
+            raise ValueError("source in collision")
+        return ids
+
+    def distances(self, sources):
+        """
+        Distances to each of the k sources (k x 2) as a (k, nx, ny)
+        array indexed by the grid coordinates, np.inf on the obstacles
+        and on the cells that can not be reached from the source.
+        """
+        ids = self.source_ids(sources)
+        k = ids.size
+        n = self._G.shape[1]
+        delta = np.zeros((n, k))
+        delta[ids, np.arange(k)] = 1.
+        u = self._heat_solve(delta)
+
+        # normalized gradients at the cells mapped back to the edges
+        edge_gradient = self._G @ u
+        m = self._to_edges[0].shape[0]
+        X = [self._to_cells[0] @ edge_gradient[:m],
+             self._to_cells[1] @ edge_gradient[m:]]
+        norms = np.sqrt(X[0] ** 2 + X[1] ** 2)
+        norms[norms == 0] = np.inf
+        X = np.vstack([self._to_edges[a] @ (-X[a] / norms) for a in range(2)])
+
+        # least squares potential, zero at the sources
+        phi = self._poisson_solve(self._G.T @ X)
+        phi -= phi[ids, np.arange(k)]
+        phi[self._components[:, None] != self._components[ids]] = np.inf
+        D = np.full((k,) + self.free.shape, np.inf)
+        D[:, self.free] = phi.T
+        return D
+
+    def distance(self, source):
+        """ Distance to the source on the grid (see distances) """
+        return self.distances(source)[0]
+
+    def distance_map(self, source):
+        """
+        Returns the distance to the source as a DifferentiableMap,
+        which can be used directly as an obstacle aware attractor.
+        The values on the cells that are not reachable are
+        extrapolated from the nearest reachable cell.
+        """
+        D = self.distance(source)
+        unreachable = np.isinf(D)
+        d, (i, j) = ndimage.distance_transform_edt(
+            unreachable, return_indices=True)
+        D = D[i, j] + self.grid.resolution * d
+        return PixelGridBilinearInterpolation(self.grid, D)
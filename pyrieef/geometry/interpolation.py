@@ -19,7 +19,10 @@
 
 import numpy as np
 from .differentiable_geometry import *
+from .differentiable_geometry import _as_batch
 from scipy.spatial import distance
+from scipy.spatial import cKDTree
+from scipy import sparse
 
 
 def linear_regression(X, Y, w_t, lambda_1, lambda_2):
@@ -47,6 +50,11 @@ class LWR(DifferentiableMap):
 
     This allows it to be used for interpolation of derivatives
     on multi-dimensional output
+
+    The output dimensions that share the same data X, metric D and
+    regularizer are regressed together. When weight_threshold is set
+    only the data points with a larger weight are used, they are
+    found with a KD-tree that is kept between queries.
     """
 
     def __init__(self, m, n):
@@ -56,6 +64,8 @@ class LWR(DifferentiableMap):
         self.Y = None
         self.D = None
         self.ridge_lambda = None
+        self.weight_threshold = None
+        self._trees = {}
 
     def output_dimension(self):
         return self._m
@@ -64,11 +74,170 @@ class LWR(DifferentiableMap):
         return self._n
 
     def forward(self, p):
-        v = np.empty(self._m)
+        return self.forward_batch(p.reshape(1, self._n))[0]
+
+    def jacobian(self, p):
+        return np.matrix(self.jacobian_batch(p.reshape(1, self._n))[0])
+
+    def evaluate(self, p):
+        V, J = self.evaluate_batch(p.reshape(1, self._n))
+        return [V[0], np.matrix(J[0])]
+
+    def forward_batch(self, X):
+        return self._regress(X, False)
+
+    def jacobian_batch(self, X):
+        return self._regress(X, True)[1]
+
+    def evaluate_batch(self, X):
+        """ Values (N x m) and analytic jacobians (N x m x n) on N points,
+            both obtained from the same weights and linear solves """
+        return self._regress(X, True)
+
+    def _regress(self, X, return_jacobian):
+        X = _as_batch(X, self._n)
+        groups = {}
         for i in range(self._m):
-            v[i] = locally_weighted_regression(
-                p, self.X[i], self.Y[i], self.D[i], self.ridge_lambda[i])
-        return v
+            key = (id(self.X[i]), id(self.D[i]), self.ridge_lambda[i])
+            groups.setdefault(key, []).append(i)
+        V = np.empty((X.shape[0], self._m))
+        J = np.empty((X.shape[0], self._m, self._n))
+        for key, outputs in groups.items():
+            i = outputs[0]
+            r = locally_weighted_regression_batch(
+                X, self.X[i], np.stack([self.Y[k] for k in outputs], axis=1),
+                self.D[i], self.ridge_lambda[i],
+                self.weight_threshold, self._tree(i), return_jacobian)
+            if return_jacobian:
+                V[:, outputs], J[:, outputs] = r
+            else:
+                V[:, outputs] = r
+        return (V, J) if return_jacobian else V
+
+    def _tree(self, i):
+        """ KD-tree of the data of output i in the metric space,
+            rebuilt when the data or the metric are replaced. The data
+            and metric are kept with the tree and compared by identity,
+            as ids can be reused once the replaced arrays are freed. """
+        if self.weight_threshold is None:
+            return None
+        X, D = self.X[i], self.D[i]
+        key = (id(X), id(D))
+        entry = self._trees.get(key)
+        if entry is None or entry[0] is not X or entry[1] is not D:
+            if len(self._trees) >= self._m:
+                self._trees.clear()
+            entry = (X, D, mahalanobis_kdtree(X, D))
+            self._trees[key] = entry
+        return entry[2]
+
+
+def mahalanobis_kdtree(X, D):
+    """
+    KD-tree of the points X (N x d) in the space where the
+    Mahalanobis metric D is Euclidean: |L'x| with D = LL'
+    """
+    X = X.reshape(X.shape[0], -1)
+    L = np.linalg.cholesky(np.atleast_2d(D))
+    return cKDTree(X @ L)
+
+
+def locally_weighted_regression_batch(
+        X_query, X, Y, D, ridge_lambda, weight_threshold=None, tree=None,
+        return_jacobian=False):
+    """
+    Locally weighted regression at Q query points at once
+
+      X_query : (Q, d) query points
+      X : (N, d) domain points
+      Y : (N,) or (N, m) targets, regressed with the same weights
+      D : (d, d) Mahalanobis metric
+      ridge_lambda : regularizer
+      weight_threshold : when given only the points of weight larger
+        than the threshold are used, they are found with a KD-tree
+        (see mahalanobis_kdtree, which can be passed to be reused)
+      return_jacobian : also returns the (Q, d) or (Q, m, d) jacobians
+        of the values with respect to the queries
+
+    Returns the (Q,) or (Q, m) values, see locally_weighted_regression.
+    The (d + 1) x (d + 1) systems of all queries are assembled with a
+    sparse product with the weights and solved as one stacked array.
+
+    Jacobian: with A = X'WX + lambda I, beta = inv(A) X'WY, z = inv(A) x
+    and dw_i/dx = w_i D (x_i - x), the derivative of the value beta'x is
+
+        beta + sum_i w_i D (x_i - x) (y_i - beta'x_i) (x_i'z)
+
+    which only needs third order weighted moments of the data, summed
+    with the same weights as A (the gradients of the weights are
+    neglected outside of the threshold).
+    """
+    Q = X_query.shape[0]
+    N = X.shape[0]
+    X = X.reshape(N, -1)
+    X_query = X_query.reshape(Q, X.shape[1])
+    Y_2d = Y.reshape(N, -1)
+    if N == 0:
+        V = np.zeros((Q,) + Y.shape[1:])
+        if return_jacobian:
+            return V, np.zeros(V.shape + (X.shape[1],))
+        return V
+
+    # Weights of the data points, sparse when truncated
+    D = np.atleast_2d(D)
+    if weight_threshold is None:
+        W = np.exp(-.5 * np.square(
+            distance.cdist(X_query, X, 'mahalanobis', VI=D)))
+    else:
+        if tree is None:
+            tree = mahalanobis_kdtree(X, D)
+        L = np.linalg.cholesky(D)
+        W = tree.sparse_distance_matrix(
+            cKDTree(X_query @ L),
+            distance_at_weight_threshold(weight_threshold),
+            output_type="coo_matrix").T.tocsr()
+        W.data = np.exp(-.5 * np.square(W.data))
+        W.sum_duplicates()
+
+    # The "augmented" version of X has an extra constant
+    # feature to represent the bias.
+    Xaug = np.ones((N, X.shape[1] + 1))
+    Xaug[:, :-1] = X
+    k = Xaug.shape[1]
+
+    # X'WX + lambda I and X'WY for all queries
+    H = W @ (Xaug[:, :, None] * Xaug[:, None, :]).reshape(N, k * k)
+    H = H.reshape(Q, k, k) + ridge_lambda * np.eye(k)
+    b = (W @ (Xaug[:, :, None] * Y_2d[:, None, :]).reshape(N, -1))
+    b = b.reshape(Q, k, -1)
+
+    # Queries without neighbors default to 0
+    empty = np.asarray(abs(W).sum(axis=1)).flatten() == 0
+    H[empty] = np.eye(k)
+    beta = np.linalg.solve(H, b)
+
+    x_query_aug = np.ones((Q, k))
+    x_query_aug[:, :-1] = X_query
+    V = np.einsum("qk,qkm->qm", x_query_aug, beta)
+    if not return_jacobian:
+        return V.reshape((Q,) + Y.shape[1:])
+
+    # Moments sum_i w_i x_ia x_ic x_ie and sum_i w_i x_ia x_ie y_i
+    # the last coordinate of the augmented points being 1, the
+    # moments with a = k - 1 are the ones of A and X'WY
+    M3 = (W @ (Xaug[:, :, None, None] * Xaug[:, None, :, None] *
+               Xaug[:, None, None, :]).reshape(N, -1)).reshape(Q, k, k, k)
+    Y2 = (W @ (Xaug[:, :, None, None] * Xaug[:, None, :, None] *
+               Y_2d[:, None, None, :]).reshape(N, -1)).reshape(Q, k, k, -1)
+    z = np.linalg.solve(H, x_query_aug[:, :, None])[:, :, 0]
+    S = (np.einsum("qaem,qe->qam", Y2, z) -
+         np.einsum("qace,qcm,qe->qam", M3, beta, z))
+    S = S[:, :-1] - X_query[:, :, None] * S[:, -1:]
+    D_sym = .5 * (D + D.T)
+    J = beta[:, :-1] + np.einsum("ja,qam->qjm", D_sym, S)
+    J = np.swapaxes(J, 1, 2)
+    return (V.reshape((Q,) + Y.shape[1:]),
+            J.reshape((Q,) + Y.shape[1:] + (X.shape[1],)))
 
 
 def locally_weighted_regression(x_query, X, Y, D, ridge_lambda):
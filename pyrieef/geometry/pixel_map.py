@@ -134,6 +134,71 @@ class RegressedPixelGridSpline(DifferentiableMap):
         return J
 
 
+def bilinear_interpolation(values, origin, resolution, X, dx=0, dy=0):
+    """
+        Bilinear interpolant (or its first partial derivatives) of values
+        given at the nodes of a regular grid, on N points stacked row-wise
+        (N x 2). The interpolant is extrapolated linearly outside of the
+        nodes, using the cells of the border.
+
+        values : node values indexed by the grid coordinates (i, j)
+        origin : world coordinates of the node (0, 0)
+        resolution : distance between the nodes (scalar or per axis)
+    """
+    h_x, h_y = np.broadcast_to(resolution, 2)
+    f = values
+    i = np.clip(np.floor((X[:, 0] - origin[0]) / h_x).astype(int),
+                0, f.shape[0] - 2)
+    j = np.clip(np.floor((X[:, 1] - origin[1]) / h_y).astype(int),
+                0, f.shape[1] - 2)
+    t_x = (X[:, 0] - origin[0]) / h_x - i
+    t_y = (X[:, 1] - origin[1]) / h_y - j
+    w_x = [1. - t_x, t_x] if dx == 0 else [-1. / h_x, 1. / h_x]
+    w_y = [1. - t_y, t_y] if dy == 0 else [-1. / h_y, 1. / h_y]
+    return (w_x[0] * w_y[0] * f[i, j] + w_x[1] * w_y[0] * f[i + 1, j] +
+            w_x[0] * w_y[1] * f[i, j + 1] +
+            w_x[1] * w_y[1] * f[i + 1, j + 1])
+
+
+class PixelGridBilinearInterpolation(DifferentiableMap):
+    """
+        Bilinear interpolation of the values at the center of the cells
+        of a PixelMap, values is indexed by the grid coordinates (i, j).
+        The map is extrapolated linearly outside of the cell centers.
+    """
+
+    def __init__(self, pixel_map, values):
+        assert values.shape == (pixel_map.nb_cells_x, pixel_map.nb_cells_y)
+        self._pixel_map = pixel_map
+        self._values = values
+
+    def output_dimension(self):
+        return 1
+
+    def input_dimension(self):
+        return 2
+
+    def _bilinear(self, X, dx, dy):
+        return bilinear_interpolation(
+            self._values, self._pixel_map.origin, self._pixel_map.resolution,
+            X, dx, dy)
+
+    def forward(self, x):
+        return float(self._bilinear(x.reshape(1, 2), 0, 0)[0])
+
+    def jacobian(self, x):
+        return np.matrix(self.jacobian_batch(x.reshape(1, 2))[0])
+
+    def forward_batch(self, X):
+        return self._bilinear(X, 0, 0).reshape(len(X), 1)
+
+    def jacobian_batch(self, X):
+        J = np.empty((len(X), 1, 2))
+        J[:, 0, 0] = self._bilinear(X, 1, 0)
+        J[:, 0, 1] = self._bilinear(X, 0, 1)
+        return J
+
+
 def costmap_from_matrix(extent, matrix):
     """ Creates a costmap wich is continuously defined given a matrix """
     assert matrix.shape[0] == matrix.shape[1]
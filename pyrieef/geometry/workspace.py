@@ -114,6 +114,37 @@ class Shape:
         """
         raise NotImplementedError()
 
+    def dist_gradient_batch(self, X):
+        """
+        Returns the gradients of the distance function at N points.
+        The default implementation loops over the points.
+
+        Parameters
+        ----------
+            X : numpy array (N x n)
+        """
+        return np.array([self.dist_gradient(x) for x in X]).reshape(X.shape)
+
+    def dist_hessian_batch(self, X):
+        """
+        Returns the hessians of the distance function at N points.
+        The default implementation loops over the points.
+
+        Parameters
+        ----------
+            X : numpy array (N x n)
+        """
+        N, n = X.shape
+        return np.array([self.dist_hessian(x) for x in X]).reshape(N, n, n)
+
+    def bounding_box(self):
+        """
+        Returns the lower and upper corners of an axis aligned box
+        that contains the shape. Shapes that do not implement it are
+        never pruned from the workspace distance queries.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def sampled_points(self):
         raise NotImplementedError()
@@ -154,6 +185,86 @@ def point_distance_hessian(x, origin):
     return d_inv * np.eye(x.size) - d_inv**3 * np.outer(x_center, x_center)
 
 
+def point_distance_gradient_batch(X, origin):
+    """
+    Returns the gradients of the distance function to a point
+    for N points stacked row-wise (N x n)
+    """
+    X_center = X - origin
+    return X_center / np.linalg.norm(X_center, axis=1)[:, np.newaxis]
+
+
+def point_distance_hessian_batch(X, origin):
+    """
+    Returns the hessians of the distance function to a point
+    for N points stacked row-wise (N x n), see point_distance_hessian
+    """
+    X_center = X - origin
+    d_inv = 1. / np.linalg.norm(X_center, axis=1)
+    outer = X_center[:, :, np.newaxis] * X_center[:, np.newaxis, :]
+    return (d_inv[:, np.newaxis, np.newaxis] * np.eye(X.shape[1]) -
+            (d_inv**3)[:, np.newaxis, np.newaxis] * outer)
+
+
+def box_distance(q, half_dim):
+    """
+    Returns the signed distance to an axis aligned box centered
+    at the origin of the coordinates of q.
+
+    Parameters
+    ----------
+        q : numpy array (n,) or stacked points (n, ...)
+        half_dim : numpy array (n,)
+    """
+    d = (np.abs(q).T - half_dim).T
+    return vector_norm(np.maximum(d, 0.)) + np.minimum(d.max(axis=0), 0.)
+
+
+def box_distance_gradient(q, half_dim):
+    """
+    Returns the gradient of box_distance, outside of the box it is
+    the normalized vector from the closest point, inside it is the
+    normal of the closest face (first axis on ties).
+
+    Parameters
+    ----------
+        q : numpy array (n,) or stacked points (n, ...)
+        half_dim : numpy array (n,)
+    """
+    d = (np.abs(q).T - half_dim).T
+    d_out = np.maximum(d, 0.)
+    norm = vector_norm(d_out)
+    outside = norm > 0.
+    axis = np.arange(q.shape[0]).reshape((-1,) + (1,) * (q.ndim - 1))
+    face = (axis == d.argmax(axis=0)).astype(float)
+    sign = np.where(q < 0., -1., 1.)
+    return sign * np.where(outside, d_out / np.where(outside, norm, 1.), face)
+
+
+def box_distance_hessian(q, half_dim):
+    """
+    Returns the hessian of box_distance (n, n) or (n, n, ...).
+    It is only non zero when the closest point is on a vertex (or
+    an edge in 3D), where it is the hessian of the distance to
+    that point (line) as in point_distance_hessian.
+
+    Parameters
+    ----------
+        q : numpy array (n,) or stacked points (n, ...)
+        half_dim : numpy array (n,)
+    """
+    n = q.shape[0]
+    d_out = np.maximum((np.abs(q).T - half_dim).T, 0.)
+    norm = vector_norm(d_out)
+    outside = norm > 0.
+    norm = np.where(outside, norm, 1.)
+    g = np.where(q < 0., -1., 1.) * d_out / norm
+    active = (d_out > 0.).astype(float)
+    shape = (n, n) + (1,) * (q.ndim - 1)
+    H = np.eye(n).reshape(shape) * active[np.newaxis] - g[:, np.newaxis] * g
+    return np.where(outside, H / norm, 0.)
+
+
 class Circle(Shape):
     """
     An Circle
@@ -202,6 +313,16 @@ class Circle(Shape):
         """ Warning: not parraleized but should work from 3D """
         return point_distance_hessian(x, self.origin)
 
+    def dist_gradient_batch(self, X):
+        return point_distance_gradient_batch(X, self.origin)
+
+    def bounding_box(self):
+        origin = np.asarray(self.origin, dtype=float)
+        return origin - self.radius, origin + self.radius
+
+    def dist_hessian_batch(self, X):
+        return point_distance_hessian_batch(X, self.origin)
+
     def sampled_points(self):
         """ TODO make this generic (3D) and parallelizable... Tough."""
         points = []
@@ -322,6 +443,9 @@ class Segment(Shape):
     def length(self):
         return self._length
 
+    def bounding_box(self):
+        return np.minimum(self._p1, self._p2), np.maximum(self._p1, self._p2)
+
     def sampled_points(self):
         return sample_line(self._p1, self._p2, self.nb_points)
 
@@ -416,6 +540,9 @@ class Box(Shape):
     def diag(self):
         return np.linalg.norm(self.dim)
 
+    def bounding_box(self):
+        return self.lower_corner(), self.upper_corner()
+
     def is_inside(self, x):
         """
         Returns false if any of the component of the vector
@@ -489,7 +616,7 @@ class Box(Shape):
         sign = np.where(Box.is_inside(self, x), -1., 1.)
         minimum = np.min(np.array(d), axis=0)
         d = sign * minimum
-        return np.asscalar(d) if d.size == 1 else d
+        return d.item() if d.size == 1 else d
 
     def sampled_points(self):
         points = []
@@ -536,10 +663,15 @@ class OrientedBox(Box):
         delattr(self, '_is_box')
         self._is_oriented_box = True
         self.orientation = np.asarray(orientation)
+        self.half_dim = 0.5 * self.dim
 
     def theta(self):
         return angle_from_matrix_2d(self.orientation)
 
+    def bounding_box(self):
+        half_extent = .5 * np.dot(np.abs(self.orientation), self.dim)
+        return self.origin - half_extent, self.origin + half_extent
+
     def to_dictionary(self):
         """ Serialize object to a dictionary """
         if self.origin.size == 2:
@@ -559,15 +691,35 @@ class OrientedBox(Box):
         else:
             raise NotImplementedError('box has to be of dim 2 or 3')
 
+    def _aligned(self, p):
+        """ Coordinates of single or stacked points in the box frame """
+        p_offset = (p.T - self.origin).T
+        return np.tensordot(self.orientation.T, p_offset, axes=1)
+
+    def is_inside(self, p):
+        p_aligned = self._aligned(p)
+        return np.all((np.abs(p_aligned).T <= self.half_dim).T, axis=0)
+
     def dist_from_border(self, p):
-        """  
-        TODO this works but could be better done 
-        (no creation of AAB)
         """
-        aab = AxisAlignedBox(dim=self.dim)
-        p_offset = (p.T - self.origin).T
-        p_aligned = np.tensordot(self.orientation.T, p_offset, axes=1)
-        return aab.dist_from_border(p_aligned)
+        Works on a single point or on meshgrid data (2 or 3, n, n)
+        """
+        return box_distance(self._aligned(p), self.half_dim)
+
+    def dist_gradient(self, p):
+        g = box_distance_gradient(self._aligned(p), self.half_dim)
+        return np.tensordot(self.orientation, g, axes=1)
+
+    def dist_hessian(self, p):
+        H = box_distance_hessian(self._aligned(p), self.half_dim)
+        R = self.orientation
+        return np.einsum('ij,jk...,lk->il...', R, H, R)
+
+    def dist_gradient_batch(self, X):
+        return self.dist_gradient(X.T).T
+
+    def dist_hessian_batch(self, X):
+        return self.dist_hessian(X.T).transpose(2, 0, 1)
 
     def sampled_points(self):
         return [(np.dot(self.orientation, p - self.origin) + self.origin)
@@ -601,6 +753,10 @@ class AxisAlignedBox(Box):
                    8  |  9  |  6
                    ___|_____|___
                    4  |  7  |  3
+
+        The distance, gradient and hessian are computed in closed
+        form for all zones at once (see box_distance), so that
+        they can be called on single points or stacked points.
         """
         self.half_dim = 0.5 * self.dim
         self._v1 = np.array([-self.half_dim[0], self.half_dim[1]])
@@ -609,42 +765,6 @@ class AxisAlignedBox(Box):
         self._v4 = np.array([-self.half_dim[0], -self.half_dim[1]])
         self._verticies = [self._v1, self._v2, self._v3, self._v4]
 
-        self._switcher_distance = {
-            1: lambda x: vector_norm(x - self._v1),
-            2: lambda x: vector_norm(x - self._v2),
-            3: lambda x: vector_norm(x - self._v3),
-            4: lambda x: vector_norm(x - self._v4),
-            5: lambda x: x[1] - self._v1[1],
-            6: lambda x: x[0] - self._v3[0],
-            7: lambda x: self._v1[1] - x[1],
-            8: lambda x: self._v1[0] - x[0],
-            9: lambda x: -min(self.half_dim - np.absolute(x))
-        }
-
-        self._switcher_gradient = {
-            1: lambda x: point_distance_gradient(x, self._v1),
-            2: lambda x: point_distance_gradient(x, self._v2),
-            3: lambda x: point_distance_gradient(x, self._v3),
-            4: lambda x: point_distance_gradient(x, self._v4),
-            5: lambda x: np.array([0, 1]),
-            6: lambda x: np.array([1, 0]),
-            7: lambda x: np.array([0, -1]),
-            8: lambda x: np.array([-1, 0]),
-            9: lambda x: self._inside_gradient(x)
-        }
-
-        self._switcher_hessian = {
-            1: lambda x: point_distance_hessian(x, self._v1),
-            2: lambda x: point_distance_hessian(x, self._v2),
-            3: lambda x: point_distance_hessian(x, self._v3),
-            4: lambda x: point_distance_hessian(x, self._v4),
-            5: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            6: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            7: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            8: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            9: lambda x: np.zeros((self.origin.size, self.origin.size))
-        }
-
     def find_zone(self, x_center):
         """
                    1  |  5  |  2
@@ -685,36 +805,26 @@ class AxisAlignedBox(Box):
 
     def is_inside(self, x):
         x_center = (x.T - self.origin).T
-        return self.find_zone(x_center) == 9
-
-    def _inside_gradient(self, x):
-        d1 = np.fabs(self.half_dim[0] - x[0])
-        d2 = np.fabs(self.half_dim[1] - x[1])
-        d3 = np.fabs(-self.half_dim[0] - x[0])
-        d4 = np.fabs(-self.half_dim[1] - x[1])
-        switcher = {
-            0: np.array([1, 0]),
-            1: np.array([0, 1]),
-            2: np.array([-1, 0]),
-            3: np.array([0, -1])}
-        idx = np.argmin([d1, d2, d3, d4])
-        return switcher[idx]
+        return np.all((np.abs(x_center).T <= self.half_dim).T, axis=0)
 
     def dist_from_border(self, x):
-        single = x.shape == (2,) or x.shape == (3,)
-        if not single:
-            # For now we can not use meshgrid for this class
-            return Box.dist_from_border(self, x)
-        x_center = (x.T - self.origin).T
-        return self._switcher_distance.get(self.find_zone(x_center))(x_center)
+        """
+        Works on a single point or on meshgrid data (2 or 3, n, n)
+        """
+        return box_distance((x.T - self.origin).T, self.half_dim)
 
     def dist_gradient(self, x):
-        x_center = (x.T - self.origin).T
-        return self._switcher_gradient.get(self.find_zone(x_center))(x_center)
+        return box_distance_gradient((x.T - self.origin).T, self.half_dim)
 
     def dist_hessian(self, x):
-        x_center = (x.T - self.origin).T
-        return self._switcher_hessian.get(self.find_zone(x_center))(x_center)
+        return box_distance_hessian((x.T - self.origin).T, self.half_dim)
+
+    def dist_gradient_batch(self, X):
+        return box_distance_gradient((X - self.origin).T, self.half_dim).T
+
+    def dist_hessian_batch(self, X):
+        H = box_distance_hessian((X - self.origin).T, self.half_dim)
+        return H.transpose(2, 0, 1)
 
     def to_dictionary(self):
         """ Serialize object to a dictionary """
@@ -873,57 +983,100 @@ class Polygon(Shape):
             else:
                 v2 = self._verticies[0]
             self._edges[i] = Segment(p1=v1, p2=v2)
+        """ Contiguous (E, 2) arrays of edge end points, edge i goes
+            from vertex i to vertex i + 1 """
+        self._edges_start = np.array(self._verticies, dtype=float)
+        self._edges_end = np.roll(self._edges_start, -1, axis=0)
 
     def verticies(self):
         return self._verticies
 
+    def bounding_box(self):
+        return self._edges_start.min(axis=0), self._edges_start.max(axis=0)
+
+    def _edges_offsets(self, x):
+        """
+        Offsets from the closest points on all edges at once
+
+        Parameters
+        ----------
+        x : numpy array 2d
+            or meshgrid data shape = (2, n, n)
+
+        Returns
+        -------
+            the offset coordinates (E, ...) x 2 and the position of
+            the closest points along the edges in [0, 1] (E, ...)
+        """
+        shape = (-1,) + (1,) * (x.ndim - 1)
+        a = self._edges_start.T.reshape((2,) + shape)
+        u = self._edges_end.T.reshape((2,) + shape) - a
+        v_x, v_y = x[0] - a[0], x[1] - a[1]
+        t = (u[0] * v_x + u[1] * v_y) / (u[0] * u[0] + u[1] * u[1])
+        t = np.clip(t, 0., 1.)
+        return v_x - t * u[0], v_y - t * u[1], t
+
     def is_inside(self, x):
         """
         Returns false if x is outside of the polygon
 
         Parameters
         ----------
-        x : numpy array with
-            arbitrary dimensions, 2d and 3d
-            or meshgrid data shape = (2 or 3, n, n)
+        x : numpy array 2d
+            or meshgrid data shape = (2, n, n)
 
-        Computes inside by checking that the point is on the
-        "right side" of all edges of the polygon
+        Computes inside with the winding number of the polygon
+        around the point, so that it also holds for non convex polygons
         """
-        single = x.shape == (2,) or x.shape == (3,)
-        shape = 1 if single else (x.shape[1], x.shape[2])
-        inside = np.full(shape, True)
-        for e in self._edges:
-            inside = np.where(line_side(e.p1(), e.p2(), x), inside, False)
-        return inside
+        shape = (-1,) + (1,) * (x.ndim - 1)
+        a_x, a_y = (self._edges_start[:, k].reshape(shape) for k in [0, 1])
+        b_x, b_y = (self._edges_end[:, k].reshape(shape) for k in [0, 1])
+        side = (b_x - a_x) * (x[1] - a_y) - (b_y - a_y) * (x[0] - a_x)
+        upward = (a_y <= x[1]) & (b_y > x[1]) & (side > 0)
+        downward = (a_y > x[1]) & (b_y <= x[1]) & (side < 0)
+        return upward.sum(axis=0) != downward.sum(axis=0)
 
     def closest_edge(self, x):
-        min_dist = np.inf
-        closest_point = np.zeros(x.shape)
-        closest_edge = None
-        for edge in self._edges:
-            p = edge.closest_point(x)
-            d = np.linalg.norm(x - p)
-            if min_dist > d:
-                min_dist = d
-                closest_point = p.copy()
-                closest_edge = edge
-        return closest_edge, closest_point, min_dist
+        d_x, d_y, _ = self._edges_offsets(x)
+        d = np.sqrt(d_x * d_x + d_y * d_y)
+        i = np.argmin(d)
+        return self._edges[i], x - np.array([d_x[i], d_y[i]]), d[i]
 
     def closest_point(self, x):
         return self.closest_edge(x)[1]
 
     def dist_hessian(self, x):
-        return self.closest_edge(x)[0].dist_hessian(x)
+        return self.dist_hessian_batch(x.reshape(1, 2))[0]
 
     def dist_from_border(self, x):
-        d = [None] * len(self._edges)
-        for i, edge in enumerate(self._edges):
-            d[i] = edge.dist_from_border(x)
-        sign = np.where(self.is_inside(x), -1., 1.)
-        minimum = np.min(np.array(d), axis=0)
-        d = sign * minimum
-        return np.asscalar(d) if d.size == 1 else d
+        d_x, d_y, _ = self._edges_offsets(x)
+        minimum = np.sqrt((d_x * d_x + d_y * d_y).min(axis=0))
+        d = np.where(self.is_inside(x), -1., 1.) * minimum
+        return d.item() if d.size == 1 else d
+
+    def _closest_points_batch(self, X):
+        """ closest points on the border of N points (N x 2)
+            and their position along the closest edges """
+        d_x, d_y, t = self._edges_offsets(X.T)
+        i = (d_x * d_x + d_y * d_y).argmin(axis=0)
+        k = np.arange(len(X))
+        return X - np.stack([d_x[i, k], d_y[i, k]], axis=1), t[i, k]
+
+    def dist_gradient_batch(self, X):
+        x_center = X - self._closest_points_batch(X)[0]
+        sign = np.where(self.is_inside(X.T), -1., 1.)
+        return (sign / np.linalg.norm(x_center, axis=1))[:, np.newaxis] * (
+            x_center)
+
+    def dist_hessian_batch(self, X):
+        """ Non zero only when the closest point is a vertex,
+            where it is the hessian of the distance to that point """
+        p, t = self._closest_points_batch(X)
+        on_vertex = (t == 0.) | (t == 1.)
+        sign = np.where(self.is_inside(X.T), -1., 1.)
+        H = point_distance_hessian_batch(X, p)
+        return np.where(
+            on_vertex, sign, 0.)[:, np.newaxis, np.newaxis] * H
 
     def sampled_points(self):
         nb_points_per_edge = max(2, int(self.nb_points / len(self._edges)))
@@ -984,7 +1137,11 @@ class Complex(Shape):
         for i, shape in enumerate(self._shapes):
             d[i] = shape.dist_from_border(x)
         d = np.min(np.array(d), axis=0)
-        return np.asscalar(d) if d.size == 1 else d
+        return d.item() if d.size == 1 else d
+
+    def bounding_box(self):
+        corners = np.array([shape.bounding_box() for shape in self._shapes])
+        return corners[:, 0].min(axis=0), corners[:, 1].max(axis=0)
 
     def is_inside(self, x):
         inside = [None] * len(self._shapes)
@@ -1016,6 +1173,16 @@ class SignedDistance2DMap(DifferentiableMap):
     def hessian(self, x):
         return np.matrix(self._shape.dist_hessian(x))
 
+    def forward_batch(self, X):
+        d = self._shape.dist_from_border(X.T.reshape(2, -1, 1))
+        return np.asarray(d).reshape(len(X), 1)
+
+    def jacobian_batch(self, X):
+        return self._shape.dist_gradient_batch(X)[:, np.newaxis, :]
+
+    def hessian_batch(self, X):
+        return self._shape.dist_hessian_batch(X)
+
 
 class SignedDistanceWorkspaceMap(DifferentiableMap):
     """
@@ -1054,6 +1221,151 @@ class SignedDistanceWorkspaceMap(DifferentiableMap):
         J_mindist = np.matrix(g_mindist).reshape((1, 2))
         return [mindist, J_mindist]
 
+    def forward_batch(self, X):
+        return self._workspace.min_dist_batch(X)[0].reshape(len(X), 1)
+
+    def jacobian_batch(self, X):
+        """ Warning: this gradient is ill defined
+            it has a kink when two objects are at the same distance """
+        [mindist, minid] = self._workspace.min_dist_batch(X)
+        J = np.zeros((len(X), 1, 2))
+        for i in np.unique(minid):
+            closest = minid == i
+            J[closest, 0, :] = self._workspace.obstacles[
+                i].dist_gradient_batch(X[closest])
+        return J
+
+    def hessian_batch(self, X):
+        """ Warning: this hessian is ill defined
+            it has a kink when two objects are at the same distance """
+        [mindist, minid] = self._workspace.min_dist_batch(X)
+        H = np.zeros((len(X), 2, 2))
+        for i in np.unique(minid):
+            closest = minid == i
+            H[closest] = self._workspace.obstacles[
+                i].dist_hessian_batch(X[closest])
+        return H
+
+
+class CachedSignedDistanceField(DifferentiableMap):
+    """
+        Signed distance field of a workspace rasterized once on a regular
+        grid of nb_points x nb_points nodes spanning the workspace box.
+        Queries are served by interpolation of the grid values
+        (bicubic spline by default, or bilinear), which avoids looping
+        over the obstacles at every call.
+
+        The raster is recomputed lazily whenever the list of obstacles
+        of the workspace changes. Modifying an obstacle in place is not
+        detected, call invalidate() in that case.
+
+        Note: the interpolation is only accurate inside the workspace box.
+    """
+
+    def __init__(self, workspace, nb_points=100, method="bicubic"):
+        assert method in ["bilinear", "bicubic"]
+        assert nb_points > 3
+        self._workspace = workspace
+        self._nb_points = nb_points
+        self._degree = 1 if method == "bilinear" else 3
+        self._obstacles = None
+        self._nodes = None
+        self._values = None
+        self._interp_spline = None
+
+    def output_dimension(self):
+        return 1
+
+    def input_dimension(self):
+        return 2
+
+    def nodes(self):
+        """ grid nodes along the x and y axis """
+        extent = self._workspace.box.extent()
+        x = np.linspace(extent.x_min, extent.x_max, self._nb_points)
+        y = np.linspace(extent.y_min, extent.y_max, self._nb_points)
+        return x, y
+
+    def is_valid(self):
+        return (self._values is not None and
+                self._obstacles == tuple(self._workspace.obstacles))
+
+    def invalidate(self):
+        self._values = None
+
+    def rasterize(self):
+        """ Evaluates the signed distance field on the grid nodes using
+            the element wise query of the workspace """
+        self._obstacles = tuple(self._workspace.obstacles)
+        self._nodes = self.nodes()
+        X, Y = np.meshgrid(*self._nodes)
+        self._values = self._workspace.min_dist(np.stack([X, Y]))[0].T
+        if self._degree == 3:
+            self._interp_spline = RectBivariateSpline(
+                *self._nodes, self._values)
+
+    def _ev(self, X, dx=0, dy=0):
+        """ Evaluates the interpolant (or its partial derivatives)
+            on N points stacked row-wise (N x 2) """
+        if not self.is_valid():
+            self.rasterize()
+        if self._degree == 3:
+            return self._interp_spline.ev(X[:, 0], X[:, 1], dx=dx, dy=dy)
+        return self._bilinear(X, dx, dy)
+
+    def _bilinear(self, X, dx, dy):
+        if dx > 1 or dy > 1:
+            return np.zeros(len(X))
+        x, y = self._nodes
+        return bilinear_interpolation(
+            self._values, (x[0], y[0]), (x[1] - x[0], y[1] - y[0]),
+            X, dx, dy)
+
+    def forward(self, x):
+        if x.shape == (2,):
+            return float(self._ev(x.reshape(1, 2))[0])
+        """ Here we handle element wise querry (2 x n x m) """
+        d = self._ev(x.reshape(2, -1).T)
+        return d.reshape(x.shape[1:])
+
+    def jacobian(self, x):
+        return np.matrix(self.jacobian_batch(x.reshape(1, 2))[0])
+
+    def hessian(self, x):
+        return np.matrix(self.hessian_batch(x.reshape(1, 2))[0])
+
+    def forward_batch(self, X):
+        return self._ev(X).reshape(len(X), 1)
+
+    def jacobian_batch(self, X):
+        J = np.empty((len(X), 1, 2))
+        J[:, 0, 0] = self._ev(X, dx=1)
+        J[:, 0, 1] = self._ev(X, dy=1)
+        return J
+
+    def hessian_batch(self, X):
+        H = np.empty((len(X), 2, 2))
+        H[:, 0, 0] = self._ev(X, dx=2)
+        H[:, 0, 1] = self._ev(X, dx=1, dy=1)
+        H[:, 1, 0] = H[:, 0, 1]
+        H[:, 1, 1] = self._ev(X, dy=2)
+        return H
+
+    def max_error(self, nb_points=None):
+        """ Maximum absolute difference with the exact signed distance
+            field, by default measured at the center of the grid cells
+            which is where the interpolation error is the largest """
+        x, y = self.nodes()
+        if nb_points is None:
+            x = .5 * (x[1:] + x[:-1])
+            y = .5 * (y[1:] + y[:-1])
+        else:
+            x = np.linspace(x[0], x[-1], nb_points)
+            y = np.linspace(y[0], y[-1], nb_points)
+        X = np.stack(np.meshgrid(x, y))
+        sdf = self._workspace.min_dist(X)[0]
+        return np.max(np.abs(self.forward(X) - sdf))
+
 
 def occupancy_map(nb_points, workspace):
     """ Returns an occupancy map in the form of a square matrix
@@ -1147,10 +1459,117 @@ def pixelmap_from_box(nb_points, box):
     return PixelMap(resolution, extent)
 
 
+class ObstacleGridIndex:
+    """
+    Uniform grid bucketing of the obstacles of a 2D workspace.
+
+    Each cell of the grid stores the obstacles that can be the closest
+    to a point of the cell: those whose bounding box is closer to the
+    cell than an upper bound of the minimum distance over the cell.
+    The signed distance field being 1-Lipschitz, that upper bound is
+    the distance at the center of the cell plus its half diagonal.
+    Points outside of the grid are tested against all obstacles.
+
+    The queries evaluate the remaining obstacles in the order of the
+    workspace, hence return the same distances and obstacle ids as
+    the brute force loop in Workspace.min_dist.
+
+    Attributes
+    ----------
+    obstacles : tuple
+        the indexed Shape objects
+    """
+
+    def __init__(self, obstacles, extent, nb_cells=16):
+        self.obstacles = tuple(obstacles)
+        self._nb_cells = nb_cells
+        self._origin = np.array([extent.x_min, extent.y_min])
+        self._cell_dim = np.array([extent.x(), extent.y()]) / nb_cells
+        corners = np.array([o.bounding_box() for o in self.obstacles])
+        i, j = np.meshgrid(np.arange(nb_cells), np.arange(nb_cells),
+                           indexing="ij")
+        cells_lower = (self._origin +
+                       self._cell_dim * np.vstack([i.ravel(), j.ravel()]).T)
+        cells_upper = cells_lower + self._cell_dim
+        centers = .5 * (cells_lower + cells_upper)
+
+        # Upper bound of the minimum distance over each cell
+        d_center = np.full(len(centers), np.inf)
+        for obst in self.obstacles:
+            d = obst.dist_from_border(centers.T.reshape(2, -1, 1))
+            d_center = np.minimum(d_center, np.asarray(d).reshape(-1))
+        upper_bound = d_center + .5 * np.linalg.norm(self._cell_dim)
+        upper_bound += 1e-9 * (1. + np.abs(upper_bound))
+
+        # Lower bound of the obstacle distances over each cell, given
+        # by the distance to the bounding box and when the cell overlaps
+        # the bounding box, by the largest penetration in that box
+        gap = np.maximum(
+            corners[np.newaxis, :, 0] - cells_upper[:, np.newaxis],
+            cells_lower[:, np.newaxis] - corners[np.newaxis, :, 1])
+        penetration = .5 * (corners[:, 1] - corners[:, 0]).min(axis=1)
+        lower_bound = np.where(
+            np.all(gap <= 0., axis=2), -penetration,
+            np.linalg.norm(np.maximum(gap, 0.), axis=2))
+
+        self._candidates = np.vstack([
+            lower_bound <= upper_bound[:, np.newaxis],
+            np.full((1, len(self.obstacles)), True)])
+
+    def cells(self, X):
+        """ Cell ids of N points stacked row-wise (N x 2),
+            points outside of the grid are mapped to the last id """
+        ij = np.floor((X - self._origin) / self._cell_dim).astype(int)
+        inside = np.all((ij >= 0) & (ij < self._nb_cells), axis=1)
+        return np.where(
+            inside, ij[:, 0] * self._nb_cells + ij[:, 1],
+            self._nb_cells ** 2)
+
+    def candidates(self, pt):
+        """ Ids of the obstacles that can be the closest to pt """
+        return np.flatnonzero(self._candidates[self.cells(
+            pt.reshape(1, 2))[0]])
+
+    def nb_candidates(self):
+        """ Average number of candidate obstacles in the grid cells """
+        return self._candidates[:-1].sum(axis=1).mean()
+
+    def min_dist(self, pt):
+        """ Minimum distance and closest obstacle id of a single point """
+        d_m = float("inf")
+        i_m = -1
+        for i in self.candidates(pt):
+            d = self.obstacles[i].dist_from_border(pt)
+            closer_to_i = d < d_m
+            d_m = np.where(closer_to_i, d, d_m)
+            i_m = np.where(closer_to_i, i, i_m)
+        return [d_m, i_m]
+
+    def min_dist_batch(self, X):
+        """ Minimum distances and closest obstacle ids
+            of N points stacked row-wise (N x 2) """
+        candidates = self._candidates[self.cells(X)]
+        d_m = np.full(len(X), np.inf)
+        i_m = np.full(len(X), -1)
+        for i in np.flatnonzero(candidates.any(axis=0)):
+            rows = np.flatnonzero(candidates[:, i])
+            d = self.obstacles[i].dist_from_border(
+                X[rows].T.reshape(2, -1, 1))
+            d = np.asarray(d).reshape(-1)
+            closer_to_i = d < d_m[rows]
+            d_m[rows[closer_to_i]] = d[closer_to_i]
+            i_m[rows[closer_to_i]] = i
+        return [d_m, i_m]
+
+
 class Workspace:
     """
     Contains obstacles.
 
+    When it contains at least min_obstacles_to_index obstacles
+    the distance queries go through an ObstacleGridIndex, which
+    is rebuilt when the list of obstacles changes.
+
     Attributes
     ----------
     box : EnvBox
@@ -1159,14 +1578,35 @@ class Workspace:
         a list of Shape objects (ex: Circle, Box, ...)
     """
 
+    min_obstacles_to_index = 10
+
     def __init__(self, box=EnvBox()):
         self.box = box
         self.obstacles = []
+        self._indexed_obstacles = ()
+        self._index = None
 
     def nb_obstacles(self):
         return len(self.obstacles)
 
+    def spatial_index(self):
+        """ Returns the obstacle index, None if the workspace has too
+            few obstacles or some of them have no bounding box """
+        obstacles = tuple(self.obstacles)
+        if obstacles != self._indexed_obstacles:
+            self._indexed_obstacles = obstacles
+            self._index = None
+            if len(obstacles) >= self.min_obstacles_to_index:
+                try:
+                    self._index = ObstacleGridIndex(
+                        obstacles, self.box.extent())
+                except NotImplementedError:
+                    pass
+        return self._index
+
     def in_collision(self, pt):
+        if self.spatial_index() is not None:
+            return self.min_dist(pt)[0] < 0.
         for obst in self.obstacles:
             if obst.dist_from_border(pt) < 0.:
                 return True
@@ -1176,6 +1616,16 @@ class Workspace:
         return lambda p: self.min_dist(p)[0]
 
     def min_dist(self, pt):
+        index = self.spatial_index()
+        if index is not None:
+            if pt.shape == (2,):
+                return index.min_dist(pt)
+            [d_m, i_m] = index.min_dist_batch(pt.reshape(2, -1).T)
+            return [d_m.reshape(pt.shape[1:]), i_m.reshape(pt.shape[1:])]
+        return self.min_dist_brute_force(pt)
+
+    def min_dist_brute_force(self, pt):
+        """ Loops over all obstacles """
         if pt.shape == (2,):
             d_m = float("inf")
             i_m = -1
@@ -1193,6 +1643,12 @@ class Workspace:
 
         return [d_m, i_m]
 
+    def min_dist_batch(self, X):
+        """ Minimum distances and closest obstacle ids
+            of N points stacked row-wise (N x 2) """
+        [d_m, i_m] = self.min_dist(X.T.reshape(2, -1, 1))
+        return [d_m.reshape(len(X)), i_m.reshape(len(X))]
+
     def min_dist_gradient(self, pt):
         """ Warning: this gradient is ill defined
             it has a kink when two objects are at the same distance """
@@ -0,0 +1,7 @@
+
+import sys
+import os
+import numpy as np
+
+directory = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, directory + os.sep + "..")
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2018, University of Stuttgart
+# All rights reserved.
+#
+# Permission to use, copy, modify, and distribute this software for any purpose
+# with or without   fee is hereby granted, provided   that the above  copyright
+# notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS  SOFTWARE INCLUDING ALL  IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR  BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR  ANY DAMAGES WHATSOEVER RESULTING  FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION,   ARISING OUT OF OR IN    CONNECTION WITH THE USE   OR
+# PERFORMANCE OF THIS SOFTWARE.
+#
+#                                        Jim Mainprice on Sunday June 13 2018
+
+from .__init__ import *
+from geometry.differentiable_geometry import *
+from geometry.pixel_map import *
+import numpy as np
+import heapq
+
+SQRT2 = 1.4142135623730951
+
+
+def fast_marching(costmap, s_i, s_j, resolution=1.):
+    """
+        Solves the Eikonal equation |grad T| = costmap on the grid with
+        the fast marching method (first order upwind scheme), T being
+        the cost-to-go to the source cell (s_i, s_j). Cells of infinite
+        cost are never reached and keep an infinite cost-to-go.
+
+        costmap : matrix of costs, cost[i, j] of the cell (i, j)
+        resolution : size of the cells
+    """
+    M, N = costmap.shape
+    # padded grid in row major order, the border is never accepted
+    stride = N + 2
+    cost = np.full((M + 2, N + 2), np.inf)
+    cost[1:-1, 1:-1] = resolution * costmap
+    cost = cost.ravel().tolist()
+    known = [np.inf] * len(cost)
+    values = [np.inf] * len(cost)
+    source = (s_i + 1) * stride + s_j + 1
+    values[source] = 0.
+    heap = [(0., source)]
+    while heap:
+        t, u = heapq.heappop(heap)
+        if known[u] != np.inf:
+            continue
+        known[u] = t
+        for v in (u - stride, u + stride, u - 1, u + 1):
+            f = cost[v]
+            if known[v] != np.inf or f == np.inf:
+                continue
+            a = min(known[v - stride], known[v + stride])
+            b = min(known[v - 1], known[v + 1])
+            if abs(a - b) >= f:
+                t_v = min(a, b) + f
+            else:
+                t_v = .5 * (a + b + np.sqrt(2. * f * f - (a - b) ** 2))
+            if t_v < values[v]:
+                values[v] = t_v
+                heapq.heappush(heap, (t_v, v))
+    return np.array(known).reshape(M + 2, N + 2)[1:-1, 1:-1]
+
+
+class CostToGoField(PixelGridBilinearInterpolation):
+    """
+        Continuous cost-to-go defined by bilinear interpolation of the
+        values at the center of the cells of a PixelMap, as returned
+        by fast_marching. The gradient points away from the source.
+    """
+
+
+def line_cells(p1, p2):
+    """ Cells traversed by the segment between the centers of two cells,
+        one cell per step along the major axis (Bresenham) """
+    d = np.subtract(p2, p1)
+    nb_steps = max(abs(d[0]), abs(d[1]))
+    t = np.linspace(0., 1., nb_steps + 1)
+    i = np.rint(p1[0] + t * d[0]).astype(int)
+    j = np.rint(p1[1] + t * d[1]).astype(int)
+    return i, j
+
+
+def line_cost(costmap, p1, p2):
+    """ Integral of the cost along the segment between the centers
+        of two cells (trapezoidal rule over the traversed cells),
+        for neighbor cells it is the length times the average cost """
+    costs = costmap[line_cells(p1, p2)]
+    length = np.sqrt((p2[0] - p1[0]) ** 2 + (p2[1] - p1[1]) ** 2)
+    return length * (costs.sum() - .5 * (costs[0] + costs[-1])) / (
+        len(costs) - 1)
+
+
+def line_of_sight(costmap, p1, p2):
+    """ True if no cell of infinite cost is traversed by the segment """
+    return bool(np.isfinite(costmap[line_cells(p1, p2)]).all())
+
+
+def theta_star(costmap, s_i, s_j, t_i, t_j, cost_to_go=None):
+    """
+        Any-angle shortest path on the costmap (Theta*)
+
+        Search on the 8-connected grid where the parent of a node can be
+        any node in line of sight, which is kept when going through it is
+        cheaper than going through the expanded node. Edges are weighted
+        by the integral of the cost along them (see line_cost). Returns
+        the waypoints of the path from target to source, as dijkstra.
+
+        cost_to_go : optional estimate of the cost to the target for all
+                     cells (e.g., from fast_marching), by default the
+                     Euclidean distance times the minimum cost is used.
+
+        A. Nash, K. Daniel, S. Koenig and A. Felner,
+        Theta*: Any-Angle Path Planning on Grids, AAAI 2007.
+    """
+    M, N = costmap.shape
+    if cost_to_go is None:
+        i, j = np.meshgrid(np.arange(M), np.arange(N), indexing="ij")
+        cost_to_go = np.min(costmap) * np.sqrt(
+            (i - t_i) ** 2 + (j - t_j) ** 2)
+    h = cost_to_go
+    source, target = (s_i, s_j), (t_i, t_j)
+    offsets = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)
+               if di != 0 or dj != 0]
+    g = {source: 0.}
+    parents = {source: source}
+    closed = set()
+    heap = [(h[source], source)]
+    while heap:
+        f, u = heapq.heappop(heap)
+        if u == target:
+            path = [u]
+            while u != source:
+                u = parents[u]
+                path.append(u)
+            return path
+        if u in closed:
+            continue
+        closed.add(u)
+        p = parents[u]
+        for di, dj in offsets:
+            v = (u[0] + di, u[1] + dj)
+            if not (0 <= v[0] < M and 0 <= v[1] < N) or v in closed:
+                continue
+            c_v = costmap[v]
+            if c_v == np.inf:
+                continue
+            length = SQRT2 if di and dj else 1.
+            g_v, p_v = g[u] + length * .5 * (costmap[u] + c_v), u
+            if p != u and line_of_sight(costmap, p, v):
+                # ties (e.g., collinear nodes) are given to the parent
+                g_p = g[p] + line_cost(costmap, p, v)
+                if g_p <= g_v * (1. + 1e-9):
+                    g_v, p_v = g_p, p
+            if g_v < g.get(v, np.inf):
+                g[v] = g_v
+                parents[v] = p_v
+                heapq.heappush(heap, (g_v + h[v], v))
+    raise ValueError("no path between source and target")
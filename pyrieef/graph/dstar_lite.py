@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2018, University of Stuttgart
+# All rights reserved.
+#
+# Permission to use, copy, modify, and distribute this software for any purpose
+# with or without   fee is hereby granted, provided   that the above  copyright
+# notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS  SOFTWARE INCLUDING ALL  IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR  BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR  ANY DAMAGES WHATSOEVER RESULTING  FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION,   ARISING OUT OF OR IN    CONNECTION WITH THE USE   OR
+# PERFORMANCE OF THIS SOFTWARE.
+#
+#                                        Jim Mainprice on Sunday June 13 2018
+
+from .shortest_path import *
+import numpy as np
+import heapq
+
+
+class DStarLite:
+    """
+        Incremental shortest path on the graph of a costmap (D* Lite)
+
+        The search runs backward from the target so that the source
+        can move between queries. The search state (g and rhs values,
+        priority queue) is kept between calls to shortest_path, when
+        some cells of the costmap change only the part of the search
+        affected by the changed edges is repaired.
+
+        S. Koenig and M. Likhachev, D* Lite, AAAI 2002.
+    """
+
+    def __init__(self, costmap, average_cost=False, integral_cost=False):
+        self.converter = CostmapToSparseGraph(costmap, average_cost)
+        self.converter.integral_cost = integral_cost
+        graph = self.converter.convert()
+        self._indptr = graph.indptr.tolist()
+        self._indices = graph.indices.tolist()
+        self._reverse = self.converter._edges_reverse.tolist()
+        self._costs = graph.data.tolist()
+        self._source_id = None
+        self._target_id = None
+
+    def initialize(self, s_i, s_j, t_i, t_j):
+        """ Resets the search state for a source and target """
+        nb_nodes = self.converter._graph.shape[0]
+        self._source_id = self.converter.graph_id(s_i, s_j)
+        self._target_id = self.converter.graph_id(t_i, t_j)
+        self._scale = self.converter.heuristic_scale()
+        self._h = self.converter.heuristic(s_i, s_j, self._scale).tolist()
+        self._km = 0.
+        self._g = [np.inf] * nb_nodes
+        self._rhs = [np.inf] * nb_nodes
+        self._rhs[self._target_id] = 0.
+        self._open = {}
+        self._heap = []
+        self._push(self._target_id)
+        self.nb_expansions = 0
+
+    def _key(self, u):
+        k = min(self._g[u], self._rhs[u])
+        return (k + self._h[u] + self._km, k)
+
+    def _push(self, u):
+        key = self._key(u)
+        self._open[u] = key
+        heapq.heappush(self._heap, (key, u))
+
+    def _top(self):
+        """ Removes the outdated entries on top of the heap """
+        heap = self._heap
+        while heap and self._open.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else ((np.inf, np.inf), None)
+
+    def _rhs_from_successors(self, u):
+        g, costs, indices = self._g, self._costs, self._indices
+        rhs = np.inf
+        for k in range(self._indptr[u], self._indptr[u + 1]):
+            c = costs[k] + g[indices[k]]
+            if c < rhs:
+                rhs = c
+        return rhs
+
+    def _update_vertex(self, u):
+        if self._g[u] != self._rhs[u]:
+            if self._open.get(u) != self._key(u):
+                self._push(u)
+        else:
+            self._open.pop(u, None)
+
+    def compute_shortest_path(self):
+        """ Expands the inconsistent nodes until the source is consistent,
+            optimized version of D* Lite (Fig. 4 of the paper) """
+        s = self._source_id
+        g, rhs, costs = self._g, self._rhs, self._costs
+        indptr, indices, reverse = self._indptr, self._indices, self._reverse
+        open_list = self._open
+        while True:
+            key_old, u = self._top()
+            if u is None or (key_old >= self._key(s) and g[s] == rhs[s]):
+                break
+            self.nb_expansions += 1
+            key_new = self._key(u)
+            if key_old < key_new:
+                self._push(u)
+            elif g[u] > rhs[u]:
+                g_u = g[u] = rhs[u]
+                del open_list[u]
+                # the pattern of the graph is symmetric, the neighbors
+                # of u are also its predecessors
+                for k in range(indptr[u], indptr[u + 1]):
+                    p = indices[k]
+                    c = costs[reverse[k]] + g_u
+                    if c < rhs[p] and p != self._target_id:
+                        rhs[p] = c
+                        self._update_vertex(p)
+            else:
+                g_old = g[u]
+                g[u] = np.inf
+                for k in range(indptr[u], indptr[u + 1]):
+                    p = indices[k]
+                    if (rhs[p] == costs[reverse[k]] + g_old and
+                            p != self._target_id):
+                        rhs[p] = self._rhs_from_successors(p)
+                    self._update_vertex(p)
+                if rhs[u] == g_old and u != self._target_id:
+                    rhs[u] = self._rhs_from_successors(u)
+                self._update_vertex(u)
+
+    def move_source(self, s_i, s_j):
+        """ Moves the source keeping the search state """
+        source_id = self.converter.graph_id(s_i, s_j)
+        self._km += self._h[source_id]
+        self._h = self.converter.heuristic(s_i, s_j, self._scale).tolist()
+        self._source_id = source_id
+
+    def update_costmap(self, costmap, cells=None):
+        """
+            Updates the edges of the graph of the costmap
+
+            costmap : the new matrix of costs
+            cells : costmap coordinates (i, j) of the cells that changed,
+                    when not given all edges are compared.
+        """
+        converter = self.converter
+        converter.costmap = costmap
+        data = converter._graph.data
+        if cells is None:
+            edges = np.arange(data.size)
+        else:
+            cells = np.asarray(cells, dtype=int).reshape(-1, 2)
+            nodes = converter.graph_id(cells[:, 0], cells[:, 1])
+            indptr = converter._graph.indptr
+            starts, counts = indptr[nodes], indptr[nodes + 1] - indptr[nodes]
+            edges = np.arange(counts.sum()) + np.repeat(
+                starts - np.cumsum(counts) + counts, counts)
+            edges = np.union1d(edges, converter._edges_reverse[edges])
+        costs = converter.edges_costs(costmap, edges)
+        changed = costs != data[edges]
+        edges, costs = edges[changed], costs[changed]
+        data[edges] = costs
+        if self._source_id is None or (
+                converter.heuristic_scale() < self._scale):
+            # not initialized or heuristic no longer admissible
+            self._costs = data.tolist()
+            if self._source_id is not None:
+                self.initialize(*(converter.costmap_id(self._source_id) +
+                                  converter.costmap_id(self._target_id)))
+            return
+        rows = np.searchsorted(
+            converter._graph.indptr, edges, side="right") - 1
+        g, rhs, c_old = self._g, self._rhs, self._costs
+        for u, k, c in zip(rows.tolist(), edges.tolist(), costs.tolist()):
+            v = self._indices[k]
+            if u == self._target_id:
+                c_old[k] = c
+            elif c_old[k] > c:
+                c_old[k] = c
+                if c + g[v] < rhs[u]:
+                    rhs[u] = c + g[v]
+                    self._update_vertex(u)
+            elif rhs[u] == c_old[k] + g[v]:
+                c_old[k] = c
+                rhs[u] = self._rhs_from_successors(u)
+                self._update_vertex(u)
+            else:
+                c_old[k] = c
+
+    def path(self):
+        """ Extracts the path from source to target greedily
+            and returns it as in dijkstra (from target to source) """
+        u = self._source_id
+        if self._g[u] == np.inf:
+            raise ValueError("no path between source and target")
+        g, costs, indices = self._g, self._costs, self._indices
+        path = [self.converter.costmap_id(u)]
+        while u != self._target_id:
+            k = min(range(self._indptr[u], self._indptr[u + 1]),
+                    key=lambda k: costs[k] + g[indices[k]])
+            u = indices[k]
+            path.append(self.converter.costmap_id(u))
+        return path[::-1]
+
+    def shortest_path(self, s_i, s_j, t_i, t_j):
+        """
+            Returns the shortest path from source to target on the
+            current costmap, the search state is reused when the
+            target did not change.
+
+            s_i, s_j : source coordinate on the costmap
+            t_i, t_j : target coordinate on the costmap
+        """
+        if self._target_id != self.converter.graph_id(t_i, t_j):
+            self.initialize(s_i, s_j, t_i, t_j)
+        elif self._source_id != self.converter.graph_id(s_i, s_j):
+            self.move_source(s_i, s_j)
+        self.compute_shortest_path()
+        return self.path()
+
+    def shortest_path_on_map(self, costmap, s_i, s_j, t_i, t_j, cells=None):
+        """
+            Repairs the shortest path after the costmap changed,
+            see update_costmap and shortest_path.
+        """
+        self.update_costmap(costmap, cells)
+        return self.shortest_path(s_i, s_j, t_i, t_j)
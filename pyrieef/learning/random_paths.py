@@ -47,6 +47,7 @@ MARGIN = .20
 OFFSET = 0.001
 TRAJ_LENGTH = 20
 DEFAULT_WS_FILE = '1k_small.hdf5'
+SEARCH = "dijkstra"  # or astar, bidirectional_dijkstra, theta_star
 
 
 def obsatcle_potential(workspace):
@@ -124,7 +125,8 @@ def sample_path(
         s = pixel_map.world_to_grid(s_w)
         t = pixel_map.world_to_grid(t_w)
         try:
-            path = graph.dijkstra_on_map(cost, s[0], s[1], t[0], t[1])
+            search = getattr(graph, SEARCH + "_on_map")
+            path = search(cost, s[0], s[1], t[0], t[1])
         except:
             print("Warning : error in dijkstra")
             resample = True
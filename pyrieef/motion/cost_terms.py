@@ -80,6 +80,20 @@ class SquaredNormDerivative(DifferentiableMap):
     def hessian(self, clique):
         return self._derivative.a().T * self._derivative.a()
 
+    def forward_batch(self, cliques):
+        d = self._derivative.forward_batch(cliques)
+        return .5 * np.sum(d ** 2, axis=1).reshape(len(cliques), 1)
+
+    def jacobian_batch(self, cliques):
+        d = self._derivative.forward_batch(cliques)
+        a = np.asarray(self._derivative.a())
+        return np.dot(d, a)[:, np.newaxis, :]
+
+    def hessian_batch(self, cliques):
+        a = np.asarray(self._derivative.a())
+        H = np.dot(a.T, a)
+        return np.broadcast_to(H, (len(cliques),) + H.shape).copy()
+
 
 class SquaredNormVelocity(SquaredNormDerivative):
 
@@ -154,6 +168,23 @@ class LogBarrierFunction(DifferentiableMap):
         H[0, 0] = self.mu / (x ** 2)
         return H
 
+    def _valid_batch(self, X):
+        x = np.asarray(X).reshape(len(X), 1)
+        d = x < self._margin
+        return d, np.where(d, 1., x)
+
+    def forward_batch(self, X):
+        d, x = self._valid_batch(X)
+        return np.where(d, np.inf, -self.mu * np.log(x))
+
+    def jacobian_batch(self, X):
+        d, x = self._valid_batch(X)
+        return np.where(d, 0., -self.mu / x)[:, :, np.newaxis]
+
+    def hessian_batch(self, X):
+        d, x = self._valid_batch(X)
+        return np.where(d, 0., self.mu / (x ** 2))[:, :, np.newaxis]
+
 
 class BoundBarrier(DifferentiableMap):
 
@@ -227,6 +258,35 @@ class BoundBarrier(DifferentiableMap):
             H[i, i] += self._alpha / (u_dist ** 2)
         return H
 
+    def _distances_batch(self, X):
+        """ distances to the bounds, replaced by 1 outside of the limits
+            where the barrier is infinite and its derivatives zero """
+        l_dist = X - self._v_lower
+        u_dist = self._v_upper - X
+        outside = np.logical_or(
+            np.any(l_dist < self._margin, axis=1),
+            np.any(u_dist < self._margin, axis=1))
+        l_dist[outside] = 1.
+        u_dist[outside] = 1.
+        return outside, l_dist, u_dist
+
+    def forward_batch(self, X):
+        outside, l_dist, u_dist = self._distances_batch(X)
+        value = -self._alpha * np.sum(np.log(l_dist) + np.log(u_dist), axis=1)
+        return np.where(outside, self._inf, value).reshape(len(X), 1)
+
+    def jacobian_batch(self, X):
+        outside, l_dist, u_dist = self._distances_batch(X)
+        J = -self._alpha / l_dist + self._alpha / u_dist
+        J[outside] = 0.
+        return J[:, np.newaxis, :]
+
+    def hessian_batch(self, X):
+        outside, l_dist, u_dist = self._distances_batch(X)
+        h = self._alpha / (l_dist ** 2) + self._alpha / (u_dist ** 2)
+        h[outside] = 0.
+        return h[:, :, np.newaxis] * np.eye(self.input_dimension())
+
 
 class SimplePotential2D(DifferentiableMap):
 
@@ -265,6 +325,25 @@ class SimplePotential2D(DifferentiableMap):
         J_sdf_sq = J_sdf.T * J_sdf
         return rho * (self._alpha**2 * J_sdf_sq - self._alpha * H_sdf)
 
+    def _rho_batch(self, X):
+        d_obs = self._sdf.forward_batch(X) - self._margin
+        return self._rho_scaling * np.exp(-self._alpha * d_obs)
+
+    def forward_batch(self, X):
+        return self._rho_scaling * np.exp(
+            -self._alpha * self._sdf.forward_batch(X))
+
+    def jacobian_batch(self, X):
+        rho = self._rho_batch(X)[:, :, np.newaxis]
+        return -self._alpha * rho * self._sdf.jacobian_batch(X)
+
+    def hessian_batch(self, X):
+        rho = self._rho_batch(X)[:, :, np.newaxis]
+        J_sdf = self._sdf.jacobian_batch(X)
+        H_sdf = self._sdf.hessian_batch(X)
+        J_sdf_sq = np.matmul(np.swapaxes(J_sdf, 1, 2), J_sdf)
+        return rho * (self._alpha**2 * J_sdf_sq - self._alpha * H_sdf)
+
 
 class CostGridPotential2D(SimplePotential2D):
 
@@ -280,6 +359,9 @@ class CostGridPotential2D(SimplePotential2D):
         d_obs = self._sdf.forward(x) - self._margin
         return self._rho_scaling * np.exp(-self._alpha * d_obs) + self._offset
 
+    def forward_batch(self, X):
+        return self._rho_batch(X) + self._offset
+
 
 class ObstaclePotential2D(DifferentiableMap):
 
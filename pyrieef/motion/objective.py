@@ -328,9 +328,9 @@ class MotionOptimization2DCostMap:
             res = optimize.minimize(
                 x0=np.array(xi),
                 method='Newton-CG',
-                fun=self.objective.forward,
-                jac=self.objective.gradient,
-                hess=self.objective.hessian,
+                fun=self.objective.value_grad,
+                jac=True,
+                hessp=self.objective.hessian_vector_product,
                 options={'maxiter': nb_steps, 'disp': self.verbose}
             )
             trajectory.active_segment()[:] = res.x
@@ -19,8 +19,10 @@
 
 from .__init__ import *
 from geometry.differentiable_geometry import *
+from geometry.expression_graph import CompiledMap
 from geometry.utils import *
 from scipy.interpolate import interp1d
+from scipy import sparse
 
 
 class FunctionNetwork(DifferentiableMap):
@@ -69,6 +71,17 @@ class CliquesFunctionNetwork(FunctionNetwork):
         for i in range(self._nb_cliques):
             self._functions[i] = []
 
+        # Functions registered for all cliques are evaluated at once
+        # on the stacked cliques, the others are evaluated clique by clique.
+        # self._functions holds all of them for each clique.
+        self._all_cliques_functions = []
+        self._all_cliques_plan = None
+        self._clique_functions = [[] for _ in range(self._nb_cliques)]
+        c_ids = clique_element_dim * np.arange(self._nb_cliques)
+        self._cliques_indices = c_ids[:, None] + np.arange(self._clique_dim)
+        self._hessian_indices = None
+        self._revision = 0
+
     def output_dimension(self):
         return 1
 
@@ -78,14 +91,21 @@ class CliquesFunctionNetwork(FunctionNetwork):
     def nb_cliques(self):
         return self._nb_cliques
 
+    def revision(self):
+        """ incremented each time a function is registered or
+            the network is invalidated """
+        return self._revision
+
+    def invalidate(self):
+        """ Modifying a registered function in place (e.g., moving the
+            obstacles or scaling a potential) is not detected, call
+            invalidate() in that case so that the compiled plan and
+            the memo of the objectives on this network are recomputed """
+        self._revision += 1
+
     def forward(self, x):
         """ We call over all subfunctions in each clique"""
-        value = 0.
-        for t, x_t in enumerate(self.all_cliques(x)):
-            # print("x_c[{}] : {}".format(t, x_t))
-            for f in self._functions[t]:
-                value += f.forward(x_t)
-        return value
+        return self.value_grad_hess(x, True, False, False)[0]
 
     def jacobian(self, x):
         """
@@ -98,31 +118,135 @@ class CliquesFunctionNetwork(FunctionNetwork):
             The sub jacobian of the maps are the sum of clique jacobians
             each clique function f : R^dim -> R, where dim is the clique size.
         """
-        J = np.matrix(np.zeros((
-            self.output_dimension(),
-            self.input_dimension())))
-        for t, x_t in enumerate(self.all_cliques(x)):
-            for f in self._functions[t]:
-                assert f.output_dimension() == self.output_dimension()
-                c_id = t * self._clique_element_dim
-                J[0, c_id:c_id + self._clique_dim] += f.jacobian(x_t)
-        return J
+        return np.matrix(self.value_grad_hess(x, False, True, False)[1])
 
     def hessian(self, x):
         """
             The hessian matrix is of dimension m x m
                 m (rows) : input size
                 m (cols) : input size
+            This is the dense version of hessian_sparse.
+        """
+        return np.matrix(self.hessian_sparse(x).toarray())
+
+    def hessian_sparse(self, x):
+        """
+            The hessian matrix is of dimension m x m
+                m (rows) : input size
+                m (cols) : input size
+            Each clique only couples consecutive configurations, hence
+            the hessian is banded (block tridiagonal in cliques) and is
+            returned as a scipy.sparse.csr_matrix.
+        """
+        return self.value_grad_hess(x, False, False, True)[2]
+
+    def hessian_vector_product(self, x, v):
+        """
+            Product of the hessian with the vector v (input size),
+            computed clique by clique with the hessian vector products
+            of the registered functions and summed with the same
+            indices as the gradient. The hessian is never formed.
+        """
+        dim = self._clique_dim
+        Hv = np.zeros(self.input_dimension())
+        if self._all_cliques_functions:
+            X = self.stacked_cliques(x)
+            V = self.stacked_cliques(v)
+            Hv_cliques = np.zeros(X.shape)
+            for f, k in self._all_cliques_functions:
+                Hv_cliques += k * f.hessian_vector_product_batch(X, V)
+            Hv += np.bincount(
+                self._cliques_indices.ravel(),
+                weights=Hv_cliques.ravel(),
+                minlength=self.input_dimension())
+
+        v = np.asarray(v).reshape(self._input_size)
+        for t, functions in enumerate(self._clique_functions):
+            if not functions:
+                continue
+            x_t = self.clique(x, t)
+            v_t = self.clique(v, t)
+            c_id = t * self._clique_element_dim
+            for f in functions:
+                Hv[c_id:c_id + dim] += f.hessian_vector_product(x_t, v_t)
+        return Hv
+
+    def value_grad_hess(self, x, value=True, gradient=True, hessian=True):
+        """
+            Returns the value, the gradient (array) and the sparse hessian
+            in one pass, so that the cliques are only split once.
+            The quantities that are not requested are returned as None.
         """
-        H = np.matrix(np.zeros((
-            self.input_dimension(),
-            self.input_dimension())))
         dim = self._clique_dim
-        for t, x_t in enumerate(self.all_cliques(x)):
+        v = 0. if value else None
+        g = np.zeros(self.input_dimension()) if gradient else None
+        H_cliques = np.zeros((self._nb_cliques, dim, dim)) if hessian else None
+
+        if self._all_cliques_functions:
+            V, J_cliques, H = self.all_cliques_plan().value_grad_hess_batch(
+                self.stacked_cliques(x), value, gradient, hessian)
+            if value:
+                v += np.sum(V)
+            if gradient:
+                g += np.bincount(
+                    self._cliques_indices.ravel(),
+                    weights=J_cliques[:, 0, :].ravel(),
+                    minlength=self.input_dimension())
+            if hessian:
+                H_cliques += H
+
+        for t, functions in enumerate(self._clique_functions):
+            if not functions:
+                continue
+            x_t = self.clique(x, t)
             c_id = t * self._clique_element_dim
-            for f in self._functions[t]:
-                H[c_id:c_id + dim, c_id:c_id + dim] += f.hessian(x_t)
-        return H
+            for f in functions:
+                assert f.output_dimension() == self.output_dimension()
+                if value:
+                    v += f.forward(x_t)
+                if gradient:
+                    g[c_id:c_id + dim] += np.asarray(
+                        f.jacobian(x_t)).reshape(dim)
+                if hessian:
+                    H_cliques[t] += f.hessian(x_t)
+
+        H = self.assemble_clique_hessians(H_cliques) if hessian else None
+        return v, g, H
+
+    def all_cliques_plan(self):
+        """
+            Sum of the functions registered for all cliques compiled in
+            a single evaluation plan (see CompiledMap), so that the terms
+            share the slicing of the cliques and a single forward pass.
+            The plan is traced again when a function is registered.
+        """
+        if (self._all_cliques_plan is None or
+                self._all_cliques_plan[0] != self._revision):
+            plan = CompiledMap(SumOfTerms([
+                Scale(f, k) for f, k in self._all_cliques_functions]))
+            assert plan.output_dimension() == self.output_dimension()
+            self._all_cliques_plan = (self._revision, plan)
+        return self._all_cliques_plan[1]
+
+    def assemble_clique_hessians(self, H_cliques):
+        """
+            Sums the clique hessians (nb_cliques x dim x dim)
+            in a sparse matrix, overlapping entries are added up.
+        """
+        rows, cols = self._clique_hessian_indices()
+        m = self.input_dimension()
+        return sparse.coo_matrix(
+            (H_cliques.ravel(), (rows, cols)), shape=(m, m)).tocsr()
+
+    def _clique_hessian_indices(self):
+        """ row and column indices of all clique hessian entries """
+        if self._hessian_indices is None:
+            dim = self._clique_dim
+            ids = self._cliques_indices
+            rows = np.repeat(ids[:, :, None], dim, axis=2)
+            cols = np.repeat(ids[:, None, :], dim, axis=1)
+            self._hessian_indices = (rows.ravel(), cols.ravel())
+        return self._hessian_indices
 
     def clique_value(self, t, x_t):
         """
@@ -151,6 +275,15 @@ class CliquesFunctionNetwork(FunctionNetwork):
         c_id = t * self._clique_element_dim
         return H[c_id:c_id + dim, c_id:c_id + dim]
 
+    def clique(self, x, t):
+        """ returns clique t """
+        c_id = t * self._clique_element_dim
+        return x[c_id:c_id + self._clique_dim]
+
+    def stacked_cliques(self, x):
+        """ returns all cliques as an array (nb_cliques x clique dim) """
+        return np.asarray(x).reshape(self._input_size)[self._cliques_indices]
+
     def all_cliques(self, x):
         """ returns a list of all cliques """
         n = self._clique_element_dim
@@ -164,18 +297,31 @@ class CliquesFunctionNetwork(FunctionNetwork):
         """ Register function f for clique i """
         assert f.input_dimension() == self._clique_dim
         self._functions[t].append(f)
+        self._clique_functions[t].append(f)
+        self._revision += 1
 
     def register_function_for_all_cliques(self, f):
-        """ Register function f """
+        """ Register function f
+
+            The function is evaluated once on the stacked cliques,
+            registering the same function twice counts it twice. """
         assert f.input_dimension() == self._clique_dim
         for t in range(self._nb_cliques):
             self._functions[t].append(f)
+        self._revision += 1
+        for f_k in self._all_cliques_functions:
+            if f_k[0] is f:
+                f_k[1] += 1
+                return
+        self._all_cliques_functions.append([f, 1])
 
     def register_function_last_clique(self, f):
         """ Register function f """
         assert f.input_dimension() == self._clique_dim
         T = self._nb_cliques - 1
         self._functions[T].append(f)
+        self._clique_functions[T].append(f)
+        self._revision += 1
 
     def center_of_clique_map(self):
         """ x_{t} """
@@ -223,6 +369,17 @@ class TrajectoryObjectiveFunction(DifferentiableMap):
         we can take it out of the optimization and through away the gradient
         computed for that configuration.
 
+        The quantities computed for the last trajectory are memoized.
+        Each pass over the network computes the value and the gradient
+        together, the hessian is added by a second pass when it is
+        queried at the same trajectory, so that the callbacks of an
+        optimizer (e.g., scipy) evaluate the network at most twice per
+        trajectory, once for line search points.
+
+        The memo is reset when the trajectory, q_init or the functions
+        registered in the network change. Modifying a function in place
+        is not detected, call invalidate() in that case.
+
         TODO Test...
         """
 
@@ -230,6 +387,10 @@ class TrajectoryObjectiveFunction(DifferentiableMap):
         self._q_init = q_init
         self._n = q_init.size
         self._function_network = function_network
+        self._memo = {}
+        self._memo_x = None
+        self._memo_q_init = None
+        self._memo_revision = None
 
     def full_vector(self, x_active):
         assert x_active.size == (
@@ -246,17 +407,77 @@ class TrajectoryObjectiveFunction(DifferentiableMap):
         return self._function_network.input_dimension() - self._n
 
     def forward(self, x):
-        x_full = self.full_vector(x)
-        return min(1e100, self._function_network(x_full))
+        """ The gradient is computed along since optimizers query both """
+        return self._evaluate(x, value=True, gradient=True)['value']
+
+    def gradient(self, x):
+        return self._evaluate(x, value=True, gradient=True)['gradient'].copy()
+
+    def value_grad(self, x):
+        """ Returns the value and gradient, e.g., for scipy with jac=True """
+        memo = self._evaluate(x, value=True, gradient=True)
+        return memo['value'], memo['gradient'].copy()
 
     def jacobian(self, x):
-        x_full = self.full_vector(x)
-        return self._function_network.jacobian(x_full)[0, self._n:]
+        return np.matrix(self.gradient(x))
 
     def hessian(self, x):
-        x_full = self.full_vector(x)
-        H = self._function_network.hessian(x_full)[self._n:, self._n:]
-        return np.array(H)
+        return self.hessian_sparse(x).toarray()
+
+    def hessian_sparse(self, x):
+        """ Banded hessian of the active part of the trajectory """
+        return self._evaluate(x, hessian=True)['hessian'].copy()
+
+    def hessian_vector_product(self, x, v):
+        """ Product of the banded hessian of the active part with v
+
+            Newton-CG queries many products at the same x, hence the
+            clique hessians are memoized once per x instead of running
+            through the network for each product (see
+            CliquesFunctionNetwork.hessian_vector_product). """
+        return self._evaluate(x, hessian=True)['hessian'] @ np.ravel(v)
+
+    def value_grad_hess(self, x):
+        """ Returns the value, gradient and sparse hessian in one pass """
+        memo = self._evaluate(x, value=True, gradient=True, hessian=True)
+        return [memo['value'],
+                memo['gradient'].copy(),
+                memo['hessian'].copy()]
+
+    def invalidate(self):
+        """ Drops the memoized quantities (see CliquesFunctionNetwork) """
+        self._function_network.invalidate()
+
+    def _evaluate(self, x, value=False, gradient=False, hessian=False):
+        """
+        Computes the requested quantities that are not memoized yet,
+        along with the value and gradient when they are missing.
+        The memo is reset when x, q_init or the network changes.
+        """
+        revision = self._function_network.revision()
+        if (self._memo_x is None or
+                self._memo_revision != revision or
+                not np.array_equal(self._memo_x, x) or
+                not np.array_equal(self._memo_q_init, self._q_init)):
+            self._memo = {}
+            self._memo_x = np.array(x)
+            self._memo_q_init = np.array(self._q_init)
+            self._memo_revision = revision
+        value = value and 'value' not in self._memo
+        gradient = gradient and 'gradient' not in self._memo
+        hessian = hessian and 'hessian' not in self._memo
+        if value or gradient or hessian:
+            value = 'value' not in self._memo
+            gradient = 'gradient' not in self._memo
+            v, g, H = self._function_network.value_grad_hess(
+                self.full_vector(x), value, gradient, hessian)
+            if value:
+                self._memo['value'] = min(1e100, v)
+            if gradient:
+                self._memo['gradient'] = g[self._n:]
+            if hessian:
+                self._memo['hessian'] = H[self._n:, self._n:]
+        return self._memo
 
 
 class Trajectory:
@@ -28,12 +28,25 @@ def newton_optimize_trajectory(
         verbose=False,
         maxiter=15):
     t_start = time.time()
+    # Newton-CG only uses the hessian through matrix-vector products,
+    # banded objectives provide them without forming the hessian.
+    if (hasattr(objective, 'hessian_sparse') and
+            hasattr(objective, 'hessian_vector_product')):
+        hessian = {'hessp': objective.hessian_vector_product}
+    elif hasattr(objective, 'hessian_sparse'):
+        hessian = {'hess': objective.hessian_sparse}
+    else:
+        hessian = {'hess': objective.hessian}
+    # The value and gradient are computed in one pass when possible.
+    if hasattr(objective, 'value_grad'):
+        value_grad = {'fun': objective.value_grad, 'jac': True}
+    else:
+        value_grad = {'fun': objective.forward, 'jac': objective.gradient}
     res = optimize.minimize(
         x0=trajectory.active_segment(),
         method='Newton-CG',
-        fun=objective.forward,
-        jac=objective.gradient,
-        hess=objective.hessian,
+        **value_grad,
+        **hessian,
         tol=1e-9,
         options={'maxiter': maxiter, 'disp': verbose}
     )
@@ -21,11 +21,33 @@
 # where POMDP has been removed
 # https://github.com/aimacode/aima-python/blob/master/mdp.py
 
+import numpy as np
 import random
+import heapq
+from scipy.sparse import identity, diags
+from scipy.sparse.linalg import spsolve
 
 
-def value_iteration(mdp, epsilon=0.001):
-    """Solving an MDP by value iteration. [Figure 17.4]"""
+def value_iteration(mdp, epsilon=0.001, method="dict",
+                    return_backups=False):
+    """Solving an MDP by value iteration. [Figure 17.4]
+
+    method : "dict" loops over the states, "sparse" performs the
+             Bellman backups of all states at once (see
+             value_iteration_sparse), "gauss_seidel" and "prioritized"
+             are asynchronous variants updating the states in place
+             (see value_iteration_gauss_seidel and
+             value_iteration_prioritized).
+    return_backups : also returns the number of single state
+             Bellman backups that were computed."""
+
+    methods = {"sparse": value_iteration_sparse,
+               "gauss_seidel": value_iteration_gauss_seidel,
+               "prioritized": value_iteration_prioritized}
+    if method in methods:
+        return methods[method](mdp, epsilon, return_backups)
+    if method != "dict":
+        raise ValueError("Unknown value iteration method : " + str(method))
 
     U1 = {s: 0 for s in mdp.states}
     R, T, gamma = mdp.R, mdp.T, mdp.gamma
@@ -41,9 +63,170 @@ def value_iteration(mdp, epsilon=0.001):
             break
         iteration += 1
     print("value iterations :", iteration)
+    if return_backups:
+        return U, iteration * len(mdp.states)
+    return U
+
+
+def expected_utilities(mdp, U):
+    """Return the expected utility of all actions in all states
+    (nb_actions x nb_states) for the vector U of utilities of the
+    indexed states, -inf where an action is not available."""
+
+    actions, P, available = mdp.transition_matrices()
+    EU = np.empty(available.shape)
+    for k, P_a in enumerate(P):
+        EU[k] = P_a.dot(U)
+    EU[~available] = -np.inf
+    return EU
+
+
+def value_iteration_sparse(mdp, epsilon=0.001, return_backups=False):
+    """Value iteration where the Bellman backup of all states is done
+    at once with sparse matrix-vector products over the indexed states,
+    same stopping criterion as the dict based version."""
+
+    R, gamma = mdp.reward_vector(), mdp.gamma
+    U1 = np.zeros(R.shape)
+    iteration = 1
+    while True:
+        U = U1
+        U1 = R + gamma * expected_utilities(mdp, U).max(
+            axis=0, initial=-np.inf)
+        delta = np.max(np.abs(U1 - U)) if U.size else 0.
+        if delta <= epsilon * (1 - gamma) / gamma:
+            break
+        iteration += 1
+    print("value iterations :", iteration)
+    U = dict(zip(mdp.indexed_states(), U.tolist()))
+    if return_backups:
+        return U, iteration * len(R)
+    return U
+
+
+def state_transitions(mdp):
+    """Return for each indexed state the transitions of its available
+    actions as lists of (p, index of s1) pairs, in the order of T."""
+
+    actions, P, available = mdp.transition_matrices()
+    transitions = [[] for _ in range(available.shape[1])]
+    for k, P_a in enumerate(P):
+        indptr = P_a.indptr.tolist()
+        indices, data = P_a.indices.tolist(), P_a.data.tolist()
+        for i in np.flatnonzero(available[k]).tolist():
+            transitions[i].append(list(zip(
+                data[indptr[i]:indptr[i + 1]],
+                indices[indptr[i]:indptr[i + 1]])))
+    return transitions
+
+
+def value_iteration_gauss_seidel(mdp, epsilon=0.001, return_backups=False):
+    """Asynchronous value iteration where the states are swept in the
+    order of the indexed states and updated in place, so that a backup
+    uses the values already updated during the same sweep. Stops when
+    a sweep changes no value by more than epsilon * (1 - gamma) / gamma
+    as the synchronous version."""
+
+    transitions = state_transitions(mdp)
+    R, gamma = mdp.reward_vector().tolist(), mdp.gamma
+    U = [0.] * len(R)
+    threshold = epsilon * (1 - gamma) / gamma
+    backups = 0
+    while True:
+        delta = 0.
+        for i, T_i in enumerate(transitions):
+            u = R[i] + gamma * max(sum(p * U[j] for (p, j) in T_a)
+                                   for T_a in T_i)
+            delta = max(delta, abs(u - U[i]))
+            U[i] = u
+        backups += len(U)
+        if delta <= threshold:
+            break
+    print("value backups :", backups)
+    U = dict(zip(mdp.indexed_states(), U))
+    if return_backups:
+        return U, backups
     return U
 
 
+def value_iteration_prioritized(mdp, epsilon=0.001, return_backups=False):
+    """Prioritized sweeping: the state with the highest priority is
+    backed up first, a change of its utility raises the priority of its
+    predecessors by gamma * max_a P(s1 | s, a) * |change|. When the heap
+    is empty the Bellman errors of all states are computed at once and
+    the states with an error above epsilon * (1 - gamma) / gamma are
+    pushed again, so that the utilities are within epsilon as in the
+    synchronous version. Each state of such a check counts as a backup.
+
+    A. W. Moore and C. G. Atkeson, Prioritized Sweeping, ML 1993."""
+
+    transitions = state_transitions(mdp)
+    R, gamma = mdp.reward_vector(), mdp.gamma
+    threshold = epsilon * (1 - gamma) / gamma
+    if R.size == 0:
+        # no states, hence no Bellman errors
+        return ({}, 0) if return_backups else {}
+
+    # largest probability of reaching a state from its predecessors
+    actions, P, available = mdp.transition_matrices()
+    predecessors = P[0]
+    for P_a in P[1:]:
+        predecessors = predecessors.maximum(P_a)
+    predecessors = (gamma * predecessors).T.tocsr()
+    indptr = predecessors.indptr.tolist()
+    indices = predecessors.indices.tolist()
+    weights = predecessors.data.tolist()
+
+    U = np.zeros(len(R))
+    backups = 0
+    while True:
+        # Bellman errors of all states at once
+        errors = np.abs(R + gamma * expected_utilities(mdp, U).max(axis=0) - U)
+        backups += len(U)
+        if errors.max() <= threshold:
+            break
+        priority = errors.tolist()
+        heap = [(-e, i) for i, e in enumerate(priority) if e > threshold]
+        heapq.heapify(heap)
+        U = U.tolist()
+        R_l = R.tolist()
+        while heap:
+            e, i = heapq.heappop(heap)
+            if -e != priority[i]:
+                continue
+            u = R_l[i] + gamma * max(sum(p * U[j] for (p, j) in T_a)
+                                     for T_a in transitions[i])
+            change = abs(u - U[i])
+            U[i] = u
+            priority[i] = 0.
+            backups += 1
+            for k in range(indptr[i], indptr[i + 1]):
+                j = indices[k]
+                priority[j] += weights[k] * change
+                if priority[j] > threshold:
+                    heapq.heappush(heap, (-priority[j], j))
+        U = np.array(U)
+    U = U.tolist()
+    print("value backups :", backups)
+    U = dict(zip(mdp.indexed_states(), U))
+    if return_backups:
+        return U, backups
+    return U
+
+
+def best_policy_sparse(mdp, U):
+    """Same as best_policy, where the expected utilities of all actions
+    are computed at once. Ties go to the first action in the order of
+    transition_matrices, which is the order of actions(s) when all
+    states share the same list of actions."""
+
+    states = mdp.indexed_states()
+    U = np.array([U[s] for s in states], float)
+    actions = mdp.transition_matrices()[0]
+    best = expected_utilities(mdp, U).argmax(axis=0)
+    return {s: actions[k] for s, k in zip(states, best.tolist())}
+
+
 def best_policy(mdp, U):
     """Given an MDP and a utility function U, determine the best policy,
     as a mapping from state to action. (Equation 17.4)"""
@@ -73,8 +256,54 @@ def policy_evaluation(pi, U, mdp, k=20):
     return U
 
 
-def policy_iteration(mdp):
-    """Solve an MDP by policy iteration [Figure 17.7]"""
+def policy_evaluation_sparse(pi, mdp):
+    """Return the utilities of the indexed states under the policy pi
+    (index of the action in each state) by solving the linear system
+    (I - gamma P_pi) U = R with a sparse direct solver."""
+
+    actions, P, available = mdp.transition_matrices()
+    P_pi = sum(diags((pi == k).astype(float)).dot(P_a)
+               for k, P_a in enumerate(P))
+    A = identity(len(pi), format="csc") - mdp.gamma * P_pi.tocsc()
+    return spsolve(A, mdp.reward_vector())
+
+
+def policy_iteration_sparse(mdp, tolerance=1e-9):
+    """Policy iteration where the policy is evaluated exactly over the
+    indexed states (see policy_evaluation_sparse) and improved for all
+    states at once. The action of a state only changes when another
+    action is better by more than tolerance (relative to the utility),
+    which prevents cycling between equivalent actions."""
+
+    actions, P, available = mdp.transition_matrices()
+    pi = available.argmax(axis=0)
+    states = np.arange(len(pi))
+    iteration = 1
+    while True:
+        U = policy_evaluation_sparse(pi, mdp)
+        EU = expected_utilities(mdp, U)
+        best = EU.argmax(axis=0)
+        gain = EU[best, states] - EU[pi, states]
+        improve = gain > tolerance * np.maximum(1., np.abs(U))
+        if not improve.any():
+            break
+        pi = np.where(improve, best, pi)
+        iteration += 1
+    print("policy iterations :", iteration)
+    return {s: actions[k] for s, k in zip(mdp.indexed_states(), pi.tolist())}
+
+
+def policy_iteration(mdp, method="dict"):
+    """Solve an MDP by policy iteration [Figure 17.7]
+
+    method : "dict" evaluates the policy with k sweeps over the states,
+             "sparse" solves for the utilities of the policy exactly
+             (see policy_iteration_sparse)."""
+
+    if method == "sparse":
+        return policy_iteration_sparse(mdp)
+    if method != "dict":
+        raise ValueError("Unknown policy iteration method : " + str(method))
 
     U = {s: 0 for s in mdp.states}
     pi = {s: random.choice(mdp.actions(s)) for s in mdp.states}
@@ -30,6 +30,8 @@ and policy_iteration algorithms."""
 
 from . import common_imports
 from utils.misc import vector_add, orientations, turn_right, turn_left
+from scipy.sparse import csr_matrix
+import numpy as np
 import random
 
 
@@ -65,13 +67,18 @@ class MDP:
 
         self.terminals = terminals
         self.transitions = transitions or {}
-        if not self.transitions:
+        if not self.transitions and type(self).T is MDP.T:
             print("Warning: Transition table is empty.")
 
         self.gamma = gamma
 
         self.reward = reward or {s: 0 for s in self.states}
 
+        # indexed model used by the vectorized algorithms
+        self._states_list = None
+        self._states_index = None
+        self._transition_matrices = None
+
         # self.check_consistency()
 
     def R(self, state):
@@ -101,6 +108,65 @@ class MDP:
         else:
             return self.actlist
 
+    def indexed_states(self):
+        """Return the states in a fixed order, the position of a state
+        in this list is its index in the vectorized algorithms."""
+
+        if self._states_list is None:
+            self._states_list = list(self.states)
+            self._states_index = {
+                s: i for i, s in enumerate(self._states_list)}
+        return self._states_list
+
+    def state_index(self, state):
+        """Return the index of a state in indexed_states."""
+
+        self.indexed_states()
+        return self._states_index[state]
+
+    def reward_vector(self):
+        """Return the rewards of all indexed states."""
+
+        return np.array([self.R(s) for s in self.indexed_states()], float)
+
+    def transition_matrices(self):
+        """Return the transition model over the indexed states:
+        the list of actions, one scipy.sparse matrix per action with
+        P[i, j] the probability of reaching state j from state i, and a
+        boolean mask (nb_actions x nb_states) of the actions available
+        in each state. The matrices are built once from T and actions.
+        The entries of each row are kept in the order of T, duplicates
+        included, so that a matrix-vector product sums the terms in the
+        same order as sum(p * U[s1] for (p, s1) in T(s, a))."""
+
+        if self._transition_matrices is None:
+            states = self.indexed_states()
+            actions, entries, available = [], {}, {}
+            for i, s in enumerate(states):
+                for a in self.actions(s):
+                    if a not in entries:
+                        actions.append(a)
+                        entries[a] = ([], [], [])
+                        available[a] = []
+                    rows, cols, probs = entries[a]
+                    available[a].append(i)
+                    for (p, s1) in self.T(s, a):
+                        rows.append(i)
+                        cols.append(self._states_index[s1])
+                        probs.append(p)
+            n = len(states)
+            P = []
+            for a in actions:
+                rows, cols, probs = entries[a]
+                indptr = np.zeros(n + 1, dtype=int)
+                np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+                P.append(csr_matrix((probs, cols, indptr), shape=(n, n)))
+            mask = np.zeros((len(actions), n), dtype=bool)
+            for k, a in enumerate(actions):
+                mask[k, available[a]] = True
+            self._transition_matrices = (actions, P, mask)
+        return self._transition_matrices
+
     def get_states_from_transitions(self, transitions):
         if isinstance(transitions, dict):
             s1 = set(transitions.keys())
@@ -164,9 +230,18 @@ class GridMDP(MDP):
     use None for an obstacle (unreachable state). Also, you should
     specify the terminal states. An action is an (x, y) unit vector;
     e.g. (1, 0) means move east.
+
+    The grid can also be a NumPy array of rewards (row 0 on top as for
+    the list), where NaN or 0 marks an obstacle unless an obstacles mask
+    is given. The model is then built with array operations, and the
+    transitions are computed on demand instead of being stored as dicts.
     """
 
-    def __init__(self, grid, terminals, init=(0, 0), gamma=.9):
+    def __init__(self, grid, terminals, init=(0, 0), gamma=.9,
+                 obstacles=None):
+        if isinstance(grid, np.ndarray):
+            self._init_from_array(grid, terminals, init, gamma, obstacles)
+            return
         grid.reverse()     # because we want row 0 on bottom, not on top
         reward = {}
         states = set()
@@ -189,6 +264,59 @@ class GridMDP(MDP):
                      terminals=terminals, transitions=transitions,
                      reward=reward, states=states, gamma=gamma)
 
+    def _init_from_array(self, grid, terminals, init, gamma, obstacles):
+        grid = np.asarray(grid, dtype=float)
+        if obstacles is None:
+            obstacles = np.isnan(grid) | (grid == 0)
+        # because we want row 0 on bottom, not on top
+        grid = np.flipud(grid)
+        free = ~np.flipud(np.asarray(obstacles, dtype=bool))
+        self.rows, self.cols = grid.shape
+        self.grid = grid
+
+        # states are indexed in row major order (y, x), index[y, x]
+        # is the index of the state (x, y) and -1 for obstacles
+        y, x = np.nonzero(free)
+        index = np.full(grid.shape, -1)
+        index[y, x] = np.arange(len(x))
+        states_list = list(zip(x.tolist(), y.tolist()))
+        rewards = grid[y, x]
+        MDP.__init__(self, init, actlist=orientations,
+                     terminals=terminals, transitions=None,
+                     reward=dict(zip(states_list, rewards.tolist())),
+                     states=set(states_list), gamma=gamma)
+        self._states_list = states_list
+        self._states_index = {s: i for i, s in enumerate(states_list)}
+
+        def go(direction):
+            """ index of the state reached from all states """
+            x1, y1 = x + direction[0], y + direction[1]
+            inside = (x1 >= 0) & (x1 < self.cols) & (y1 >= 0) & (
+                y1 < self.rows)
+            target = np.full(len(x), -1)
+            target[inside] = index[y1[inside], x1[inside]]
+            return np.where(target < 0, np.arange(len(x)), target)
+
+        # same entries and order as calculate_T, terminals only have
+        # the None action with a zero probability of staying
+        n = len(states_list)
+        is_terminal = np.zeros(n, dtype=bool)
+        is_terminal[[self._states_index[s] for s in terminals]] = True
+        actions = list(orientations) + ([None] if terminals else [])
+        P = []
+        for a in orientations:
+            P.append(csr_matrix(
+                (np.tile([.8, .1, .1], n), np.column_stack([
+                    go(a), go(turn_right(a)), go(turn_left(a))]).ravel(),
+                 np.arange(0, 3 * n + 1, 3)), shape=(n, n)))
+        if terminals:
+            P.append(csr_matrix((np.zeros(n), np.arange(n), np.arange(
+                n + 1)), shape=(n, n)))
+        available = np.zeros((len(actions), n), dtype=bool)
+        available[:len(orientations)] = ~is_terminal
+        available[len(orientations):] = is_terminal
+        self._transition_matrices = (actions, P, available)
+
     def calculate_T(self, state, action):
         if action:
             return [(0.8, self.go(state, action)),
@@ -198,7 +326,11 @@ class GridMDP(MDP):
             return [(0.0, state)]
 
     def T(self, state, action):
-        return self.transitions[state][action] if action else [(0.0, state)]
+        if not action:
+            return [(0.0, state)]
+        if not self.transitions:
+            return self.calculate_T(state, action)
+        return self.transitions[state][action]
 
     def go(self, state, direction):
         """Return the state that results from going in this direction."""
@@ -156,12 +156,28 @@ class TrajectoryOptimizationViewer:
         x : array
             the trajectory vector
         """
+        self._draw_hessian_call(x)
+        return self.objective.objective.hessian(x)
+
+    def hessian_sparse(self, x):
+        """
+        Calculates the sparse (banded) hessian after drawing the trajectory
+        and draws optionaly the gradient
+
+        Parameters
+        ----------
+        x : array
+            the trajectory vector
+        """
+        self._draw_hessian_call(x)
+        return self.objective.objective.hessian_sparse(x)
+
+    def _draw_hessian_call(self, x):
         if self.viewer is not None:
             if self._draw_hessian:
                 self.draw_gradient(x)
             else:
                 self.draw(Trajectory(q_init=self.objective.q_init, x=x))
-        return self.objective.objective.hessian(x)
 
     def draw_configuration(self, q, color=(1, 0, 0), with_robot=False):
         """
@@ -19,7 +19,9 @@
 
 import __init__
 from geometry.differentiable_geometry import *
+from geometry.expression_graph import *
 from numpy.testing import assert_allclose
+import pytest
 
 
 def test_finite_difference():
@@ -410,6 +412,170 @@ def test_radial_basis_function():
     assert abs(f(x) - np.exp(-.5 * phi)) < 1e-5
 
 
+def check_batch_against_single_point(phi, nb_points=10, hessian=True):
+    """ Makes sure the batch methods match the single point ones """
+    X = np.random.rand(nb_points, phi.input_dimension())
+    m, n = phi.output_dimension(), phi.input_dimension()
+    Y = phi.forward_batch(X)
+    J = phi.jacobian_batch(X)
+    assert Y.shape == (nb_points, m)
+    assert J.shape == (nb_points, m, n)
+    for i, x in enumerate(X):
+        assert_allclose(Y[i], np.asarray(phi.forward(x)).reshape(m))
+        assert_allclose(J[i], np.asarray(phi.jacobian(x)).reshape(m, n))
+    if m == 1 and hessian:
+        H = phi.hessian_batch(X)
+        assert H.shape == (nb_points, n, n)
+        for i, x in enumerate(X):
+            assert_allclose(H[i], np.asarray(phi.hessian(x)), atol=1e-12)
+    return True
+
+
+def test_batch_evaluation():
+    dim = 3
+    g = AffineMap(np.random.rand(dim, dim), np.random.rand(dim))
+    f = SquaredNorm(np.random.rand(dim))
+    q = QuadricFunction(np.random.rand(dim, dim), np.random.rand(dim), .3)
+    l = AffineMap(np.random.rand(1, dim), np.random.rand(1))
+    maps = [
+        IdentityMap(dim),
+        ZeroMap(2, dim),
+        g,
+        l,
+        f,
+        q,
+        Scale(f, .3),
+        SumOfTerms([f, q, l]),
+        RangeSubspaceMap(dim, [0, 2]),
+        CombinedOutputMap([g, l]),
+        Compose(g, g),
+        Compose(AffineMap(np.random.rand(1, 1), np.random.rand(1)), l),
+        Pullback(f, g),
+        Pullback(q, g),
+        ProductFunction(q, f),
+        SoftMax(dim, 3.),
+        LogSumExp(dim, 10.),
+        LogSumExp(dim, -10.),
+        Norm(np.random.rand(dim)),      # looped fallback
+        PolynomeTestFunction()]         # looped fallback
+    for phi in maps:
+        print("Check batch of {}".format(type(phi).__name__))
+        assert check_batch_against_single_point(phi)
+
+    # The hessian of a composition is only defined when g is a function
+    assert check_batch_against_single_point(Compose(f, g), hessian=False)
+
+
+def test_finite_difference_methods():
+    np.random.seed(0)
+    maps = [LogSumExp(3, 5.),                   # batched
+            SoftMax(3, 5.),                     # batched, multiple outputs
+            PolynomeTestFunction()]             # looped fallback
+    for phi in maps:
+        q = np.random.rand(phi.input_dimension())
+        J = np.asarray(phi.jacobian(q)).reshape(
+            phi.output_dimension(), phi.input_dimension())
+        for method in ["central", "threads"]:
+            J_diff = finite_difference_jacobian(phi, q, method=method)
+            assert isinstance(J_diff, np.matrix)
+            assert_allclose(J_diff, J, atol=1e-7)
+        assert_allclose(finite_difference_jacobian(
+            phi, q, method="complex"), J, atol=1e-14)
+        assert_allclose(finite_difference_jacobian(
+            phi, q, dt=1e-6), J, atol=1e-8)
+        if phi.output_dimension() == 1:
+            H = phi.hessian(q)
+            for method in ["central", "threads"]:
+                assert_allclose(finite_difference_hessian(
+                    phi, q, method=method), H, atol=1e-7)
+            assert_allclose(finite_difference_hessian(
+                phi, q, method="complex"), H, atol=1e-10)
+    with pytest.raises(ValueError):
+        finite_difference_jacobian(maps[0], np.zeros(3), method="unknown")
+    with pytest.raises(ValueError):
+        # the norm is real for complex inputs
+        finite_difference_jacobian(Norm(), np.ones(2), method="complex")
+
+
+def test_hessian_vector_product():
+    np.random.seed(0)
+    g = AffineMap(np.random.rand(3, 2), np.random.rand(3))
+    f = QuadricFunction(np.eye(2) + 1, np.ones(2), 1.)
+    maps = [Compose(LogSumExp(3, 5.), g),
+            Pullback(SquaredNorm(np.zeros(3)), g),
+            Compose(f, Normalize(2)),           # non linear inner map
+            Compose(SquaredNorm(np.zeros(1)), f),  # scalar inner map
+            SumOfTerms([f, Scale(LogSumExp(2, 5.), 2.)]),
+            PolynomeTestFunction()]             # finite differences
+    for phi in maps:
+        n = phi.input_dimension()
+        X = np.random.rand(5, n)
+        V = np.random.rand(5, n)
+        Hv = phi.hessian_vector_product_batch(X, V)
+        assert Hv.shape == (5, n)
+        for x, v, Hv_x in zip(X, V, Hv):
+            H = np.asarray(finite_difference_hessian(phi, x))
+            assert_allclose(phi.hessian_vector_product(x, v), H @ v,
+                            atol=1e-5)
+            assert_allclose(Hv_x, H @ v, atol=1e-5)
+
+
+def test_compiled_map():
+    np.random.seed(0)
+    n = 6
+    center = RangeSubspaceMap(n, [2, 3])
+    f = QuadricFunction(np.eye(2) + 1, np.ones(2), 1.)
+    velocity = AffineMap(np.random.rand(3, 4), np.random.rand(3))
+    tree = SumOfTerms([
+        Scale(Scale(Pullback(f, center), 2.), .5),
+        Pullback(SquaredNorm(np.zeros(3)), Compose(
+            velocity, RangeSubspaceMap(n, [0, 1, 2, 3]))),
+        Scale(ProductFunction(
+            Pullback(LogSumExp(2, 5.), RangeSubspaceMap(n, [2, 3])),
+            Pullback(f, center)), 3.),
+        Pullback(f, Compose(IdentityMap(2), RangeSubspaceMap(n, [4, 5]))),
+        Pullback(SquaredNorm(np.zeros(2)), Compose(
+            RangeSubspaceMap(n, [0, 1]), Normalize(n)))])
+    compiled = compile_map(tree)
+
+    # Scales, affine maps and indices are merged, the pullbacks
+    # of the center of the clique are evaluated once
+    ops = compiled.operations()
+    assert "scale" not in ops[:ops.index("product")]
+    assert ops.count("affine") == 1
+    assert ops.count("index") == 2
+    assert ops.count("map") == 5
+
+    X = np.random.rand(10, n)
+    V, J, H = compiled.value_grad_hess_batch(X)
+    assert_allclose(V, tree.forward_batch(X), rtol=1e-12)
+    assert_allclose(J, tree.jacobian_batch(X), rtol=1e-12, atol=1e-14)
+    for x, H_x in zip(X, H):
+        H_tree = tree.hessian(x)
+        assert_allclose(H_x, H_tree, rtol=1e-12, atol=1e-12)
+        assert_allclose(compiled.hessian(x), H_tree, rtol=1e-12, atol=1e-12)
+        assert_allclose(compiled.forward(x), tree.forward(x), rtol=1e-12)
+        assert_allclose(compiled.jacobian(x), tree.jacobian(x),
+                        rtol=1e-12, atol=1e-14)
+    assert compiled.value_grad_hess_batch(X, gradient=False)[1] is None
+
+    # Scales by arrays are leaves, scalars can be numpy scalars
+    g = AffineMap(np.random.rand(2, n), np.random.rand(2))
+    alpha = np.array([2., 3.])
+    tree = SumOfTerms([Scale(g, alpha), Scale(g, np.float64(1.)),
+                       Scale(g, np.array(2.))])
+    compiled = compile_map(tree)
+    assert compiled.operations().count("map") == 1
+    assert_allclose(compiled.forward_batch(X), tree.forward_batch(X))
+
+    # Constants modified in place are taken into account by recompile
+    alpha[:] = 1.
+    tree._functions[2]._alpha = np.array(4.)
+    assert not np.allclose(compiled.forward_batch(X), tree.forward_batch(X))
+    compiled.recompile()
+    assert_allclose(compiled.forward_batch(X), tree.forward_batch(X))
+
+
 if __name__ == "__main__":
     # test_finite_difference()
     # test_zero()
@@ -430,3 +596,7 @@ if __name__ == "__main__":
     # test_normalize()
     # test_trigonometric_functions()
     # test_radial_basis_function()
+    # test_batch_evaluation()
+    # test_finite_difference_methods()
+    # test_hessian_vector_product()
+    # test_compiled_map()
@@ -22,10 +22,12 @@ from utils.misc import *
 from geometry.heat_diffusion import *
 from geometry.differentiable_geometry import PolynomeTestFunction
 from numpy.testing import assert_allclose
+import pytest
 
 # Externals
 from scipy.linalg import cholesky_banded, solveh_banded
 from numpy import zeros, diag
+from scipy import sparse
 
 
 def test_matrix_coordinates():
@@ -105,7 +107,7 @@ def test_gradient_1d_operator_linear():
 
         D = discrete_2d_gradient(N, N, dx=dx, axis=a)
 
-        grad1 = np.dot(D, Z.flatten())
+        grad1 = D @ Z.flatten()
         grad2 = np.gradient(Z, dx, axis=a)
         grad3 = G[:, :, a]
 
@@ -152,7 +154,7 @@ def test_gradient_1d_operator():
 
         D = discrete_2d_gradient(N, N, dx, axis=a)
 
-        grad1 = np.dot(D, Z.flatten())
+        grad1 = D @ Z.flatten()
         grad2 = np.gradient(Z, dx, axis=a)
         grad3 = jacobian[a]
 
@@ -176,9 +178,9 @@ def test_gradient_operator():
     Z = PolynomeTestFunction().forward(Q)
     # Z = LinearTestFunction().forward(Q)
 
-    grad1 = np.dot(np.vstack([
+    grad1 = sparse.vstack([
         discrete_2d_gradient(N, N, axis=0),
-        discrete_2d_gradient(N, N, axis=1)]), Z.flatten())
+        discrete_2d_gradient(N, N, axis=1)]) @ Z.flatten()
 
     grad2 = np.stack([
         np.gradient(Z, axis=0).flatten(),
@@ -204,7 +206,7 @@ def test_distance_from_gradient():
     dl = 1/float(N-1)
     Dx = discrete_2d_gradient(N, N, dx=dl, axis=0)
     Dy = discrete_2d_gradient(N, N, dx=dl, axis=1)
-    D = np.vstack([Dx, Dy])
+    D = sparse.vstack([Dx, Dy]).toarray()
 
     grad = np.dot(D, f.flatten())
     phi = np.dot(np.linalg.pinv(D), grad)
@@ -245,7 +247,7 @@ def test_2d_laplacian_solve():
     verbose = True
 
     n = 5
-    M = discrete_2d_laplacian(n, n, matrix_form=True)
+    M = discrete_2d_laplacian(n, n, matrix_form=True).toarray()
 
     # convert to banded format
     N = M.shape[0]                              # num of rows in A
@@ -284,6 +286,128 @@ def test_2d_laplacian_solve():
     assert_allclose(v1, v2)
 
 
+def test_crank_nicholson():
+    import geometry.heat_diffusion as hd
+    nb_points, time_factor = hd.NB_POINTS, hd.TIME_FACTOR
+    hd.NB_POINTS, hd.TIME_FACTOR = 30, 20
+    workspace = Workspace()
+    workspace.obstacles = [Circle(origin=[.1, .0], radius=0.1)]
+    occupancy = occupancy_map(hd.NB_POINTS, workspace)
+    free = occupancy == 0
+    grid = workspace.pixel_map(hd.NB_POINTS)
+    source_grid = grid.world_to_grid(np.array([0.2, 0.15]))
+    h = grid.resolution
+
+    # implicit step of the heat equation with boundry conditions
+    c = hd.TIME_STEP / (h ** 2)
+    u = np.random.random(occupancy.size)
+    u[~free.flatten()] = 0
+    v = implicit_step_solver(free, c)(u)
+    assert implicit_step_solver(free, c) is implicit_step_solver(free, c)
+    assert_allclose(v + c * (dirichlet_laplacian(free) @ v), u)
+    assert_allclose(v[~free.flatten()], 0)
+
+    U1 = forward_euler_2d(
+        hd.TIME_STEP, h, source_grid, 3, occupancy.T)
+    U2 = crank_nicholson_2d_sparse(
+        hd.TIME_STEP, h, source_grid, 3, occupancy.T)
+    hd.NB_POINTS, hd.TIME_FACTOR = nb_points, time_factor
+    assert len(U1) == len(U2) == 3
+    for u1, u2 in zip(U1, U2):
+        assert abs(u1 - u2).max() < .05 * u1.max()
+        assert_allclose(u2[~free], 0)
+
+
+def test_crank_nicholson_fixed_steps():
+    # crank_nicholson_2d is the dense inversion scheme with 9 fixed steps
+    import geometry.heat_diffusion as hd
+    nb_points, hd.NB_POINTS = hd.NB_POINTS, 10
+    workspace = Workspace()
+    workspace.obstacles = [Circle(origin=[.1, .0], radius=0.2)]
+    occupancy = occupancy_map(hd.NB_POINTS, workspace).T
+    grid = workspace.pixel_map(hd.NB_POINTS)
+    source_grid = grid.world_to_grid(np.array([-0.2, 0.15]))
+    h = grid.resolution
+    U = crank_nicholson_2d(hd.TIME_STEP, h, source_grid, 3, occupancy)
+    hd.NB_POINTS = nb_points
+
+    n = 10
+    u_t = np.zeros(n ** 2)
+    u_t[source_grid[0] * n + source_grid[1]] = 1.e4
+    M = (-1 / (h ** 2)) * discrete_2d_laplacian(n, n, True).toarray()
+    A_inv = np.linalg.inv(np.eye(n ** 2) - .003 * M)
+    U_dense = []
+    for i in range(9):
+        u_t = A_inv @ u_t
+        apply_boundry_conditions_to_vector(u_t, n, occupancy)
+        if (i + 1) % 3 == 0:
+            U_dense.append(np.reshape(u_t, (n, n)))
+    assert len(U) == 3
+    for u, u_dense in zip(U, U_dense):
+        assert_allclose(u, u_dense, atol=1e-9 * u_dense.max())
+    assert_allclose(U[-1][[0, -1], :], 0)
+    assert_allclose(U[-1][:, [0, -1]], 0)
+    assert U[-1].max() > 0
+
+
+def test_geodesic_distance_field():
+    workspace = Workspace()
+    field = GeodesicDistanceField(workspace, 40)
+    h = field.grid.resolution
+    sources = np.array([[0., 0.], [.3, -.2], [-.41, .37]])
+    D = field.distances(sources)
+    assert D.shape == (3, 40, 40)
+    X = workspace.box.stacked_meshgrid(40)
+    for k, source in enumerate(sources):
+        assert_allclose(D[k], field.distance(source))
+        center = field.grid.grid_to_world(field.grid.world_to_grid(source))
+        d = np.linalg.norm(X - center[:, None, None], axis=0).T
+        assert abs(D[k] - d).max() < 2 * h
+
+    # the shortest path goes around the obstacle
+    workspace.obstacles = [Circle(origin=[.0, .0], radius=0.2)]
+    field = GeodesicDistanceField(workspace, 40)
+    D = field.distance(np.array([-.3, 0.]))
+    assert np.isinf(D[~field.free]).all()
+    assert np.isfinite(D[field.free]).all()
+    p = field.grid.world_to_grid(np.array([.3, 0.]))
+    assert D[p[0], p[1]] > .2 * np.pi + .2 - 2 * h
+    with pytest.raises(ValueError):
+        field.distance(np.array([0., 0.]))
+
+    # attractor to the source
+    phi = field.distance_map(np.array([-.3, 0.]))
+    x = np.array([.3, .1])
+    assert phi(np.array([-.3, 0.])) < h
+    assert_allclose(phi(x), phi.forward_batch(x.reshape(1, 2))[0, 0])
+    assert_allclose(
+        phi.jacobian(x), finite_difference_jacobian(phi, x), rtol=1e-4)
+
+
+def test_forward_euler_steps():
+    import geometry.heat_diffusion as hd
+    nb_points, time_factor = hd.NB_POINTS, hd.TIME_FACTOR
+    hd.NB_POINTS, hd.TIME_FACTOR = 30, 5
+    workspace = Workspace()
+    workspace.obstacles = [Circle(origin=[.1, .0], radius=0.1)]
+    occupancy = occupancy_map(hd.NB_POINTS, workspace)
+    h = workspace.pixel_map(hd.NB_POINTS).resolution
+    args = (hd.TIME_STEP, h, (25, 20))
+    U = forward_euler_2d(*args, 4, occupancy.T)
+    frames = list(forward_euler_2d_steps(*args, 20, occupancy.T, stride=1))
+    steps = forward_euler_2d_steps(*args, 20, occupancy.T, stride=1)
+    for k, (t, u_t) in enumerate(steps):
+        if k % hd.TIME_FACTOR == 0:
+            assert_allclose(u_t, U[k // hd.TIME_FACTOR])
+            assert_allclose(t, (k + 1) * hd.TIME_STEP)
+    hd.NB_POINTS, hd.TIME_FACTOR = nb_points, time_factor
+    assert len(U) == 4 and len(frames) == 20
+
+    # frames are views of the two buffers
+    assert len(set(id(u_t) for t, u_t in frames)) == 2
+    assert_allclose(U[0][occupancy > 0], 0)
+
+
 if __name__ == "__main__":
     # test_matrix_coordinates()
     # test_gradient_1d_operator_linear()
@@ -292,3 +416,7 @@ if __name__ == "__main__":
     # test_distance_from_gradient()
     # test_2d_laplacian()
     test_2d_laplacian_solve()
+    test_crank_nicholson()
+    test_crank_nicholson_fixed_steps()
+    test_forward_euler_steps()
+    test_geodesic_distance_field()
@@ -19,10 +19,22 @@
 
 from __init__ import *
 from graph.shortest_path import *
+from graph.dstar_lite import *
+from graph.any_angle import *
 from geometry.workspace import *
 from motion.cost_terms import *
 from utils import timer
 from numpy.testing import assert_allclose
+import pytest
+
+
+def path_cost(converter, path):
+    """ Paths are returned from target to source, they are walked in
+        reverse so that the edges are read from source to target, which
+        matters on the directed graph (average_cost=False) """
+    graph = converter._graph
+    return sum(graph[converter.graph_id(*p1), converter.graph_id(*p2)]
+               for p1, p2 in zip(path[:0:-1], path[-2::-1]))
 
 
 def test_symetrize():
@@ -136,6 +148,254 @@ def test_breadth_first_search():
     assert len(path) > 0
 
 
+def test_sparse_graph():
+    np.random.seed(0)
+    costmap = np.random.random((7, 5))
+    for average_cost in [True, False]:
+        converter = CostmapToSparseGraph(costmap, average_cost)
+        converter.integral_cost = not average_cost
+        graph = converter.convert()
+        assert graph.nnz == 4 * 7 * 5 * 2 - 3 * (7 + 5) * 2 + 4
+        for (n1_i, n1_j), c_ij in np.ndenumerate(costmap):
+            for (n2_i, n2_j) in converter.neiborghs(n1_i, n1_j):
+                if converter.is_in_costmap(n2_i, n2_j):
+                    assert_allclose(
+                        converter.graph_edge_cost(n1_i, n1_j, n2_i, n2_j),
+                        converter.edge_cost(n1_i, n1_j, n2_i, n2_j))
+
+        # The sparsity pattern is kept when updating the costmap
+        indices = graph.indices.copy()
+        costmap_new = np.random.random((7, 5))
+        converter.update_graph(costmap_new)
+        assert converter._graph is graph
+        assert np.array_equal(graph.indices, indices)
+        for (n1_i, n1_j), c_ij in np.ndenumerate(costmap_new):
+            for (n2_i, n2_j) in converter.neiborghs(n1_i, n1_j):
+                if converter.is_in_costmap(n2_i, n2_j):
+                    assert_allclose(
+                        converter.graph_edge_cost(n1_i, n1_j, n2_i, n2_j),
+                        converter.edge_cost(n1_i, n1_j, n2_i, n2_j))
+
+
+def test_dijkstra_on_large_map():
+    np.random.seed(0)
+    costmap = np.random.random((300, 300))
+    converter = CostmapToSparseGraph(costmap, average_cost=True)
+    converter.convert()
+    path = converter.dijkstra_on_map(costmap, 0, 0, 299, 299)
+    assert path[0] == (299, 299)
+    assert path[-1] == (0, 0)
+    for p1, p2 in zip(path[:-1], path[1:]):
+        assert max(abs(p1[0] - p2[0]), abs(p1[1] - p2[1])) == 1
+
+
+def test_zero_cost_walls():
+    # cells of zero cost are obstacles (e.g., binary costmaps)
+    costmap = np.ones((5, 5))
+    costmap[:4, 2] = 0
+    for average_cost, integral_cost in [(False, False), (False, True)]:
+        converter = CostmapToSparseGraph(costmap, average_cost)
+        converter.integral_cost = integral_cost
+        graph = converter.convert()
+        for path in [converter.dijkstra_on_map(costmap, 4, 4, 4, 0),
+                     converter.dijkstra(graph, 4, 4, 4, 0),
+                     converter.astar(4, 4, 4, 0),
+                     converter.bidirectional_dijkstra(4, 4, 4, 0),
+                     converter.breadth_first_search(graph, 4, 4, 4, 0),
+                     DStarLite(costmap.copy(), average_cost,
+                               integral_cost).shortest_path_on_map(
+                         costmap, 4, 4, 4, 0)]:
+            assert all(costmap[p] > 0 for p in path)
+            assert (4, 2) in path
+
+    costmap[4, 2] = 0
+    converter = CostmapToSparseGraph(costmap, average_cost=False)
+    converter.convert()
+    converter.update_graph(costmap)
+    with pytest.raises(ValueError):
+        converter.dijkstra_on_map(costmap, 4, 4, 4, 0)
+    with pytest.raises(ValueError):
+        converter.astar(4, 4, 4, 0)
+
+
+def test_astar_and_bidirectional_dijkstra():
+    np.random.seed(0)
+    costmap = np.random.random((40, 30)) + .1
+    costmap[10:30, 12] = np.inf
+
+    # average_cost=False gives a directed graph
+    for average_cost, integral_cost in [
+            (True, False), (False, False), (True, True)]:
+        converter = CostmapToSparseGraph(costmap, average_cost)
+        converter.integral_cost = integral_cost
+        converter.convert()
+        for _ in range(10):
+            s_i, t_i = np.random.randint(40, size=2)
+            s_j, t_j = np.random.randint(13, 30, size=2)
+            path = converter.dijkstra_on_map(costmap, s_i, s_j, t_i, t_j)
+            path_astar = converter.astar(s_i, s_j, t_i, t_j)
+            path_bidir = converter.bidirectional_dijkstra(
+                s_i, s_j, t_i, t_j)
+            for p in [path_astar, path_bidir]:
+                assert p[0] == (t_i, t_j)
+                assert p[-1] == (s_i, s_j)
+                assert_allclose(path_cost(converter, p),
+                                path_cost(converter, path))
+    path = converter.astar_on_map(costmap, 3, 4, 3, 4)
+    assert path == [(3, 4)]
+    path = converter.bidirectional_dijkstra_on_map(costmap, 3, 4, 3, 4)
+    assert path == [(3, 4)]
+
+
+def test_dstar_lite():
+    np.random.seed(0)
+    costmap = np.random.random((40, 30)) + .1
+
+    for average_cost, integral_cost in [
+            (True, False), (False, False), (True, True)]:
+        planner = DStarLite(costmap.copy(), average_cost, integral_cost)
+        converter = CostmapToSparseGraph(costmap, average_cost)
+        converter.integral_cost = integral_cost
+        converter.convert()
+        s, t = (2, 3), (35, 25)
+        for k in range(10):
+            if k % 3 == 1:
+                s = (s[0] + 1, s[1] + 1)
+            new_costmap = planner.converter.costmap.copy()
+            cells = np.column_stack([np.random.randint(40, size=20),
+                                     np.random.randint(30, size=20)])
+            new_costmap[cells[:, 0], cells[:, 1]] = np.random.choice(
+                [.1, 2., np.inf], size=20)
+            new_costmap[s], new_costmap[t] = .5, .5
+            cells = np.vstack([cells, s, t])
+            if k % 2:
+                cells = None
+            path = planner.shortest_path_on_map(
+                new_costmap, s[0], s[1], t[0], t[1], cells)
+            path_dijkstra = converter.dijkstra_on_map(
+                new_costmap, s[0], s[1], t[0], t[1])
+            assert path[0] == t
+            assert path[-1] == s
+            assert_allclose(path_cost(converter, path),
+                            path_cost(converter, path_dijkstra))
+            assert_allclose(path_cost(converter, path),
+                            planner._g[planner._source_id])
+
+
+def test_shortest_path_tree():
+    np.random.seed(0)
+    costmap = np.random.random((30, 20)) + .1
+    converter = CostmapToSparseGraph(costmap, average_cost=False)
+    converter.convert()
+    targets = np.column_stack([np.random.randint(30, size=50),
+                               np.random.randint(20, size=50)])
+    targets[0] = [4, 5]
+    paths = converter.dijkstra_paths_on_map(costmap, 4, 5, targets)
+    tree = converter.shortest_path_tree(costmap.copy(), 4, 5)
+    assert len(converter._trees) == 1
+    for t, path in zip(targets, paths):
+        assert path == converter.dijkstra(converter._graph, 4, 5, t[0], t[1])
+        assert path[0] == tuple(t)
+        assert path[-1] == (4, 5)
+        d = sum(converter._graph[converter.graph_id(*p1),
+                                 converter.graph_id(*p2)]
+                for p1, p2 in zip(path[:0:-1], path[-2::-1]))
+        assert_allclose(d, tree.distances[converter.graph_id(*t)])
+    assert paths[0] == [(4, 5)]
+
+    # a new costmap or source computes a new tree
+    costmap[4, 6] = 100.
+    assert converter.shortest_path_tree(costmap, 4, 5) is not tree
+    assert converter.shortest_path_tree(costmap, 4, 6) is not tree
+    assert len(converter._trees) == 3
+    converter.max_cached_trees = 3
+    for i in range(5):
+        converter.dijkstra_on_map(costmap, i, 0, 10, 10)
+    assert len(converter._trees) == 3
+
+    # the same bytes with another type or shape are another costmap
+    key = converter.costmap_hash(costmap)
+    assert key == converter.costmap_hash(costmap.copy())
+    assert key != converter.costmap_hash(costmap.view(np.int64))
+    assert key != converter.costmap_hash(costmap.reshape(20, 30))
+    assert key != converter.costmap_hash(costmap.T)
+
+    # all-pairs and breadth first search walk the predecessors the same way
+    predecessors = shortest_paths(converter._graph)
+    path = converter.shortest_path(predecessors, 4, 5, 10, 10)
+    assert path[0] == (4, 5)
+    assert path[-1] == (10, 10)
+
+    costmap[:, 10] = np.inf
+    converter.update_graph(costmap)
+    graph = converter._graph.copy()
+    graph.data[np.isinf(graph.data)] = 0.
+    graph.eliminate_zeros()
+    with pytest.raises(ValueError):
+        converter.dijkstra(graph, 4, 5, 4, 15)
+
+
+def test_fast_marching():
+    n = 30
+    costmap = 2. * np.ones((n, n))
+    T = fast_marching(costmap, 10, 12, resolution=.1)
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    d = .2 * np.sqrt((i - 10) ** 2 + (j - 12) ** 2)
+    assert T[10, 12] == 0.
+    assert_allclose(T[10, :], d[10, :])
+    assert_allclose(T[:, 12], d[:, 12])
+    assert np.all(T >= d - 1e-9)
+    assert np.all(T <= d * (1. + SQRT2 - 1.) + 1e-9)
+
+    # cells behind a wall are never reached
+    costmap[:, 20] = np.inf
+    T = fast_marching(costmap, 10, 12)
+    assert np.all(np.isinf(T[:, 20:]))
+    assert np.all(np.isfinite(T[:, :20]))
+
+    # the continuous field interpolates the values at the cell centers
+    pixel_map = PixelMap(1. / n)
+    costmap = 1. + np.random.random((n, n))
+    field = CostToGoField(pixel_map, fast_marching(costmap, 3, 4))
+    for p in [(3, 4), (7, 15), (20, 10)]:
+        x = pixel_map.grid_to_world(np.array(p))
+        assert_allclose(field(x), field._values[p], atol=1e-12)
+    for _ in range(10):
+        x = pixel_map.grid_to_world(np.random.uniform(0, n - 1, 2))
+        assert_allclose(field.jacobian(x),
+                        finite_difference_jacobian(field, x), rtol=1e-4)
+
+
+def test_theta_star():
+    n = 40
+    costmap = np.ones((n, n))
+    path = theta_star(costmap, 3, 5, 30, 36)
+    assert path == [(30, 36), (3, 5)]
+
+    costmap[10:20, 2:30] = np.inf
+    converter = CostmapToSparseGraph(costmap, average_cost=True)
+    converter.integral_cost = True
+    converter.convert()
+    path_dijkstra = converter.dijkstra_on_map(costmap, 5, 10, 35, 15)
+    for cost_to_go in [None, fast_marching(costmap, 35, 15)]:
+        path = theta_star(costmap, 5, 10, 35, 15, cost_to_go)
+        assert path[0] == (35, 15)
+        assert path[-1] == (5, 10)
+        assert len(path) < 6
+        for p1, p2 in zip(path[:-1], path[1:]):
+            assert line_of_sight(costmap, p1, p2)
+        cost = sum(line_cost(costmap, p1, p2)
+                   for p1, p2 in zip(path[:-1], path[1:]))
+        cost_dijkstra = sum(line_cost(costmap, p1, p2)
+                            for p1, p2 in zip(
+                                path_dijkstra[:-1], path_dijkstra[1:]))
+        assert cost < cost_dijkstra
+
+    costmap[:, 20] = np.inf
+    with pytest.raises(ValueError):
+        converter.theta_star_on_map(costmap, 5, 10, 35, 25)
+
+
 if __name__ == "__main__":
     test_symetrize()
     test_coordinates()
@@ -144,3 +404,11 @@ if __name__ == "__main__":
     test_workspace_to_graph()
     test_workspace_to_shortest_path()
     test_breadth_first_search()
+    test_sparse_graph()
+    test_dijkstra_on_large_map()
+    test_zero_cost_walls()
+    test_astar_and_bidirectional_dijkstra()
+    test_dstar_lite()
+    test_shortest_path_tree()
+    test_fast_marching()
+    test_theta_star()
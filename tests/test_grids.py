@@ -119,7 +119,36 @@ def test_regressed_grid():
     assert check_is_close(g2_y, g1_y, 1e-10)
 
 
+def test_bilinear_interpolation():
+    # bilinear functions are interpolated exactly, also outside the nodes
+    np.random.seed(0)
+    pixel_map = PixelMap(.1)
+    a = np.random.random(4)
+    X = np.random.uniform(-.7, .7, (50, 2))
+    Y = pixel_map.grid_to_world(np.array(list(product(
+        range(pixel_map.nb_cells_x), range(pixel_map.nb_cells_y)))))
+    values = (a[0] + a[1] * Y[:, 0] + a[2] * Y[:, 1] +
+              a[3] * Y[:, 0] * Y[:, 1]).reshape(
+        pixel_map.nb_cells_x, pixel_map.nb_cells_y)
+    f = PixelGridBilinearInterpolation(pixel_map, values)
+    assert_allclose(f.forward_batch(X)[:, 0],
+                    a[0] + a[1] * X[:, 0] + a[2] * X[:, 1] +
+                    a[3] * X[:, 0] * X[:, 1])
+    assert_allclose(f.jacobian_batch(X)[:, 0, 0], a[1] + a[3] * X[:, 1])
+    assert_allclose(f.jacobian_batch(X)[:, 0, 1], a[2] + a[3] * X[:, 0])
+
+    # nodes with a resolution per axis
+    x, y = np.linspace(0, 1, 5), np.linspace(-1, 1, 5)
+    values = np.add.outer(2 * x, 3 * y)
+    assert_allclose(
+        bilinear_interpolation(values, (0, -1), (.25, .5), X),
+        2 * X[:, 0] + 3 * X[:, 1])
+    assert_allclose(
+        bilinear_interpolation(values, (0, -1), (.25, .5), X, dy=1), 3)
+
+
 if __name__ == "__main__":
     test_pixelmap_random()
     test_pixelmap_meshgrid()
     test_regressed_grid()
+    test_bilinear_interpolation()
@@ -20,6 +20,7 @@
 import __init__
 from geometry.interpolation import *
 from numpy.testing import assert_allclose
+import pytest
 
 
 def test_linear_regression():
@@ -169,6 +170,88 @@ def test_mahalanobis_tools_test_rescale_mahalanobis():
     assert np.abs(desired_weight - scaled_weight) < 1e-7
 
 
+def test_lwr_batch():
+    np.random.seed(0)
+    X = np.random.uniform(-1, 1, (200, 2))
+    Y = np.sin(3 * X[:, 0]) * X[:, 1]
+    X_query = np.random.uniform(-1, 1, (30, 2))
+    D = 20 * np.eye(2)
+    values = [locally_weighted_regression(
+        x.copy(), X.copy(), Y, D, .1) for x in X_query]
+    assert_allclose(locally_weighted_regression_batch(
+        X_query, X, Y, D, .1), values)
+    assert_allclose(locally_weighted_regression_batch(
+        X_query, X, Y, D, .1, weight_threshold=1e-10), values, atol=1e-8)
+
+    # 1d data of test_lwr
+    value = locally_weighted_regression_batch(
+        np.array([[.3]]), np.array([-1, .5, 0, .5, 1]),
+        np.array([.1, .2, .3, .4, .5]), np.ones(1), .1)
+    assert np.abs(value[0] - 0.307063690815270) < 1e-7
+
+    # multiple outputs and no neighbors
+    f = LWR(2, 2)
+    f.X = [X, X]
+    f.Y = [Y, -Y]
+    f.D = [D, D]
+    f.ridge_lambda = [.1, .1]
+    f.weight_threshold = 1e-10
+    V = f.forward_batch(X_query)
+    assert_allclose(V[:, 0], values, atol=1e-8)
+    assert_allclose(V[:, 1], -V[:, 0])
+    assert_allclose(f(X_query[0]), V[0])
+    assert_allclose(f.forward_batch(np.array([[10., 10.]])), 0)
+
+    # Replacing the data rebuilds the KD-tree, even if the new arrays
+    # get the ids of the freed ones
+    for k in range(5):
+        X_new = np.random.uniform(-1, 1, (200, 2)) + k
+        f.X = [X_new, X_new]
+        f.Y = [Y, -Y]
+        del X_new
+        values = [locally_weighted_regression(
+            x.copy(), f.X[0].copy(), Y, D, .1) for x in X_query]
+        assert_allclose(f.forward_batch(X_query)[:, 0], values, atol=1e-8)
+
+
+def test_lwr_jacobian():
+    np.random.seed(0)
+    X = np.random.uniform(-1, 1, (200, 2))
+    X_query = np.random.uniform(-1, 1, (10, 2))
+    D = np.array([[20., 3.], [3., 10.]])
+    f = LWR(2, 2)
+    f.X = [X, X]
+    f.Y = [np.sin(3 * X[:, 0]) * X[:, 1], np.cos(X[:, 1])]
+    f.D = [D, D]
+    f.ridge_lambda = [.1, .1]
+    for weight_threshold in [None, 1e-12]:
+        f.weight_threshold = weight_threshold
+        V, J = f.evaluate_batch(X_query)
+        assert_allclose(V, f.forward_batch(X_query))
+        assert_allclose(J, f.jacobian_batch(X_query))
+        for x, J_x in zip(X_query, J):
+            assert_allclose(
+                J_x, finite_difference_jacobian(f, x), atol=1e-6)
+        v, J_0 = f.evaluate(X_query[0])
+        assert_allclose(v, V[0])
+        assert_allclose(J_0, J[0])
+        assert_allclose(f.jacobian(X_query[0]), J[0])
+
+    # LWR fills float arrays, the complex step would be dropped
+    with pytest.raises(ValueError):
+        finite_difference_jacobian(f, X_query[0], method="complex")
+
+    # 1d data of test_lwr
+    X = np.array([-1, .5, 0, .5, 1])
+    Y = np.array([.1, .2, .3, .4, .5])
+    value, J = locally_weighted_regression_batch(
+        np.array([[.3]]), X, Y, np.ones(1), .1, return_jacobian=True)
+    dx = 1e-6
+    values = [locally_weighted_regression_batch(
+        np.array([[.3 + e]]), X, Y, np.ones(1), .1) for e in [dx, -dx]]
+    assert_allclose(J[0, 0], (values[0] - values[1]) / (2 * dx), rtol=1e-6)
+
+
 # def test_signed_distance_interpolation():
 #     workspace = Workspace()
 #     workspace.obstacles = [Circle(origin=[.0, .0], radius=0.1)]
@@ -196,3 +279,5 @@ if __name__ == "__main__":
     # test_mahalanobis_tools_basic_square_distance()
     # test_mahalanobis_tools_neighborhood_distance_threshold()
     # test_mahalanobis_tools_test_rescale_mahalanobis()
+    test_lwr_batch()
+    test_lwr_jacobian()
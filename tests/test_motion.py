@@ -22,9 +22,11 @@ from motion.trajectory import *
 from motion.cost_terms import *
 from motion.objective import *
 from motion.control import *
+from optimization import algorithms
 import time
 from numpy.linalg import norm
 from numpy.testing import assert_allclose
+from test_differentiable_geometry import check_batch_against_single_point
 
 np.random.seed(0)
 
@@ -633,6 +635,182 @@ def test_trajectory_objective():
     assert check_hessian_against_finite_difference(objective, False, 1e-3)
 
 
+def test_sparse_hessian():
+    np.random.seed(0)
+    problem = MotionOptimization2DCostMap(T=20)
+    network = problem.function_network
+    x = np.random.random(network.input_dimension())
+
+    # Dense assembly clique by clique
+    dim = 3 * problem.config_space_dim
+    H_dense = np.zeros((network.input_dimension(), network.input_dimension()))
+    for t, x_t in enumerate(network.all_cliques(x)):
+        c_id = t * problem.config_space_dim
+        for f in network._functions[t]:
+            H_dense[c_id:c_id + dim, c_id:c_id + dim] += f.hessian(x_t)
+
+    H_sparse = network.hessian_sparse(x)
+    assert sparse.issparse(H_sparse)
+    assert_allclose(H_sparse.toarray(), H_dense)
+    assert_allclose(network.hessian(x), H_dense)
+
+    # Entries are only non zero in the band of the cliques
+    rows, cols = H_sparse.nonzero()
+    assert np.all(np.abs(rows - cols) < dim)
+
+    xi = x[problem.config_space_dim:]
+    H_active = problem.objective.hessian_sparse(xi)
+    assert sparse.issparse(H_active)
+    assert_allclose(H_active.toarray(), problem.objective.hessian(xi))
+
+
+def test_hessian_vector_product():
+    np.random.seed(0)
+    problem = MotionOptimization2DCostMap(T=20)
+    problem.add_all_terms()
+    network = problem.function_network
+    network.register_function_for_clique(
+        3, SquaredNormAcceleration(2, problem.dt))
+    x = np.random.random(network.input_dimension())
+    v = np.random.random(network.input_dimension())
+    assert_allclose(network.hessian_vector_product(x, v),
+                    network.hessian_sparse(x) @ v, rtol=1e-9)
+
+    objective = problem.objective
+    xi, v_xi = x[problem.config_space_dim:], v[problem.config_space_dim:]
+    assert_allclose(objective.hessian_vector_product(xi, v_xi),
+                    objective.hessian_sparse(xi) @ v_xi, rtol=1e-9)
+
+
+def test_cost_terms_batch():
+    np.random.seed(0)
+    workspace = Workspace()
+    for center, radius in sample_circles(nb_circles=10):
+        workspace.obstacles.append(Circle(center, radius))
+    sdf = SignedDistanceWorkspaceMap(workspace)
+    barrier = LogBarrierFunction()
+    barrier.set_mu(20.)
+    terms = [
+        SquaredNormVelocity(2, .1),
+        SquaredNormAcceleration(2, .1),
+        barrier,
+        BoundBarrier(np.array([0, 0]), np.array([1, 1])),
+        sdf,
+        SimplePotential2D(sdf),
+        CostGridPotential2D(sdf, 10, 0.1, 1.),
+        Compose(barrier, sdf)]
+    for phi in terms:
+        print("Check batch of {}".format(type(phi).__name__))
+        assert check_batch_against_single_point(phi)
+
+    # Out of the bound barrier limits
+    f = BoundBarrier(np.array([0, 0]), np.array([1, 1]))
+    X = np.array([[-.1, .5], [.5, 1.1]])
+    assert np.all(np.isinf(f.forward_batch(X)))
+    assert_allclose(f.jacobian_batch(X), np.zeros((2, 1, 2)))
+    assert_allclose(f.hessian_batch(X), np.zeros((2, 2, 2)))
+
+
+def test_vectorized_cliques():
+    np.random.seed(0)
+    problem = MotionOptimization2DCostMap(
+        T=30, q_init=np.array([-.4, .4]), q_goal=np.array([.4, .4]))
+    network = problem.function_network
+
+    # Register the same function twice
+    f = Scale(SquaredNormAcceleration(2, problem.dt), .5)
+    network.register_function_for_all_cliques(f)
+    network.register_function_for_all_cliques(f)
+
+    trajectory = linear_interpolation_trajectory(
+        problem.q_init, problem.q_goal, problem.T)
+    x = trajectory.x() + .01 * np.random.random(trajectory.x().size)
+
+    # Evaluate every function clique by clique
+    dim = network._clique_dim
+    v = 0.
+    J = np.zeros(x.size)
+    H = np.zeros((x.size, x.size))
+    for t, x_t in enumerate(network.all_cliques(x)):
+        c_id = t * problem.config_space_dim
+        for f in network._functions[t]:
+            v += f.forward(x_t)
+            J[c_id:c_id + dim] += np.asarray(f.jacobian(x_t)).ravel()
+            H[c_id:c_id + dim, c_id:c_id + dim] += f.hessian(x_t)
+
+    assert abs(network.forward(x) - v) < 1e-8 * abs(v)
+    assert_allclose(np.asarray(network.jacobian(x)).ravel(), J, atol=1e-8)
+    assert_allclose(network.hessian(x), H, atol=1e-8)
+
+    # The terms for all cliques are compiled once per registration
+    plan = network.all_cliques_plan()
+    assert network.all_cliques_plan() is plan
+    network.register_function_for_all_cliques(f)
+    assert network.all_cliques_plan() is not plan
+
+
+def test_value_grad_hess():
+    np.random.seed(0)
+    problem = MotionOptimization2DCostMap(
+        T=20, q_init=np.array([-.4, .4]), q_goal=np.array([.4, .4]))
+    objective = problem.objective
+    network = problem.function_network
+    xi = linear_interpolation_trajectory(
+        problem.q_init, problem.q_goal, problem.T).active_segment()
+
+    # Count the evaluations of the network
+    nb_calls = [0]
+    value_grad_hess = network.value_grad_hess
+
+    def counted_value_grad_hess(*args):
+        nb_calls[0] += 1
+        return value_grad_hess(*args)
+    network.value_grad_hess = counted_value_grad_hess
+
+    v, g, H = objective.value_grad_hess(xi)
+    assert nb_calls[0] == 1
+    assert v == objective.forward(xi)
+    assert_allclose(g, objective.gradient(xi))
+    assert_allclose(H.toarray(), objective.hessian(xi))
+    assert nb_calls[0] == 1
+
+    # Separate callbacks at a new point share the memo
+    xi_2 = xi + .01 * np.random.random(xi.size)
+    objective.forward(xi_2)
+    objective.gradient(xi_2)
+    objective.hessian_sparse(xi_2)
+    objective.forward(xi_2)
+    objective.gradient(xi_2)
+    assert nb_calls[0] == 3
+    x_full = objective.full_vector(xi_2)
+    assert abs(objective.forward(xi_2) - value_grad_hess(x_full)[0]) < 1e-10
+
+    # Registering a function resets the memo
+    f = Scale(SquaredNormAcceleration(2, problem.dt), 1.)
+    network.register_function_for_all_cliques(f)
+    v_2 = objective.forward(xi_2)
+    assert nb_calls[0] == 4
+    assert abs(v_2 - value_grad_hess(x_full)[0]) < 1e-10
+
+    # Modifying it in place requires to invalidate
+    f._alpha = 3.
+    assert objective.forward(xi_2) == v_2
+    objective.invalidate()
+    v_3 = objective.forward(xi_2)
+    assert nb_calls[0] == 5
+    assert abs(v_3 - value_grad_hess(x_full)[0]) < 1e-10
+    assert v_3 > v_2
+
+    # Newton evaluates the value and gradient once per point and
+    # the hessian once per iteration
+    nb_calls[0] = 0
+    trajectory = linear_interpolation_trajectory(
+        problem.q_init, problem.q_goal, problem.T)
+    res = algorithms.newton_optimize_trajectory(
+        objective, trajectory, maxiter=5)
+    assert nb_calls[0] == res.nfev + res.nit
+
+
 def test_optimize():
     print("Check Motion Optimization (optimize)")
     q_init = np.zeros(2)
@@ -678,5 +856,10 @@ if __name__ == "__main__":
     test_linear_interpolation_optimal_potential()
     # test_smoothness_metric()
     # test_trajectory_objective()
+    # test_sparse_hessian()
+    # test_hessian_vector_product()
+    # test_cost_terms_batch()
+    # test_vectorized_cliques()
+    # test_value_grad_hess()
     # test_optimize()
     # test_trajectory_following()
@@ -24,6 +24,9 @@
 from __init__ import *
 from planning.mdp import *
 from planning.algorithms import *
+from numpy.testing import assert_allclose
+import numpy as np
+import pytest
 
 sequential_decision_environment_1 = GridMDP([[-0.1, -0.1, -0.1, +1],
                                              [-0.1, None, -0.1, -1],
@@ -169,3 +172,127 @@ def test_transition_model():
                                    (0.2, 'b'), (0.1, 'c'), (0.1, 'd')]
     assert mdp.T("c", "plan1") == [(0.3, 'a'),
                                    (0.5, 'b'), (0.1, 'c'), (0.1, 'd')]
+
+
+def test_transition_matrices():
+    mdp = sequential_decision_environment
+    actions, P, available = mdp.transition_matrices()
+    assert actions == [(1, 0), (0, 1), (-1, 0), (0, -1), None]
+    assert available.shape == (5, len(mdp.states))
+    for s in mdp.states:
+        i = mdp.state_index(s)
+        assert mdp.indexed_states()[i] == s
+        for k, a in enumerate(actions):
+            assert available[k, i] == (a in mdp.actions(s))
+            if available[k, i]:
+                row = P[k][i].toarray().ravel()
+                assert_allclose(row.sum(), sum(p for p, _ in mdp.T(s, a)))
+                for p, s1 in mdp.T(s, a):
+                    assert row[mdp.state_index(s1)] >= p
+    assert_allclose(mdp.reward_vector(),
+                    [mdp.R(s) for s in mdp.indexed_states()])
+
+
+def test_value_iteration_sparse():
+    np.random.seed(0)
+    grid = np.random.uniform(-1, -.01, (20, 25))
+    grid[np.random.random(grid.shape) < .2] = 0  # obstacles
+    grid[0, 0] = 10.
+    random_environment = GridMDP(grid.tolist(), terminals=[(0, 19)])
+    for mdp in [sequential_decision_environment,
+                sequential_decision_environment_1,
+                sequential_decision_environment_2,
+                sequential_decision_environment_3,
+                random_environment]:
+        U = value_iteration(mdp, .01)
+        U_sparse = value_iteration(mdp, .01, method="sparse")
+        assert U_sparse == U
+        assert best_policy_sparse(mdp, U_sparse) == best_policy(mdp, U)
+
+    # MDP without states
+    mdp = GridMDP([[None, None]], terminals=[])
+    assert value_iteration(mdp, .01, method="sparse") == {}
+
+
+def test_policy_iteration_sparse():
+    environments = [sequential_decision_environment,
+                    sequential_decision_environment_1,
+                    sequential_decision_environment_2]
+    for mdp in environments:
+        assert (policy_iteration(mdp, method="sparse") ==
+                policy_iteration(mdp))
+
+    # the utilities of the policy are the optimal utilities
+    mdp = sequential_decision_environment_3
+    pi = policy_iteration(mdp, method="sparse")
+    actions = mdp.transition_matrices()[0]
+    pi_index = np.array([actions.index(pi[s])
+                         for s in mdp.indexed_states()])
+    U = value_iteration(mdp, 1e-10, method="sparse")
+    assert_allclose(policy_evaluation_sparse(pi_index, mdp),
+                    [U[s] for s in mdp.indexed_states()], atol=1e-8)
+
+
+def test_grid_mdp_from_array():
+    np.random.seed(0)
+    grid = np.random.uniform(-1, -.01, (20, 25))
+    grid[np.random.random(grid.shape) < .2] = np.nan  # obstacles
+    grid[0, 0] = 10.
+    terminals = [(0, 19), (10, 10)]
+    grid[9, 10] = -1.
+    mdp_list = GridMDP(np.where(np.isnan(grid), None, grid).tolist(),
+                       terminals=terminals)
+    mdp_array = GridMDP(grid, terminals=terminals)
+    assert mdp_array.states == mdp_list.states
+    assert mdp_array.reward == mdp_list.reward
+    assert (mdp_array.rows, mdp_array.cols) == (20, 25)
+    for s in mdp_list.states:
+        for a in mdp_list.actions(s):
+            assert mdp_array.T(s, a) == mdp_list.T(s, a)
+    U = value_iteration(mdp_list, .01)
+    U_array = value_iteration(mdp_array, .01, method="sparse")
+    assert U_array == U
+    pi = best_policy_sparse(mdp_array, U_array)
+    assert pi == best_policy(mdp_list, U)
+    assert mdp_array.to_arrows(pi) == mdp_list.to_arrows(pi)
+    assert mdp_array.to_grid(U)[0][0] == 10.
+
+    # obstacles given as a mask
+    occupancy = np.isnan(grid)
+    mdp = GridMDP(np.where(occupancy, -1., grid), terminals=terminals,
+                  obstacles=occupancy)
+    assert mdp.states == mdp_list.states
+
+
+def test_value_iteration_asynchronous():
+    np.random.seed(0)
+    grid = np.random.uniform(-1, -.01, (15, 15))
+    grid[np.random.random(grid.shape) < .2] = np.nan  # obstacles
+    grid[0, 0] = 10.
+    environments = [sequential_decision_environment,
+                    sequential_decision_environment_3,
+                    GridMDP(grid, terminals=[(0, 14)])]
+    for mdp in environments:
+        U_star = value_iteration(mdp, 1e-10, method="sparse")
+        pi_star = best_policy(mdp, U_star)
+        U, nb_backups = value_iteration(
+            mdp, .001, method="dict", return_backups=True)
+        for method in ["gauss_seidel", "prioritized"]:
+            U, backups = value_iteration(
+                mdp, .001, method=method, return_backups=True)
+            assert backups < nb_backups
+            assert max(abs(U[s] - U_star[s]) for s in mdp.states) < .001
+            pi = best_policy(mdp, U)
+            for s in mdp.states:
+                if mdp.actions(s) != [None]:
+                    assert_allclose(
+                        expected_utility(pi[s], s, U_star, mdp),
+                        expected_utility(pi_star[s], s, U_star, mdp))
+    with pytest.raises(ValueError):
+        value_iteration(sequential_decision_environment, method="unknown")
+
+    # MDP without states
+    mdp = GridMDP([[None, None]], terminals=[])
+    for method in ["gauss_seidel", "prioritized"]:
+        assert value_iteration(
+            mdp, .001, method=method, return_backups=True) == ({}, 0)
@@ -153,11 +153,45 @@ def test_axis_aligned_box():
         sdf2 = box2.dist_from_border(p)
         assert np.fabs(sdf1 - sdf2) < 1.e-06
 
-    # TODO make code parallelizable
-    # grid = EnvBox().stacked_meshgrid()
-    # sdf1 = box1.dist_from_border(grid)
-    # sdf2 = box2.dist_from_border(grid)
-    # assert_allclose(sdf1, sdf2)
+    grid = EnvBox().stacked_meshgrid()
+    sdf1 = box1.dist_from_border(grid)
+    sdf2 = box2.dist_from_border(grid)
+    assert_allclose(sdf1, sdf2, atol=1e-12)
+
+
+def test_oriented_box():
+    np.random.seed(0)
+    dimensions = np.array([.4, .2])
+    origin = np.array([.1, -.1])
+    orientation = rotation_matrix_2d_radian(.3)
+    box = OrientedBox(origin, dimensions, orientation)
+    aligned_box = AxisAlignedBox(dim=dimensions)
+    f = SignedDistance2DMap(box)
+    for _ in range(100):
+        p = np.random.random(2) - .5
+        p_aligned = np.dot(orientation.T, p - origin)
+        if np.min(np.abs(np.abs(p_aligned) - .5 * dimensions)) < 1e-3:
+            continue  # too close to a kink for finite differences
+        assert_allclose(box.dist_from_border(p),
+                        aligned_box.dist_from_border(p_aligned))
+        assert box.is_inside(p) == aligned_box.is_inside(p_aligned)
+        assert check_is_close(
+            f.jacobian(p), finite_difference_jacobian(f, p), 1e-4)
+        assert check_is_close(
+            f.hessian(p), finite_difference_hessian(f, p), 1e-4)
+
+    # Single points, stacked points and meshgrid agree
+    points = np.random.random((20, 2)) - .5
+    for shape in [box, aligned_box]:
+        g = shape.dist_gradient_batch(points)
+        H = shape.dist_hessian_batch(points)
+        for i, p in enumerate(points):
+            assert_allclose(g[i], shape.dist_gradient(p))
+            assert_allclose(H[i], shape.dist_hessian(p))
+        grid = EnvBox().stacked_meshgrid(10)
+        sdf = shape.dist_from_border(grid)
+        for i, j in product(range(10), range(10)):
+            assert_allclose(sdf[i, j], shape.dist_from_border(grid[:, i, j]))
 
 
 def test_ellipse():
@@ -234,6 +268,41 @@ def test_hexagon():
     assert h.is_inside(np.array([0., -.1]))
 
 
+def test_non_convex_polygon():
+    verticies = [np.array(v, dtype=float) for v in [
+        [0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]]]
+    polygon = Polygon(verticies=verticies)
+    assert polygon.is_inside(np.array([.5, .5]))
+    assert polygon.is_inside(np.array([1.5, .5]))
+    assert polygon.is_inside(np.array([.5, 1.5]))
+    assert not polygon.is_inside(np.array([1.5, 1.5]))
+    assert not polygon.is_inside(np.array([-.5, .5]))
+    assert_allclose(polygon.dist_from_border(np.array([1.5, 1.5])), .5)
+    assert_allclose(polygon.dist_from_border(np.array([.9, .9])),
+                    -np.sqrt(.02))
+
+    # Single points, stacked points and meshgrid agree
+    np.random.seed(0)
+    points = 3. * np.random.random((50, 2)) - .5
+    g = polygon.dist_gradient_batch(points)
+    H = polygon.dist_hessian_batch(points)
+    for i, p in enumerate(points):
+        assert_allclose(g[i], polygon.dist_gradient(p))
+        assert_allclose(H[i], polygon.dist_hessian(p))
+    grid = EnvBox(np.array([1., 1.]), np.array([3., 3.])).stacked_meshgrid(10)
+    sdf = polygon.dist_from_border(grid)
+    inside = polygon.is_inside(grid)
+    for i, j in product(range(10), range(10)):
+        p = grid[:, i, j]
+        assert_allclose(sdf[i, j], polygon.dist_from_border(p))
+        assert inside[i, j] == polygon.is_inside(p)
+
+    # The hessian is the one of the distance to the reflex vertex
+    f = SignedDistance2DMap(polygon)
+    p = np.array([.9, .8])
+    assert check_is_close(f.hessian(p), finite_difference_hessian(f, p), 1e-4)
+
+
 def test_hexagon_jac():
     environment = EnvBox()
     polygon = hexagon(scale=.5)
@@ -332,6 +401,80 @@ def test_signed_disance_field_function():
         assert_allclose(sdf(p), workspace.min_dist(p)[0])
 
 
+def test_cached_sdf():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=5)
+    points = np.array([workspace.box.sample_uniform() for _ in range(100)])
+    for method in ["bilinear", "bicubic"]:
+        sdf = CachedSignedDistanceField(workspace, 150, method)
+        error = sdf.max_error()
+        assert error < 1e-2
+        d = workspace.min_dist_batch(points)[0]
+        assert_allclose(sdf.forward_batch(points)[:, 0], d, atol=error)
+        for p in points[:10]:
+            assert_allclose(
+                sdf.jacobian(p), finite_difference_jacobian(sdf, p),
+                atol=1e-6)
+            assert_allclose(sdf.jacobian_batch(p.reshape(1, 2))[0],
+                            sdf.jacobian(p))
+            assert_allclose(sdf.hessian_batch(p.reshape(1, 2))[0],
+                            sdf.hessian(p))
+        grid = workspace.box.stacked_meshgrid(10)
+        assert_allclose(sdf(grid), workspace.min_dist(grid)[0], atol=error)
+
+    # Bicubic derivatives match the exact field away from the kinks
+    sdf = CachedSignedDistanceField(workspace, 300)
+    exact = SignedDistanceWorkspaceMap(workspace)
+    p = workspace.box.origin + np.array([.3, .3])
+    assert_allclose(sdf.jacobian(p), exact.jacobian(p), atol=1e-3)
+
+    # The raster is recomputed when obstacles change
+    assert sdf.is_valid()
+    p = workspace.box.origin + np.array([.1, .1])
+    workspace.obstacles.append(Circle(p, .1))
+    assert not sdf.is_valid()
+    assert_allclose(sdf(p), -.1, atol=1e-2)
+    assert sdf.is_valid()
+
+
+def test_obstacle_grid_index():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=30)
+    workspace.obstacles += sample_box_workspaces(20).obstacles
+    workspace.obstacles += sample_box_workspaces(
+        20, oriented=True).obstacles
+    workspace.obstacles.append(hexagon(.1, [.2, .2]))
+    workspace.obstacles.append(Segment(p1=[0., 0.], p2=[.2, -.1]))
+    for center, radius in sample_circles(nb_circles=5):
+        workspace.obstacles.append(Circle(center, radius))
+    index = workspace.spatial_index()
+    assert index is not None
+    assert index.nb_candidates() < workspace.nb_obstacles()
+
+    # Same distances and ids as the brute force loop
+    points = 1.5 * np.random.random((200, 2)) - .75
+    for p in points:
+        [d1, i1] = workspace.min_dist(p)
+        [d2, i2] = workspace.min_dist_brute_force(p)
+        assert d1 == d2 and i1 == i2
+        assert workspace.in_collision(p) == (d2 < 0.)
+    [d1, i1] = workspace.min_dist_batch(points)
+    [d2, i2] = workspace.min_dist_brute_force(points.T.reshape(2, -1, 1))
+    assert np.array_equal(d1, d2.ravel())
+    assert np.array_equal(i1, i2.ravel())
+    grid = workspace.box.stacked_meshgrid(30)
+    [d1, i1] = workspace.min_dist(grid)
+    [d2, i2] = workspace.min_dist_brute_force(grid)
+    assert np.array_equal(d1, d2)
+    assert np.array_equal(i1, i2)
+
+    # The index is rebuilt when obstacles change
+    workspace.obstacles.append(Circle(np.array([.45, .45]), .01))
+    assert workspace.spatial_index() is not index
+    assert workspace.min_dist(np.array([.45, .45]))[1] == (
+        workspace.min_dist_brute_force(np.array([.45, .45]))[1])
+
+
 if __name__ == "__main__":
 
     # test_circle()
@@ -341,12 +484,16 @@ if __name__ == "__main__":
     # test_polygon()
     # test_axis_aligned_box()
     # test_inside_box()
+    # test_oriented_box()
     # test_ellipse()
     # test_polygon()
     # test_hexagon()
+    # test_non_convex_polygon()
     # test_sdf_derivatives()
     # test_sdf_workspace()
     # test_meshgrid()
     # test_sdf_grid()
     # test_workspace_to_occupancy_map()
-    test_signed_disance_field_function()
+    # test_signed_disance_field_function()
+    # test_cached_sdf()
+    test_obstacle_grid_index()